@@ -0,0 +1,333 @@
+"""
+allocation.py
+===
+
+Allocate the units of a basket to special offers, so that each unit
+counts towards at most one special offer.
+
+By default, each special offer is evaluated against the whole basket, so
+the same unit can trigger (or be discounted by) several special offers.
+An Allocator instead assigns each unit to at most one special offer,
+choosing the allocation with the largest total discount.
+
+Special offers only compete with each other if they share a product, so
+the special offers of a basket are split into groups that don't share
+products, and each group is solved on its own, by dynamic programming
+over the special offers and the units that are left. Solving a group
+takes time exponential in its number of products, so each basket has a
+budget (a number of states and a time limit). A group that exceeds the
+budget is allocated greedily instead: the largest discount that is left
+is taken first, until no discount is left, or until a second time limit
+passes.
+
+A special offer without triggers (e.g. FractionOfPrice) discounts each
+unit on its own, so it only has one allocation, of all of its units.
+These special offers are solved after the others, so they get the units
+that are left.
+"""
+
+import logging
+from time import perf_counter
+
+
+logger = logging.getLogger(__name__)
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+def _group_special_offers(positioned_special_offers):
+    """
+    Split (position, special_offer) pairs into lists of pairs that don't
+    share a product with any other list, each in position order
+    """
+    group_by_product = {}
+    groups = []
+
+    for positioned_special_offer in positioned_special_offers:
+        _, special_offer = positioned_special_offer
+        group = [positioned_special_offer]
+
+        for product in special_offer._products:
+            other_group = group_by_product.get(product)
+
+            if other_group is not None and other_group is not group:
+                group.extend(other_group)
+                other_group.clear()
+
+        for _, other_special_offer in group:
+            for product in other_special_offer._products:
+                group_by_product[product] = group
+
+        groups.append(group)
+
+    return [sorted(group) for group in groups if group]
+
+
+class Allocator:
+    """
+    Allocates basket units to special offers (see the module docstring)
+
+    max_states: Largest number of dynamic programming states per basket
+    max_seconds: Longest time to spend on a basket before the rest of it
+                 is allocated greedily (which is given the same time
+                 again)
+    cache_size: Largest number of basket allocations to cache (the cache
+                is cleared when it is full)
+    """
+
+    # Largest number of special offers in a group that is solved by
+    # dynamic programming (each one is a level of recursion)
+    _MAX_GROUP_SIZE = 256
+
+    def __init__(self, max_states=100000, max_seconds=0.05, cache_size=1024):
+        self._max_states = max_states
+        self._max_seconds = max_seconds
+        self._cache_size = cache_size
+        self._cache = {}
+
+    def __repr__(self):
+        return (
+            f"Allocator(max_states={self._max_states!r}, "
+            f"max_seconds={self._max_seconds!r}, "
+            f"cache_size={self._cache_size!r})")
+
+    def __reduce__(self):
+        # The cache isn't pickled (e.g. when sent to a worker process)
+        return (
+            type(self),
+            (self._max_states, self._max_seconds, self._cache_size),
+        )
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def get_discounts(
+            self,
+            quantity_by_product,
+            positioned_special_offers,
+            in_pence=False,
+    ):
+        """
+        Get a tuple of the discounts with a positive value, in the order
+        of the special offers' positions, with each unit of the basket
+        allocated to at most one special offer
+        """
+        positioned_special_offers = tuple(positioned_special_offers)
+
+        key = (
+            frozenset(quantity_by_product.items()),
+            tuple(s for _, s in positioned_special_offers),
+            in_pence,
+        )
+        discounts = self._cache.get(key)
+
+        if discounts is None:
+            if len(self._cache) >= self._cache_size:
+                self._cache.clear()
+
+            discounts = self._cache[key] = self._allocate(
+                quantity_by_product,
+                positioned_special_offers,
+                in_pence,
+            )
+
+        return discounts
+
+    def _allocate(
+            self,
+            quantity_by_product,
+            positioned_special_offers,
+            in_pence,
+    ):
+        deadline = perf_counter() + self._max_seconds
+        greedy_deadline = None
+        num_states = 0
+        positioned_discounts = []
+
+        for group in _group_special_offers(positioned_special_offers):
+            try:
+                group_discounts, group_num_states = self._solve(
+                    group,
+                    quantity_by_product,
+                    in_pence,
+                    self._max_states - num_states,
+                    deadline,
+                )
+            except _BudgetExceeded:
+                logger.debug(
+                    "Allocation budget exceeded for %d special offers, "
+                    "allocating greedily",
+                    len(group),
+                )
+
+                # The greedy allocations of the basket share one more
+                # time limit, from when the first of them starts
+                if greedy_deadline is None:
+                    greedy_deadline = perf_counter() + self._max_seconds
+
+                group_discounts = self._solve_greedy(
+                    group,
+                    quantity_by_product,
+                    in_pence,
+                    greedy_deadline,
+                )
+            else:
+                num_states += group_num_states
+
+            positioned_discounts.extend(group_discounts)
+
+        positioned_discounts.sort(key=lambda item: item[0])
+
+        return tuple(discount for _, discount in positioned_discounts)
+
+    @classmethod
+    def _solve(
+            cls,
+            group,
+            quantity_by_product,
+            in_pence,
+            max_states,
+            deadline,
+    ):
+        """
+        Get the (position, discount) pairs of the best allocation for
+        group, and the number of states it took, raising _BudgetExceeded
+        if it takes more than max_states states or passes deadline
+        """
+        if len(group) > cls._MAX_GROUP_SIZE:
+            raise _BudgetExceeded
+
+        # Special offers without triggers last (see the module docstring)
+        group = sorted(
+            group,
+            key=lambda item: not item[1].rule.trigger_sets,
+        )
+
+        products = list(dict.fromkeys(
+            product
+            for _, special_offer in group
+            for product in special_offer._products))
+        index_by_product = {
+            product: index
+            for index, product in enumerate(products)}
+
+        # Best (total value, (position, discount) pairs) by (special
+        # offer index, quantities left)
+        best_by_state = {}
+
+        def solve(offer_ix, quantities):
+            if offer_ix == len(group):
+                return 0, ()
+
+            state = offer_ix, quantities
+            best = best_by_state.get(state)
+
+            if best is not None:
+                return best
+
+            if len(best_by_state) >= max_states or perf_counter() > deadline:
+                raise _BudgetExceeded
+
+            # Not using the special offer at all
+            best = solve(offer_ix + 1, quantities)
+            best_value = best[0]
+
+            position, special_offer = group[offer_ix]
+
+            for used, key in special_offer._iter_allocations(
+                dict(zip(products, quantities)),
+            ):
+                # A special offer can have an allocation per unit
+                if perf_counter() > deadline:
+                    raise _BudgetExceeded
+
+                discount = special_offer._get_discount_by_key(key, in_pence)
+
+                if not discount.value > 0:
+                    continue
+
+                quantities_left = list(quantities)
+
+                for product, quantity in used.items():
+                    quantities_left[index_by_product[product]] -= quantity
+
+                value, positioned_discounts = solve(
+                    offer_ix + 1,
+                    tuple(quantities_left),
+                )
+                value += discount.value
+
+                if value > best_value:
+                    best_value = value
+                    best = (
+                        value,
+                        ((position, discount),) + positioned_discounts,
+                    )
+
+            best_by_state[state] = best
+            return best
+
+        _, positioned_discounts = solve(
+            0,
+            tuple(quantity_by_product.get(p, 0) for p in products),
+        )
+
+        return positioned_discounts, len(best_by_state)
+
+    @staticmethod
+    def _solve_greedy(group, quantity_by_product, in_pence, deadline):
+        """
+        Get the (position, discount) pairs of a greedy allocation for
+        group: the special offer allocation with the largest discount is
+        taken first, then the largest of the rest, and so on. After
+        deadline, the largest allocation found so far is taken, and the
+        rest of the group is left out.
+        """
+        quantities_left = {
+            product: quantity_by_product.get(product, 0)
+            for _, special_offer in group
+            for product in special_offer._products}
+        group_left = list(group)
+        positioned_discounts = []
+        is_late = False
+
+        while group_left and not is_late:
+            best = None
+
+            for group_ix, (position, special_offer) in enumerate(
+                group_left,
+            ):
+                for used, key in special_offer._iter_allocations(
+                    quantities_left,
+                ):
+                    if perf_counter() > deadline:
+                        is_late = True
+                        break
+
+                    discount = special_offer._get_discount_by_key(
+                        key,
+                        in_pence,
+                    )
+
+                    if discount.value > 0 and (
+                            best is None or discount.value > best[0].value
+                    ):
+                        best = discount, used, group_ix, position
+
+                if is_late:
+                    break
+
+            if best is None:
+                break
+
+            discount, used, group_ix, position = best
+
+            for product, quantity in used.items():
+                quantities_left[product] -= quantity
+
+            del group_left[group_ix]
+            positioned_discounts.append((position, discount))
+
+        return positioned_discounts
@@ -0,0 +1,173 @@
+"""
+basket.py
+===
+
+A mutable basket, for baskets that change one product at a time (e.g.
+a live checkout).
+
+The original total and the discount of each special offer are kept up
+to date as products are added and removed. Only the special offers that
+reference the changed product are re-evaluated, so each change costs
+O(affected offers) rather than O(basket + special offers), and reading
+the totals is O(1).
+"""
+
+from collections.abc import Mapping
+
+from special_offer import get_special_offers_by_product
+from stats import get_active_stats
+
+
+class Basket(Mapping):
+    """
+    Quantities by product, priced incrementally
+
+    A Basket is a read-only mapping of product to quantity, so it can
+    also be passed anywhere a Counter basket is accepted. Use add and
+    remove to change it.
+
+    If in_pence is true, the totals and discount values are integer
+    amounts in pence, rather than Decimal amounts in pounds (see
+    money.py).
+    """
+
+    def __init__(
+            self,
+            special_offers,
+            special_offers_by_product=None,
+            in_pence=False,
+    ):
+        if special_offers_by_product is None:
+            special_offers_by_product = get_special_offers_by_product(
+                special_offers,
+            )
+
+        self._special_offers_by_product = special_offers_by_product
+        self._in_pence = in_pence
+
+        self._quantity_by_product = {}
+        self._original_total = 0
+
+        # The current discount of each special offer referencing a
+        # product in the basket, by the offer's position
+        self._discount_by_position = {}
+        self._total_discount = 0
+
+    def __repr__(self):
+        return (
+            f"Basket(len={len(self)!r}, "
+            f"total={self.total!r})")
+
+    def __getitem__(self, product):
+        return self._quantity_by_product[product]
+
+    def __iter__(self):
+        return iter(self._quantity_by_product)
+
+    def __len__(self):
+        return len(self._quantity_by_product)
+
+    @property
+    def original_total(self):
+        return self._original_total
+
+    @property
+    def total_discount(self):
+        return self._total_discount
+
+    @property
+    def total(self):
+        return self._original_total - self._total_discount
+
+    @property
+    def discounts(self):
+        """
+        The discounts with a positive value, in special offer order (the
+        same discounts as get_original_total_and_discounts)
+        """
+        discount_by_position = self._discount_by_position
+
+        return tuple(
+            discount_by_position[position]
+            for position in sorted(discount_by_position))
+
+    def _get_price(self, product):
+        return product.price_pence if self._in_pence else product.price
+
+    def _update_discounts(self, product):
+        """
+        Re-evaluate the special offers referencing product, adjusting the
+        total discount by the change in each offer's discount
+        """
+        quantity_by_product = self._quantity_by_product
+        discount_by_position = self._discount_by_position
+        total_discount = self._total_discount
+        stats = get_active_stats()
+
+        for position, special_offer in (
+                self._special_offers_by_product.get(product, ())):
+            old_discount = discount_by_position.pop(position, None)
+
+            if old_discount is not None:
+                total_discount -= old_discount.value
+
+            if stats is not None:
+                discount = stats.get_discount(
+                    position,
+                    special_offer,
+                    quantity_by_product,
+                    self._in_pence,
+                )
+            elif self._in_pence:
+                discount = special_offer.get_discount_pence(
+                    quantity_by_product,
+                )
+            else:
+                discount = special_offer.get_discount(quantity_by_product)
+
+            # As in get_original_total_and_discounts, only positive
+            # discounts are applied
+            if discount.value > 0:
+                discount_by_position[position] = discount
+                total_discount += discount.value
+
+        # When no discount applies, reset the total to avoid carrying
+        # e.g. Decimal("0E-2") around
+        self._total_discount = total_discount if discount_by_position else 0
+
+    def add(self, product, quantity=1):
+        if quantity < 1:
+            raise ValueError("quantity must be positive")
+
+        quantity_by_product = self._quantity_by_product
+
+        quantity_by_product[product] = (
+            quantity_by_product.get(product, 0) + quantity)
+
+        self._original_total += quantity * self._get_price(product)
+        self._update_discounts(product)
+
+    def remove(self, product, quantity=1):
+        """
+        Raises KeyError if the product is not in the basket, and
+        ValueError if quantity is more than the quantity in the basket
+        """
+        if quantity < 1:
+            raise ValueError("quantity must be positive")
+
+        quantity_by_product = self._quantity_by_product
+        new_quantity = quantity_by_product[product] - quantity
+
+        if new_quantity < 0:
+            raise ValueError("quantity is more than the basket contains")
+        elif new_quantity == 0:
+            del quantity_by_product[product]
+        else:
+            quantity_by_product[product] = new_quantity
+
+        if quantity_by_product:
+            self._original_total -= quantity * self._get_price(product)
+        else:
+            self._original_total = 0
+
+        self._update_discounts(product)
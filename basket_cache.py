@@ -0,0 +1,102 @@
+"""
+basket_cache.py
+===
+
+A size-bounded LRU cache of basket pricing results, for traffic where
+the same baskets are priced again and again.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple(
+    "CacheInfo",
+    ("hits", "misses", "evictions", "size", "max_size"),
+)
+
+
+def get_basket_key(quantity_by_product, in_pence=False):
+    """
+    Get a key for a basket that doesn't depend on the order its
+    products were added in, or on products with a zero quantity (e.g.
+    left in a Counter after they were removed)
+    """
+    return (
+        frozenset(i for i in quantity_by_product.items() if i[1] > 0),
+        in_pence,
+    )
+
+
+class BasketCache:
+    """
+    Pricing results by basket key (see get_basket_key), for up to
+    max_size baskets. The least recently used result is evicted first.
+
+    Each result is stored with the catalog snapshot it was priced with,
+    and is only returned for the same snapshot, so a result is never
+    returned for a different catalog (e.g. after a reload), even if it
+    was stored by a call that was in progress during the reload.
+    """
+
+    def __init__(self, max_size):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self._max_size = max_size
+        self._entry_by_key = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __repr__(self):
+        return f"BasketCache(max_size={self._max_size!r})"
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def get(self, catalog, key):
+        """
+        Get the result for key, priced with catalog, or None
+        """
+        with self._lock:
+            entry = self._entry_by_key.get(key)
+
+            if entry is not None and entry[0] is catalog:
+                self._entry_by_key.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+            return None
+
+    def put(self, catalog, key, result):
+        with self._lock:
+            entry_by_key = self._entry_by_key
+
+            entry_by_key[key] = (catalog, result)
+            entry_by_key.move_to_end(key)
+
+            if len(entry_by_key) > self._max_size:
+                entry_by_key.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """
+        Remove every result (the counters are kept)
+        """
+        with self._lock:
+            self._entry_by_key.clear()
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self._entry_by_key),
+                max_size=self._max_size,
+            )
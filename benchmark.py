@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+===
+
+Benchmark catalog loading, special offer parsing, basket pricing and
+bill formatting, against synthetic catalogs generated with the
+factories in factories.py.
+
+Each benchmark is run at each catalog size, and reports operations per
+second and the peak memory allocated while it ran (measured with
+tracemalloc, in a separate run, as tracing slows the code down). The
+results are written to a JSON file, so that runs can be compared over
+time.
+
+Generating a catalog of 1M products takes a few minutes. Use --data-dir
+to keep the generated catalogs between runs (they are the same for the
+same size and seed).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+
+import factory
+import factory.random
+
+from bill_writer import BillFormat, BillWriter
+from factories import (
+    FractionOfPriceFactory,
+    FractionOfPricePerQuantityFactory,
+    ProductFactory,
+    fake,
+)
+from price_basket import (
+    get_original_total_and_discounts,
+    load_json_catalog,
+    load_json_catalog_shards,
+    price_baskets,
+)
+from product import get_product_table_from_json, get_products_from_json
+from special_offer import get_special_offers_from_json
+
+
+BenchmarkResult = namedtuple(
+    "BenchmarkResult",
+    (
+        "name",
+        "num_products",
+        "num_special_offers",
+        "ops",
+        "seconds",
+        "ops_per_sec",
+        "peak_memory_bytes",
+    ),
+)
+
+# Largest number of products in a basket
+_MAX_BASKET_LEN = 10
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark price_basket.py against synthetic catalogs"),
+    )
+
+    parser.add_argument(
+        "--products",
+        dest="num_products_seq",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[1000, 100000, 1000000],
+        help="Catalog sizes (number of products) to benchmark",
+    )
+
+    parser.add_argument(
+        "--max-special-offers",
+        type=int,
+        default=100000,
+        help=(
+            "Largest number of special offers in a catalog (each "
+            "catalog has one special offer per product, up to this "
+            "number)"),
+    )
+
+    parser.add_argument(
+        "--baskets",
+        dest="num_baskets",
+        type=int,
+        default=10000,
+        help="Number of baskets to price",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to run each benchmark (the best is kept)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for generating the catalogs and baskets",
+    )
+
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        help=(
+            "Directory to keep the generated catalogs in, so that they "
+            "are reused by later runs (by default, they are generated "
+            "in a temporary directory)"),
+    )
+
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help=(
+            "Path of the JSON results (default: "
+            "benchmark-<timestamp>.json)"),
+    )
+
+    args = parser.parse_args()
+
+    for value, name in (
+            (min(args.num_products_seq), "--products"),
+            (args.max_special_offers, "--max-special-offers"),
+            (args.num_baskets, "--baskets"),
+            (args.repeat, "--repeat"),
+    ):
+        if value < 1:
+            parser.error(f"{name} must be at least 1")
+
+    return args
+
+
+def _seed(seed):
+    fake.seed_instance(seed)
+    factory.random.reseed_random(seed)
+    ProductFactory.reset_sequence(force=True)
+
+
+def _generate_catalog(
+        products_path,
+        special_offers_path,
+        num_products,
+        num_special_offers,
+        seed,
+):
+    _seed(seed)
+
+    product_stubs = ProductFactory.stub_batch(num_products)
+
+    with open(products_path, "w") as file_obj:
+        json.dump(
+            list(map(ProductFactory.stub_to_dict, product_stubs)),
+            file_obj,
+        )
+
+    def sample_products(k):
+        return factory.Iterator(
+            fake.random.choices(product_stubs, k=k),
+            cycle=False,
+        )
+
+    # Fractions of price between 0 and 1, so that every discount is
+    # positive
+    fraction_of_price = factory.Faker(
+        'pydecimal',
+        left_digits=0,
+        right_digits=2,
+        positive=True,
+    )
+
+    num_fraction_of_price = num_special_offers // 2
+    num_per_quantity = num_special_offers - num_fraction_of_price
+
+    special_offer_dicts = list(map(
+        FractionOfPriceFactory.stub_to_dict,
+        FractionOfPriceFactory.stub_batch(
+            num_fraction_of_price,
+            discounted_product=sample_products(num_fraction_of_price),
+            fraction_of_price=fraction_of_price,
+        ),
+    ))
+
+    special_offer_dicts.extend(map(
+        FractionOfPricePerQuantityFactory.stub_to_dict,
+        FractionOfPricePerQuantityFactory.stub_batch(
+            num_per_quantity,
+            trigger_product=sample_products(num_per_quantity),
+            discounted_product=sample_products(num_per_quantity),
+            fraction_of_price=fraction_of_price,
+        ),
+    ))
+
+    fake.random.shuffle(special_offer_dicts)
+
+    with open(special_offers_path, "w") as file_obj:
+        json.dump(special_offer_dicts, file_obj)
+
+
+def _get_catalog_paths(
+        data_dir,
+        num_products,
+        num_special_offers,
+        seed,
+):
+    """
+    Get the paths of a generated catalog, generating it if it does not
+    exist yet
+    """
+    stem = f"{num_products}-{num_special_offers}-{seed}"
+
+    products_path = data_dir / f"products-{stem}.json"
+    special_offers_path = data_dir / f"special_offers-{stem}.json"
+
+    if not (products_path.exists() and special_offers_path.exists()):
+        _generate_catalog(
+            products_path,
+            special_offers_path,
+            num_products,
+            num_special_offers,
+            seed,
+        )
+
+    return products_path, special_offers_path
+
+
+def _get_baskets(catalog, num_baskets, seed):
+    rand = random.Random(seed)
+
+    # Only products with a special offer, so that the baskets have
+    # discounts to calculate
+    products = list(catalog.special_offers_by_product)
+
+    return [
+        Counter({
+            p: rand.randint(1, 9)
+            for p in rand.sample(
+                products,
+                min(rand.randint(1, _MAX_BASKET_LEN), len(products)),
+            )})
+        for _ in range(num_baskets)]
+
+
+def _time(func, repeat):
+    """
+    Call func repeat times, returning the fastest time in seconds
+    """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+
+        if best is None or seconds < best:
+            best = seconds
+
+    return best
+
+
+def _get_peak_memory(func):
+    """
+    Call func once, returning the peak memory (in bytes) allocated while
+    it ran
+    """
+    tracemalloc.start()
+
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def _get_benchmarks(
+        products_path,
+        special_offers_path,
+        catalog,
+        baskets,
+):
+    """
+    Yield (name, ops, func) triples, where func performs ops operations
+    """
+    def load_catalog():
+        load_json_catalog(products_path, special_offers_path)
+
+    def load_catalog_compact():
+        load_json_catalog(products_path, special_offers_path, True)
+
+    def load_catalog_async():
+        load_json_catalog_shards([products_path], [special_offers_path])
+
+    def parse_products():
+        with open(products_path, "rb") as file_obj:
+            get_products_from_json(file_obj)
+
+    def parse_products_compact():
+        with open(products_path, "rb") as file_obj:
+            get_product_table_from_json(file_obj)
+
+    def parse_special_offers():
+        with open(special_offers_path, "rb") as file_obj:
+            for _ in get_special_offers_from_json(
+                file_obj,
+                catalog.products_by_id,
+            ):
+                pass
+
+    def price_basket():
+        for basket in baskets:
+            _, discounts = get_original_total_and_discounts(
+                basket,
+                catalog.special_offers,
+                catalog.special_offers_by_product,
+            )
+
+            for _ in discounts:
+                pass
+
+    def price_basket_pence():
+        for basket in baskets:
+            _, discounts = get_original_total_and_discounts(
+                basket,
+                catalog.special_offers,
+                catalog.special_offers_by_product,
+                in_pence=True,
+            )
+
+            for _ in discounts:
+                pass
+
+    def price_batch():
+        price_baskets(
+            baskets,
+            catalog.special_offers,
+            catalog.special_offers_by_product,
+        )
+
+    results = price_baskets(
+        baskets,
+        catalog.special_offers,
+        catalog.special_offers_by_product,
+    )
+
+    def format_bills(bill_format):
+        with io.StringIO() as file_obj:
+            with BillWriter(file_obj, bill_format) as bill_writer:
+                bill_writer.write_many(results)
+
+    yield "load_catalog", 1, load_catalog
+    yield "load_catalog_compact", 1, load_catalog_compact
+    yield "load_catalog_async", 1, load_catalog_async
+    yield "parse_products", len(catalog.products_by_id), parse_products
+    yield (
+        "parse_products_compact",
+        len(catalog.products_by_id),
+        parse_products_compact,
+    )
+    yield (
+        "parse_special_offers",
+        len(catalog.special_offers),
+        parse_special_offers,
+    )
+    yield "price_basket", len(baskets), price_basket
+    yield "price_basket_pence", len(baskets), price_basket_pence
+    yield "price_batch", len(baskets), price_batch
+
+    for bill_format in BillFormat:
+        yield (
+            f"format_bill_{bill_format.value}",
+            len(baskets),
+            partial(format_bills, bill_format),
+        )
+
+
+def run_benchmarks(
+        num_products_seq,
+        max_special_offers,
+        num_baskets,
+        repeat,
+        data_dir,
+        seed=0,
+        measure_memory=True,
+):
+    """
+    Run each benchmark at each catalog size, yielding BenchmarkResult
+    objects. The catalogs are generated in data_dir, unless they are
+    there already.
+    """
+    for num_products in num_products_seq:
+        num_special_offers = min(num_products, max_special_offers)
+
+        products_path, special_offers_path = _get_catalog_paths(
+            data_dir,
+            num_products,
+            num_special_offers,
+            seed,
+        )
+
+        catalog = load_json_catalog(products_path, special_offers_path)
+        baskets = _get_baskets(catalog, num_baskets, seed)
+
+        for name, ops, func in _get_benchmarks(
+            products_path,
+            special_offers_path,
+            catalog,
+            baskets,
+        ):
+            seconds = _time(func, repeat)
+
+            yield BenchmarkResult(
+                name=name,
+                num_products=num_products,
+                num_special_offers=num_special_offers,
+                ops=ops,
+                seconds=seconds,
+                ops_per_sec=ops / seconds if seconds else None,
+                peak_memory_bytes=(
+                    _get_peak_memory(func) if measure_memory else None),
+            )
+
+
+def _print_result(result):
+    # ops_per_sec is None if the benchmark was too quick to time
+    if result.ops_per_sec is None:
+        ops_per_sec = "-"
+    else:
+        ops_per_sec = f"{result.ops_per_sec:,.1f}"
+
+    if result.peak_memory_bytes is None:
+        peak_memory = "-"
+    else:
+        peak_memory = f"{result.peak_memory_bytes / 2 ** 20:.1f}MiB"
+
+    print(
+        f"{result.name:<24}"
+        f"{result.num_products:>10}"
+        f"{result.num_special_offers:>10}"
+        f"{ops_per_sec:>16} ops/s"
+        f"{peak_memory:>12}")
+
+
+def main():
+    args = _parse_args()
+
+    created = datetime.now(timezone.utc)
+
+    output_path = args.output
+
+    if output_path is None:
+        output_path = Path(
+            f"benchmark-{created.strftime('%Y%m%dT%H%M%SZ')}.json")
+
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data_dir
+
+        if data_dir is None:
+            data_dir = Path(stack.enter_context(
+                tempfile.TemporaryDirectory()))
+        else:
+            data_dir.mkdir(parents=True, exist_ok=True)
+
+        results = []
+
+        for result in run_benchmarks(
+            args.num_products_seq,
+            args.max_special_offers,
+            args.num_baskets,
+            args.repeat,
+            data_dir,
+            args.seed,
+        ):
+            _print_result(result)
+            results.append(result)
+
+    with open(output_path, "w") as file_obj:
+        json.dump(
+            {
+                "created": created.isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "seed": args.seed,
+                "num_baskets": args.num_baskets,
+                "repeat": args.repeat,
+                "results": [r._asdict() for r in results],
+            },
+            file_obj,
+            indent=2,
+        )
+
+    print(f"Results written to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
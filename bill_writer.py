@@ -0,0 +1,227 @@
+"""
+bill_writer.py
+===
+
+Write priced baskets (bills) as text, JSON lines or CSV, through one
+buffered writer.
+
+Each bill is a (original_total, discounts) result, or None for a basket
+that could not be priced. Bills are rendered into an in-memory buffer,
+which is written to the file object in large blocks, so writing many
+bills doesn't cost a write call (or a print call) per line.
+
+Formats:
+
+text: The human readable bill, e.g.:
+
+      Subtotal: £3.10
+      Apples 10% off: -10p
+      Total: £3.00
+
+      Bills are separated by a blank line.
+
+json: One JSON object per line, with the original total, the discounts
+      (each with a value and a description) and the total.
+
+csv:  One row per bill, with no header row. The columns are:
+
+      original_total, (discount_value, discount_description)...,
+      total
+
+      i.e. the original total, then the value and the description of
+      each discount, then the total. Rows have a varying number of
+      columns, so the total is always the last one, e.g. (in pence):
+
+      310,10,Apples 10% off: -10p,300
+      80,80
+
+In the json and csv formats, amounts are integers (pence) if in_pence is
+true, otherwise decimal strings (pounds), rounded to the penny as in the
+text format. A basket that could not be
+priced is written as {"error": "Basket is invalid"} in json, as a row of
+"error" and the message in csv, and as the message in text.
+"""
+
+import csv
+import io
+import json
+from decimal import Decimal
+from enum import Enum
+
+from money import from_pence, to_pence
+from utils import format_currency_gbp, format_pence_gbp
+
+
+_INVALID_BASKET_MESSAGE = "Basket is invalid"
+
+
+class BillFormat(Enum):
+    TEXT = "text"
+    JSON = "json"
+    CSV = "csv"
+
+
+def _to_decimal_str(dec):
+    """
+    Convert a Decimal amount in pounds to a string, rounded to the penny
+    as format_currency_gbp does, e.g. Decimal("0.325") => "0.32" (the
+    total of an empty basket is the integer 0)
+    """
+    return str(from_pence(to_pence(Decimal(dec))))
+
+
+def get_bill_obj(result, in_pence=False):
+    """
+    Get the JSON object of a bill
+    """
+    if result is None:
+        return {"error": _INVALID_BASKET_MESSAGE}
+
+    to_json_value = int if in_pence else _to_decimal_str
+    original_total, discounts = result
+    discounts = tuple(discounts)
+
+    return {
+        "original_total": to_json_value(original_total),
+        "discounts": [
+            {
+                "value": to_json_value(discount.value),
+                "description": discount.description,
+            }
+            for discount in discounts],
+        "total": to_json_value(
+            original_total - sum(d.value for d in discounts)),
+    }
+
+
+class BillWriter:
+    """
+    Writes bills to file_obj (a text file object) in bill_format, with
+    amounts in pence if in_pence is true
+
+    Bills are buffered until at least buffer_size characters are
+    waiting, so call flush (or use the writer as a context manager) once
+    the bills are written. If buffer_size is None, each bill is written
+    to file_obj straight away, e.g. when file_obj is buffered itself and
+    is flushed by the caller.
+
+    If separate_first is true, the first text bill is preceded by a
+    blank line too, e.g. when it follows bills from another writer.
+    """
+
+    def __init__(
+            self,
+            file_obj,
+            bill_format=BillFormat.TEXT,
+            in_pence=False,
+            buffer_size=2 ** 16,
+            separate_first=False,
+    ):
+        self._file_obj = file_obj
+        self._bill_format = BillFormat(bill_format)
+        self._in_pence = in_pence
+        self._buffer_size = buffer_size
+        self._separate_first = separate_first
+
+        if buffer_size is None:
+            self._buffer = file_obj
+        else:
+            self._buffer = io.StringIO()
+
+        self._csv_writer = csv.writer(self._buffer, lineterminator="\n")
+        self._num_bills = 0
+
+        self._write_bill = {
+            BillFormat.TEXT: self._write_text,
+            BillFormat.JSON: self._write_json,
+            BillFormat.CSV: self._write_csv,
+        }[self._bill_format]
+
+    def __repr__(self):
+        return (
+            f"BillWriter(bill_format={self._bill_format!r}, "
+            f"in_pence={self._in_pence!r})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _write_text(self, result):
+        write = self._buffer.write
+
+        if self._num_bills or self._separate_first:
+            write("\n")
+
+        if result is None:
+            write(f"{_INVALID_BASKET_MESSAGE}\n")
+            return
+
+        if self._in_pence:
+            format_currency = format_pence_gbp
+        else:
+            format_currency = format_currency_gbp
+
+        original_total, discounts = result
+        subtotal = original_total
+
+        for discount in discounts:
+            write(
+                f"Subtotal: {format_currency(subtotal)}\n"
+                f"{discount.description}\n")
+            subtotal -= discount.value
+
+        write(f"Total: {format_currency(subtotal)}\n")
+
+    def _write_json(self, result):
+        self._buffer.write(json.dumps(get_bill_obj(result, self._in_pence)))
+        self._buffer.write("\n")
+
+    def _write_csv(self, result):
+        if result is None:
+            self._csv_writer.writerow(("error", _INVALID_BASKET_MESSAGE))
+            return
+
+        to_csv_value = int if self._in_pence else _to_decimal_str
+        original_total, discounts = result
+
+        discounts = tuple(discounts)
+        row = [to_csv_value(original_total)]
+
+        for discount in discounts:
+            row.append(to_csv_value(discount.value))
+            row.append(discount.description)
+
+        row.append(to_csv_value(
+            original_total - sum(d.value for d in discounts)))
+        self._csv_writer.writerow(row)
+
+    def write(self, result):
+        """
+        Write the bill of a result (an (original_total, discounts) pair,
+        or None if the basket could not be priced)
+        """
+        self._write_bill(result)
+        self._num_bills += 1
+
+        if (
+                self._buffer_size is not None and
+                self._buffer.tell() >= self._buffer_size
+        ):
+            self.flush()
+
+    def write_many(self, results):
+        for result in results:
+            self.write(result)
+
+    def flush(self):
+        """
+        Write the buffered bills to the file object
+        """
+        buffer = self._buffer
+
+        if self._buffer_size is not None and buffer.tell():
+            self._file_obj.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
@@ -0,0 +1,547 @@
+"""
+catalog.py
+===
+
+Compile products and special offers into a fixed-layout binary file,
+and load it through a memory map.
+
+Loading a compiled catalog only reads its header. Products and special
+offers are decoded when they are first looked up, so start-up cost does
+not grow with the size of the catalog. The file is mapped read-only, so
+several processes loading the same file share the same pages.
+
+File layout (little-endian):
+
+    Header
+    Product records, sorted by product ID
+    Name index: product record indices, sorted by name (UTF-8)
+    Names: UTF-8 encoded product names
+    Special offer records, in their original order
+    Special offer index: for each product record, a range of special
+        offer record indices (CSR format, i.e. num_products + 1
+        offsets, followed by the special offer record indices)
+
+Prices and fractions are stored as an integer coefficient and a base 10
+exponent, so that the original Decimal objects are reconstructed
+exactly.
+"""
+
+import mmap
+import struct
+from collections.abc import Mapping, Sequence
+
+from money import from_coefficient_and_exponent, to_coefficient_and_exponent
+from product import Product, get_products_from_json
+from special_offer import (
+    FractionOfPrice,
+    FractionOfPricePerQuantity,
+    SpecialOfferType,
+    get_special_offers_from_json,
+)
+
+
+_MAGIC = b"PBCAT\x00\x00\x00"
+_VERSION = 1
+
+# magic, version, num_products, num_special_offers, products_offset,
+# name_index_offset, names_offset, special_offers_offset, index_offset
+_HEADER = struct.Struct("<8sIIIQQQQQ")
+
+# product_id, price coefficient, price exponent, name offset, name length
+_PRODUCT = struct.Struct("<qqiII")
+
+_UINT = struct.Struct("<I")
+
+# special offer type code, number of products, product record indices
+# (2), integer values (2), fraction coefficient, fraction exponent
+_SPECIAL_OFFER = struct.Struct("<BBxxIIqqqi")
+
+_SPECIAL_OFFER_TYPES = (
+    SpecialOfferType.FRACTION_OF_PRICE,
+    SpecialOfferType.FRACTION_OF_PRICE_PER_QUANTITY,
+)
+
+
+def _encode_special_offer(special_offer, product_ix_by_id):
+    special_offer_type = special_offer.SPECIAL_OFFER_TYPE
+
+    if special_offer_type is SpecialOfferType.FRACTION_OF_PRICE:
+        product_ixs = (
+            product_ix_by_id[special_offer.discounted_product.product_id],
+            0,
+        )
+        values = (0, 0)
+        num_products = 1
+
+    elif special_offer_type is (
+            SpecialOfferType.FRACTION_OF_PRICE_PER_QUANTITY):
+        product_ixs = (
+            product_ix_by_id[special_offer.trigger_product.product_id],
+            product_ix_by_id[special_offer.discounted_product.product_id],
+        )
+        values = (
+            special_offer.trigger_product_quantity,
+            special_offer.discounted_product_quantity,
+        )
+        num_products = 2
+
+    else:
+        raise ValueError(
+            f"'{special_offer_type.value}' special offers are not "
+            f"supported by compiled catalogs")
+
+    return _SPECIAL_OFFER.pack(
+        _SPECIAL_OFFER_TYPES.index(special_offer_type),
+        num_products,
+        *product_ixs,
+        *values,
+        *to_coefficient_and_exponent(special_offer.fraction_of_price),
+    )
+
+
+def _decode_special_offer(record, get_product):
+    (type_code,
+     num_products,
+     product_ix_0,
+     product_ix_1,
+     value_0,
+     value_1,
+     fraction_coefficient,
+     fraction_exponent) = record
+
+    special_offer_type = _SPECIAL_OFFER_TYPES[type_code]
+    product_seq = tuple(map(
+        get_product,
+        (product_ix_0, product_ix_1)[:num_products],
+    ))
+    fraction_of_price = from_coefficient_and_exponent(
+        fraction_coefficient,
+        fraction_exponent,
+    )
+
+    if special_offer_type is SpecialOfferType.FRACTION_OF_PRICE:
+        cls = FractionOfPrice
+        return cls(
+            product_seq,
+            (cls.ProductValues(fraction_of_price=fraction_of_price),),
+        )
+
+    cls = FractionOfPricePerQuantity
+    return cls(
+        product_seq,
+        (
+            cls.ProductValues(quantity=value_0),
+            cls.ProductValues(quantity=value_1),
+        ),
+        cls.SharedValues(fraction_of_price=fraction_of_price),
+    )
+
+
+def compile_catalog(products_file_obj, special_offers_file_obj, out_file_obj):
+    """
+    Validate products and special offers JSON (see product.py and
+    special_offer.py), and write them to out_file_obj as a compiled
+    catalog
+    """
+    products_by_id = get_products_from_json(products_file_obj)
+    special_offers = tuple(get_special_offers_from_json(
+        special_offers_file_obj,
+        products_by_id,
+    ))
+
+    # In product ID order
+    products = list(products_by_id.values())
+
+    product_ix_by_id = {p.product_id: ix for ix, p in enumerate(products)}
+
+    name_bytes_seq = tuple(p.name.encode("utf-8") for p in products)
+    name_index = sorted(
+        range(len(products)),
+        key=name_bytes_seq.__getitem__,
+    )
+
+    product_records = []
+    name_offset = 0
+
+    for product, name_bytes in zip(products, name_bytes_seq):
+        product_records.append(_PRODUCT.pack(
+            product.product_id,
+            *to_coefficient_and_exponent(product.price),
+            name_offset,
+            len(name_bytes),
+        ))
+        name_offset += len(name_bytes)
+
+    special_offer_records = []
+    special_offer_ixs_by_product_ix = [[] for _ in products]
+
+    for special_offer_ix, special_offer in enumerate(special_offers):
+        special_offer_records.append(_encode_special_offer(
+            special_offer,
+            product_ix_by_id,
+        ))
+
+        product_ixs = dict.fromkeys(
+            product_ix_by_id[p.product_id] for p in special_offer._products)
+
+        for product_ix in product_ixs:
+            special_offer_ixs_by_product_ix[product_ix].append(
+                special_offer_ix,
+            )
+
+    index_offsets = [0]
+    for special_offer_ixs in special_offer_ixs_by_product_ix:
+        index_offsets.append(index_offsets[-1] + len(special_offer_ixs))
+
+    sections = (
+        b"".join(product_records),
+        b"".join(map(_UINT.pack, name_index)),
+        b"".join(name_bytes_seq),
+        b"".join(special_offer_records),
+        b"".join(
+            _UINT.pack(ix)
+            for ixs in (
+                index_offsets,
+                *special_offer_ixs_by_product_ix,
+            )
+            for ix in ixs),
+    )
+
+    section_offsets = []
+    offset = _HEADER.size
+    for section in sections:
+        section_offsets.append(offset)
+        offset += len(section)
+
+    out_file_obj.write(_HEADER.pack(
+        _MAGIC,
+        _VERSION,
+        len(products),
+        len(special_offers),
+        *section_offsets,
+    ))
+
+    for section in sections:
+        out_file_obj.write(section)
+
+
+class _ProductsById(Mapping):
+    """
+    Products of a compiled catalog, by product ID (binary search)
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, product_id):
+        catalog = self._catalog
+        lo, hi = 0, catalog.num_products
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_product_id = catalog._get_product_record(mid)[0]
+
+            if mid_product_id < product_id:
+                lo = mid + 1
+            elif mid_product_id > product_id:
+                hi = mid
+            else:
+                return catalog._get_product(mid)
+
+        raise KeyError(product_id)
+
+    def __iter__(self):
+        catalog = self._catalog
+        for product_ix in range(catalog.num_products):
+            yield catalog._get_product_record(product_ix)[0]
+
+    def __len__(self):
+        return self._catalog.num_products
+
+
+class _ProductByName(Mapping):
+    """
+    Products of a compiled catalog, by name (binary search)
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, name):
+        catalog = self._catalog
+        name_bytes = name.encode("utf-8")
+        lo, hi = 0, catalog.num_products
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            product_ix = catalog._get_name_index_entry(mid)
+            mid_name_bytes = catalog._get_name_bytes(product_ix)
+
+            if mid_name_bytes < name_bytes:
+                lo = mid + 1
+            elif mid_name_bytes > name_bytes:
+                hi = mid
+            else:
+                return catalog._get_product(product_ix)
+
+        raise KeyError(name)
+
+    def __iter__(self):
+        catalog = self._catalog
+        for product_ix in range(catalog.num_products):
+            yield catalog._get_name_bytes(product_ix).decode("utf-8")
+
+    def __len__(self):
+        return self._catalog.num_products
+
+
+class _SpecialOffers(Sequence):
+    """
+    Special offers of a compiled catalog, in their original order
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, special_offer_ix):
+        if isinstance(special_offer_ix, slice):
+            return tuple(map(
+                self.__getitem__,
+                range(len(self))[special_offer_ix],
+            ))
+
+        if not 0 <= special_offer_ix < len(self):
+            raise IndexError(special_offer_ix)
+
+        return self._catalog._get_special_offer(special_offer_ix)
+
+    def __len__(self):
+        return self._catalog.num_special_offers
+
+
+class _SpecialOffersByProduct:
+    """
+    Special offers of a compiled catalog, by product, in the same form
+    as special_offer.get_special_offers_by_product
+    """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def get(self, product, default=None):
+        catalog = self._catalog
+
+        try:
+            product_ix = catalog._product_ix_by_product[product]
+        except KeyError:
+            return default
+
+        return catalog._get_positioned_special_offers(product_ix) or default
+
+    def __getitem__(self, product):
+        positioned_special_offers = self.get(product)
+        if positioned_special_offers is None:
+            raise KeyError(product)
+
+        return positioned_special_offers
+
+
+class CompiledCatalog:
+    """
+    A compiled catalog, loaded through a read-only memory map
+
+    Products and special offers are decoded on first access, and then
+    cached, so that each is only ever represented by one object.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file_obj:
+            try:
+                self._mmap = mmap.mmap(
+                    file_obj.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ,
+                )
+            except ValueError:
+                # e.g. an empty file, which can't be mapped
+                raise ValueError(f"{path} is not a compiled catalog") from None
+
+        try:
+            self._read_header(path)
+        except ValueError:
+            self._mmap.close()
+            raise
+
+        self._product_by_ix = {}
+        self._product_ix_by_product = {}
+        self._special_offer_by_ix = {}
+
+        self.products_by_id = _ProductsById(self)
+        self.product_by_name = _ProductByName(self)
+        self.special_offers = _SpecialOffers(self)
+        self.special_offers_by_product = _SpecialOffersByProduct(self)
+
+    def __repr__(self):
+        return (
+            f"CompiledCatalog(num_products={self.num_products!r}, "
+            f"num_special_offers={self.num_special_offers!r})")
+
+    def _read_header(self, path):
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{path} is not a compiled catalog")
+
+        (magic,
+         version,
+         self.num_products,
+         self.num_special_offers,
+         self._products_offset,
+         self._name_index_offset,
+         self._names_offset,
+         self._special_offers_offset,
+         self._index_offset) = _HEADER.unpack_from(self._mmap)
+
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog")
+
+        if version != _VERSION:
+            raise ValueError(
+                f"{path} has an unsupported catalog version: {version}")
+
+        self._check_sections(path)
+
+    def _check_sections(self, path):
+        """
+        Check that each section of the file is within it, so that a
+        truncated or corrupt file fails here rather than on a lookup
+        """
+        size = len(self._mmap)
+        index_offsets_size = (self.num_products + 1) * _UINT.size
+
+        for name, offset, length in (
+                (
+                    "products",
+                    self._products_offset,
+                    self.num_products * _PRODUCT.size,
+                ),
+                (
+                    "name index",
+                    self._name_index_offset,
+                    self.num_products * _UINT.size,
+                ),
+                (
+                    "names",
+                    self._names_offset,
+                    self._special_offers_offset - self._names_offset,
+                ),
+                (
+                    "special offers",
+                    self._special_offers_offset,
+                    self.num_special_offers * _SPECIAL_OFFER.size,
+                ),
+                (
+                    "special offer index",
+                    self._index_offset,
+                    index_offsets_size,
+                ),
+        ):
+            if offset < _HEADER.size or length < 0 or offset + length > size:
+                raise ValueError(
+                    f"{path} is corrupt (its {name} section is out of "
+                    f"bounds)")
+
+        # The last offset of the index is its number of entries
+        num_entries, = _UINT.unpack_from(
+            self._mmap,
+            self._index_offset + self.num_products * _UINT.size,
+        )
+
+        if (
+                self._index_offset + index_offsets_size +
+                num_entries * _UINT.size > size
+        ):
+            raise ValueError(
+                f"{path} is corrupt (its special offer index entries are "
+                f"out of bounds)")
+
+    def close(self):
+        self._mmap.close()
+
+    def _get_product_record(self, product_ix):
+        return _PRODUCT.unpack_from(
+            self._mmap,
+            self._products_offset + product_ix * _PRODUCT.size,
+        )
+
+    def _get_name_index_entry(self, ix):
+        return _UINT.unpack_from(
+            self._mmap,
+            self._name_index_offset + ix * _UINT.size,
+        )[0]
+
+    def _get_name_bytes(self, product_ix):
+        *_, name_offset, name_len = self._get_product_record(product_ix)
+        start = self._names_offset + name_offset
+        return self._mmap[start:start + name_len]
+
+    def _get_product(self, product_ix):
+        try:
+            return self._product_by_ix[product_ix]
+        except KeyError:
+            pass
+
+        (product_id,
+         price_coefficient,
+         price_exponent,
+         name_offset,
+         name_len) = self._get_product_record(product_ix)
+
+        name_start = self._names_offset + name_offset
+
+        product = self._product_by_ix[product_ix] = Product(
+            product_id=product_id,
+            name=self._mmap[name_start:name_start + name_len].decode(
+                "utf-8"),
+            price=from_coefficient_and_exponent(
+                price_coefficient,
+                price_exponent,
+            ),
+        )
+
+        self._product_ix_by_product[product] = product_ix
+        return product
+
+    def _get_special_offer(self, special_offer_ix):
+        try:
+            return self._special_offer_by_ix[special_offer_ix]
+        except KeyError:
+            pass
+
+        record = _SPECIAL_OFFER.unpack_from(
+            self._mmap,
+            (
+                self._special_offers_offset +
+                special_offer_ix * _SPECIAL_OFFER.size),
+        )
+
+        special_offer = _decode_special_offer(record, self._get_product)
+
+        self._special_offer_by_ix[special_offer_ix] = special_offer
+        return special_offer
+
+    def _get_positioned_special_offers(self, product_ix):
+        start, end = struct.unpack_from(
+            "<II",
+            self._mmap,
+            self._index_offset + product_ix * _UINT.size,
+        )
+
+        entries_offset = (
+            self._index_offset + (self.num_products + 1) * _UINT.size)
+
+        return tuple(
+            (special_offer_ix, self._get_special_offer(special_offer_ix))
+            for special_offer_ix in struct.unpack_from(
+                f"<{end - start}I",
+                self._mmap,
+                entries_offset + start * _UINT.size,
+            ))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from pathlib import Path
+
+from catalog import compile_catalog
+
+
+_MODULE_DIR_PATH = Path(__file__).parent.resolve()
+
+
+def _create_arg_parser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Compile products and special offers JSON into a binary "
+            "catalog, for use with price_basket.py --catalog"),
+    )
+
+    parser.add_argument(
+        "output",
+        metavar="OUTPUT",
+        type=Path,
+        help="Path of the compiled catalog to write",
+    )
+
+    parser.add_argument(
+        "--products",
+        type=Path,
+        default=_MODULE_DIR_PATH / "products.json",
+        help="Path of the products JSON",
+    )
+
+    parser.add_argument(
+        "--special-offers",
+        type=Path,
+        default=_MODULE_DIR_PATH / "special_offers.json",
+        help="Path of the special offers JSON",
+    )
+
+    return parser
+
+
+def _compile(args):
+    # Write to a temporary file, then rename it over the output, so that
+    # a process using the previous catalog (which is memory-mapped) never
+    # sees a partly written file
+    tmp_path = args.output.with_name(f".{args.output.name}.tmp")
+
+    try:
+        with args.products.open("rb") as products_file_obj, \
+                args.special_offers.open("rb") as special_offers_file_obj, \
+                tmp_path.open("wb") as out_file_obj:
+            compile_catalog(
+                products_file_obj,
+                special_offers_file_obj,
+                out_file_obj,
+            )
+
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def main():
+    parser = _create_arg_parser()
+    args = parser.parse_args()
+
+    try:
+        _compile(args)
+    except ValueError as exc:
+        # e.g. a special offer type that compiled catalogs don't support
+        parser.error(
+            f"can't compile the catalog: {str(exc) or 'invalid JSON'}")
+
+
+if __name__ == '__main__':
+    main()
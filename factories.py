@@ -1,32 +1,31 @@
-from itertools import repeat
+from collections import Counter
 
 import factory
 from faker import Factory as FakerFactory
 
-from product import Product
+from product import Product, ProductsById
 from special_offer import (
+    Bundle,
+    BundleProduct,
+    BundleShared,
     FractionOfPrice,
     FractionOfPriceProduct,
     FractionOfPricePerQuantityProduct,
     FractionOfPricePerQuantityShared,
     FractionOfPricePerQuantity,
+    MultiBuy,
+    MultiBuyShared,
 )
 
 
 fake = FakerFactory.create('en-GB')
 
 
-def create_sparse_list(items):
+def create_products_by_id(products):
     """
-    Create a list, indexed by an integer (key) for faster lookup.
-    E.g.: {1: foo, 2: bar, 4: baz} => [None, foo, bar, None, baz]
+    Index products by product ID, as get_products_from_json does
     """
-    seq = []
-    for key, value in sorted(items):
-        seq.extend(repeat(None, key - len(seq)))
-        seq.append(value)
-
-    return seq
+    return ProductsById(products)
 
 
 class ProductFactory(factory.StubFactory):
@@ -164,3 +163,178 @@ class FractionOfPricePerQuantityFactory(SpecialOfferFactory):
                 fraction_of_price=stub.fraction_of_price,
             ),
         )
+
+
+class MultiBuyFactory(SpecialOfferFactory):
+    products = factory.LazyFunction(lambda: ProductFactory.stub_batch(2))
+
+    buy_quantity = factory.Faker('random_int', min=2, max=4)
+
+    pay_quantity = factory.LazyAttribute(lambda o: o.buy_quantity - 1)
+
+    @staticmethod
+    def stub_to_dict(stub):
+        return {
+            "special_offer_type": "multi_buy",
+            "product_matrix": [
+                [p.product_id for p in stub.products],
+            ],
+            "shared_values": [
+                stub.buy_quantity,
+                stub.pay_quantity,
+            ],
+        }
+
+    @staticmethod
+    def stub_to_obj(stub, products):
+        return MultiBuy(
+            products,
+            (),
+            MultiBuyShared(
+                buy_quantity=stub.buy_quantity,
+                pay_quantity=stub.pay_quantity,
+            ),
+        )
+
+
+class BundleFactory(SpecialOfferFactory):
+    products = factory.LazyFunction(lambda: ProductFactory.stub_batch(2))
+
+    quantities = factory.LazyAttribute(
+        lambda o: [fake.random_int(min=1, max=3) for _ in o.products])
+
+    price = factory.Faker(
+        'pydecimal',
+        left_digits=3,
+        right_digits=2,
+        positive=True,
+    )
+
+    @staticmethod
+    def stub_to_dict(stub):
+        return {
+            "special_offer_type": "bundle",
+            "product_matrix": [
+                [p.product_id for p in stub.products],
+                list(stub.quantities),
+            ],
+            "shared_values": [
+                str(stub.price),
+            ],
+        }
+
+    @staticmethod
+    def stub_to_obj(stub, products):
+        return Bundle(
+            products,
+            tuple(BundleProduct(quantity=q) for q in stub.quantities),
+            BundleShared(price=stub.price),
+        )
+
+
+def create_products(num_products):
+    return tuple(map(
+        ProductFactory.stub_to_obj,
+        ProductFactory.stub_batch(num_products),
+    ))
+
+
+def create_special_offers(
+        products,
+        num_fraction_of_price,
+        num_per_quantity,
+        **per_quantity_kwargs
+):
+    """
+    Create fraction of price special offers, then fraction of price per
+    quantity special offers, for random products from products.
+    per_quantity_kwargs are passed on to
+    FractionOfPricePerQuantityFactory.
+    """
+    special_offer_seq = [
+        FractionOfPriceFactory.stub_to_obj(
+            stub,
+            (stub.discounted_product,),
+        )
+        for stub in FractionOfPriceFactory.stub_batch(
+            num_fraction_of_price,
+            discounted_product=factory.Faker(
+                'random_element', elements=products),
+        )]
+
+    special_offer_seq.extend(
+        FractionOfPricePerQuantityFactory.stub_to_obj(
+            stub,
+            (stub.trigger_product, stub.discounted_product),
+        )
+        for stub in FractionOfPricePerQuantityFactory.stub_batch(
+            num_per_quantity,
+            **{
+                "trigger_product": factory.Faker(
+                    'random_element', elements=products),
+                "discounted_product": factory.Faker(
+                    'random_element', elements=products),
+                **per_quantity_kwargs,
+            },
+        ))
+
+    return tuple(special_offer_seq)
+
+
+def create_basket(
+        products,
+        min_quantity=1,
+        max_quantity=8,
+        max_num_products=None,
+):
+    """
+    Create a basket (a Counter) of random quantities of up to
+    max_num_products random products, or of every product if
+    max_num_products is None
+    """
+    if max_num_products is not None:
+        products = fake.random_elements(
+            products,
+            length=fake.random_int(min=0, max=max_num_products),
+            unique=True,
+        )
+
+    return Counter({
+        p: fake.random_int(min=min_quantity, max=max_quantity)
+        for p in products})
+
+
+class BasketsTestCaseMixin:
+    """
+    Creates random products (product_seq), special offers of the
+    fraction of price types (special_offers) and baskets (baskets) for
+    each test. Override the class attributes to change their numbers and
+    sizes.
+    """
+
+    num_products = 8
+    num_fraction_of_price = 4
+    num_per_quantity = 4
+
+    num_baskets = 32
+    min_quantity = 1
+    max_quantity = 8
+    max_num_basket_products = 5
+
+    def setUp(self):
+        super().setUp()
+
+        self.product_seq = create_products(self.num_products)
+        self.special_offers = create_special_offers(
+            self.product_seq,
+            self.num_fraction_of_price,
+            self.num_per_quantity,
+        )
+        self.baskets = [
+            create_basket(
+                self.product_seq,
+                self.min_quantity,
+                self.max_quantity,
+                self.max_num_basket_products,
+            )
+            for _ in range(self.num_baskets)]
@@ -0,0 +1,103 @@
+"""
+money.py
+===
+
+Integer money arithmetic, in pence (the smallest GBP denomination).
+
+This is an optional alternative to Decimal arithmetic, used when pricing
+baskets with in_pence=True. Integer arithmetic is considerably cheaper
+than Decimal arithmetic, and totals match the Decimal path whenever
+each discount is a whole number of pence.
+
+Rounding rule: a discount that is not a whole number of pence (e.g. 50%
+off £0.65) is rounded to the nearest penny, with ties rounded to the
+nearest even penny (ROUND_HALF_EVEN, as used by format_currency_gbp).
+Each discount is rounded on its own, before it is subtracted from the
+total, so the printed discounts always add up to the printed total.
+Prices are expected to be whole numbers of pence, and are rounded in the
+same way if they are not.
+"""
+
+from decimal import Decimal, ROUND_HALF_EVEN
+
+
+PENCE_PER_POUND = 100
+
+_GBP_SMALLEST_DENOMINATION = Decimal("0.01")
+
+
+def to_pence(dec):
+    """
+    Convert a Decimal amount in pounds to an integer amount in pence
+
+    Decimal("1.30") => 130
+    Decimal("0.325") => 32
+    """
+    return int(dec.quantize(
+        _GBP_SMALLEST_DENOMINATION,
+        rounding=ROUND_HALF_EVEN,
+    ).scaleb(2))
+
+
+def from_pence(pence):
+    """
+    Convert an integer amount in pence to a Decimal amount in pounds
+
+    130 => Decimal("1.30")
+    """
+    return Decimal(pence).scaleb(-2)
+
+
+def to_ratio(dec):
+    """
+    Convert a Decimal to an exact (numerator, denominator) pair of
+    integers, for use with multiply_pence
+
+    Decimal("0.25") => (1, 4)
+    """
+    return dec.as_integer_ratio()
+
+
+def multiply_pence(pence, numerator, denominator):
+    """
+    Multiply an amount in pence by numerator / denominator, rounding the
+    result to the nearest penny (ties to even). The denominator must be
+    positive.
+
+    multiply_pence(65, 1, 2) => 32 (32.5 is rounded down to even)
+    multiply_pence(75, 1, 2) => 38 (37.5 is rounded up to even)
+    """
+    quotient, remainder = divmod(pence * numerator, denominator)
+
+    twice_remainder = remainder * 2
+
+    if (
+            twice_remainder > denominator or
+            (twice_remainder == denominator and quotient % 2 == 1)
+    ):
+        quotient += 1
+
+    return quotient
+
+
+def to_coefficient_and_exponent(dec):
+    """
+    Convert a finite Decimal to an exact (coefficient, exponent) pair of
+    integers, for compact storage
+
+    Decimal("1.30") => (130, -2)
+    """
+    sign, digits, exponent = dec.as_tuple()
+
+    if type(exponent) is not int:
+        raise ValueError("Decimal is not finite")
+
+    coefficient = int("".join(map(str, digits)))
+    return -coefficient if sign else coefficient, exponent
+
+
+def from_coefficient_and_exponent(coefficient, exponent):
+    """
+    (130, -2) => Decimal("1.30")
+    """
+    return Decimal(coefficient).scaleb(exponent)
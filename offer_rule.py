@@ -0,0 +1,346 @@
+"""
+offer_rule.py
+===
+
+A declarative model of special offers, evaluated by one generic engine.
+
+An OfferRule is a table of product sets:
+
+trigger_sets:     TriggerSet(products, quota) rows. The offer applies
+                  once for every quota units of each trigger set in the
+                  basket (units of any of the set's products count). If
+                  there are no trigger sets, the offer applies without
+                  limit.
+discounted_sets:  DiscountedSet(products, quota) rows. Each application
+                  discounts up to quota units of each discounted set
+                  (every unit, if quota is None), the cheapest units
+                  first.
+price_rule_type:  How the discounted units are priced (see
+                  PriceRuleType)
+price_rule_value: The fraction of price, or the fixed price
+
+A product may be in both a trigger set and a discounted set, in which
+case the same units count towards both (e.g. "3 for 2").
+
+A trigger set with a quota that is not positive never applies.
+
+For example, FractionOfPricePerQuantity (buy 2 apples, get a banana
+half price) is:
+
+OfferRule(
+    trigger_sets=(TriggerSet((apple,), 2),),
+    discounted_sets=(DiscountedSet((banana,), 1),),
+    price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+    price_rule_value=Decimal("0.5"),
+)
+
+compile_rule compiles a rule into evaluators once, so that evaluating a
+basket only loops over the rule's rows.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+from enum import Enum
+
+from money import multiply_pence, to_pence, to_ratio
+
+
+class PriceRuleType(Enum):
+    # The discounted units cost a fraction of their price (as in
+    # FractionOfPrice, this is the surcharge rather than the discount)
+    FRACTION_OF_PRICE = "fraction_of_price"
+
+    # The discounted units of each application cost a fixed price in
+    # total (e.g. a bundle), unless that is more than they cost anyway
+    FIXED_PRICE = "fixed_price"
+
+
+TriggerSet = namedtuple("TriggerSet", ("products", "quota"))
+
+DiscountedSet = namedtuple("DiscountedSet", ("products", "quota"))
+
+OfferRule = namedtuple(
+    "OfferRule",
+    (
+        "trigger_sets",
+        "discounted_sets",
+        "price_rule_type",
+        "price_rule_value",
+    ),
+)
+
+_ZERO = Decimal(0)
+
+
+def get_rule_products(rule):
+    """
+    Get the products of a rule, without duplicates, in the order they
+    first appear
+    """
+    return tuple(dict.fromkeys(
+        product
+        for product_set in rule.trigger_sets + rule.discounted_sets
+        for product in product_set.products))
+
+
+def _get_cheapest_first(products):
+    return sorted(dict.fromkeys(products), key=lambda p: p.price)
+
+
+def compile_rule(rule, key_products):
+    """
+    Compile the evaluators of a rule's discount, from a tuple of the
+    quantities of key_products in the basket (which must include every
+    product of the rule):
+
+    get_value(quantities): Decimal amount in pounds
+    get_value_pence(quantities): Integer amount in pence
+
+    If a product is in key_products more than once, trigger sets use
+    its first quantity and discounted sets its last, so that the units
+    counted as triggers and as discounted can be given separately (see
+    FractionOfPricePerQuantity._iter_allocations).
+    """
+    if not rule.trigger_sets and (
+            rule.price_rule_type is PriceRuleType.FIXED_PRICE):
+        raise ValueError("A fixed price rule requires a trigger set")
+
+    first_ix_by_product = {}
+    last_ix_by_product = {}
+
+    for ix, product in enumerate(key_products):
+        first_ix_by_product.setdefault(product, ix)
+        last_ix_by_product[product] = ix
+
+    trigger_rows = tuple(
+        (
+            tuple(map(first_ix_by_product.__getitem__, dict.fromkeys(
+                trigger_set.products,
+            ))),
+            trigger_set.quota,
+        )
+        for trigger_set in rule.trigger_sets)
+
+    discounted_rows = tuple(
+        (
+            tuple(
+                (
+                    last_ix_by_product[product],
+                    product.price,
+                    product.price_pence,
+                )
+                for product in _get_cheapest_first(discounted_set.products)),
+            discounted_set.quota,
+        )
+        for discounted_set in rule.discounted_sets)
+
+    def get_num_applications(quantities):
+        # No trigger sets means no limit
+        num_applications = None
+
+        for ixs, quota in trigger_rows:
+            quantity = 0
+
+            for ix in ixs:
+                quantity += quantities[ix]
+
+            if quantity <= 0 or quota <= 0:
+                return 0
+
+            set_num_applications = quantity // quota
+
+            if (
+                    num_applications is None or
+                    set_num_applications < num_applications
+            ):
+                num_applications = set_num_applications
+
+        return num_applications
+
+    def get_discounted_units(quantities):
+        """
+        Get the number of applications, and a list of (quantity, price,
+        price_pence) for each discounted product
+        """
+        num_applications = get_num_applications(quantities)
+        units = []
+
+        for rows, quota in discounted_rows:
+            if quota is None or num_applications is None:
+                units_left = None
+            else:
+                units_left = num_applications * quota
+
+            for ix, price, price_pence in rows:
+                quantity = quantities[ix]
+
+                if units_left is not None:
+                    if quantity > units_left:
+                        quantity = units_left
+
+                    units_left -= quantity
+
+                units.append((quantity, price, price_pence))
+
+        return num_applications, units
+
+    if rule.price_rule_type is PriceRuleType.FRACTION_OF_PRICE:
+        discount_fraction = 1 - rule.price_rule_value
+        numerator, denominator = to_ratio(discount_fraction)
+
+        def get_value(quantities):
+            _, units = get_discounted_units(quantities)
+
+            if not units:
+                return _ZERO
+
+            # The first term starts the sum (rather than zero), so that a
+            # single discounted product gives exactly the same Decimal as
+            # quantity * price * discount_fraction
+            (quantity, price, _), *other_units = units
+            value = quantity * price * discount_fraction
+
+            for quantity, price, _ in other_units:
+                value += quantity * price * discount_fraction
+
+            return value
+
+        def get_value_pence(quantities):
+            _, units = get_discounted_units(quantities)
+
+            return multiply_pence(
+                sum(quantity * price_pence for quantity, _, price_pence
+                    in units),
+                numerator,
+                denominator,
+            )
+
+    elif rule.price_rule_type is PriceRuleType.FIXED_PRICE:
+        fixed_price = rule.price_rule_value
+        fixed_price_pence = to_pence(fixed_price)
+
+        def get_value(quantities):
+            num_applications, units = get_discounted_units(quantities)
+
+            if not num_applications:
+                return _ZERO
+
+            # A fixed price above the original cost never adds to the bill
+            return max(
+                sum(
+                    (quantity * price for quantity, price, _ in units),
+                    _ZERO,
+                ) - num_applications * fixed_price,
+                _ZERO,
+            )
+
+        def get_value_pence(quantities):
+            num_applications, units = get_discounted_units(quantities)
+
+            if not num_applications:
+                return 0
+
+            return max(
+                sum(
+                    quantity * price_pence for quantity, _, price_pence
+                    in units) - num_applications * fixed_price_pence,
+                0,
+            )
+
+    else:
+        raise ValueError(
+            f"Unsupported price rule type: {rule.price_rule_type!r}")
+
+    return get_value, get_value_pence
+
+
+def _take(quantity_by_product, products, num_units):
+    """
+    Take num_units units of products from quantity_by_product, in order,
+    returning a dict of the quantity taken of each product, or None if
+    there are not enough units
+    """
+    taken = {}
+
+    for product in products:
+        if num_units <= 0:
+            break
+
+        quantity = min(quantity_by_product.get(product, 0), num_units)
+
+        if quantity > 0:
+            taken[product] = quantity
+            num_units -= quantity
+
+    if num_units > 0:
+        return None
+
+    return taken
+
+
+def iter_rule_allocations(rule, quantity_by_product):
+    """
+    Yield the units of the basket used by 1, 2, ... applications of the
+    rule, as dicts of quantities by product (see
+    SpecialOffer._iter_allocations). Units are taken from the cheapest
+    product first, and a unit in both a trigger set and a discounted set
+    is only used once. A rule without trigger sets only yields the units
+    of all of its discounted sets.
+    """
+    if not rule.trigger_sets:
+        # Each unit of a discounted set is discounted on its own, so only
+        # the allocation of every unit is yielded, rather than one per
+        # unit (see Allocator._solve)
+        used = {
+            product: quantity_by_product.get(product, 0)
+            for discounted_set in rule.discounted_sets
+            for product in discounted_set.products
+            if quantity_by_product.get(product, 0) > 0}
+
+        if used:
+            yield used
+
+        return
+
+    if any(trigger_set.quota <= 0 for trigger_set in rule.trigger_sets):
+        return
+
+    num_applications = 0
+
+    while True:
+        num_applications += 1
+        used = {}
+
+        for trigger_set in rule.trigger_sets:
+            taken = _take(
+                quantity_by_product,
+                _get_cheapest_first(trigger_set.products),
+                num_applications * trigger_set.quota,
+            )
+
+            if taken is None:
+                return
+
+            for product, quantity in taken.items():
+                used[product] = max(used.get(product, 0), quantity)
+
+        for discounted_set in rule.discounted_sets:
+            products = _get_cheapest_first(discounted_set.products)
+
+            if discounted_set.quota is None:
+                num_units = sum(
+                    quantity_by_product.get(p, 0) for p in products)
+            else:
+                num_units = min(
+                    num_applications * discounted_set.quota,
+                    sum(quantity_by_product.get(p, 0) for p in products),
+                )
+
+            for product, quantity in _take(
+                quantity_by_product,
+                products,
+                num_units,
+            ).items():
+                used[product] = max(used.get(product, 0), quantity)
+
+        yield used
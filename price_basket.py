@@ -1,30 +1,245 @@
 #!/usr/bin/env python3
 
 import argparse
-from collections import Counter
+import codecs
+import contextlib
+import io
+import json
+import logging
+import sys
+import threading
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain, count, islice
 from pathlib import Path
 
-from product import get_products_from_json
-from special_offer import get_special_offers_from_json
-from utils import format_currency_gbp
+from allocation import Allocator
+from basket import Basket
+from basket_cache import BasketCache, get_basket_key
+from bill_writer import BillFormat, BillWriter, get_bill_obj
+from catalog import CompiledCatalog
+from product import Product, ProductTable, get_products_by_id
+from special_offer import (
+    get_special_offers_by_product,
+    get_special_offers_from_json_objs,
+)
+from stats import collect_stats, get_active_stats
+from utils import iter_json_array
 
 
+logger = logging.getLogger(__name__)
+
 _MODULE_DIR_PATH = Path(__file__).parent.resolve()
 
-with (_MODULE_DIR_PATH / 'products.json').open('rb') as file_obj:
-    _PRODUCTS_BY_ID = tuple(get_products_from_json(file_obj))
+_PRODUCTS_PATH = _MODULE_DIR_PATH / 'products.json'
+_SPECIAL_OFFERS_PATH = _MODULE_DIR_PATH / 'special_offers.json'
 
-with (_MODULE_DIR_PATH / 'special_offers.json').open('rb') as file_obj:
-    _SPECIAL_OFFERS = tuple(get_special_offers_from_json(
-        file_obj,
-        _PRODUCTS_BY_ID,
+# close releases the catalog's resources (e.g. the memory map of a
+# compiled catalog), or is None if there is nothing to release
+CatalogSnapshot = namedtuple(
+    "CatalogSnapshot",
+    (
+        "products_by_id",
+        "product_by_name",
+        "special_offers",
+        "special_offers_by_product",
+        "close",
+    ),
+    defaults=(None,),
+)
+
+# Set in each worker process by _init_worker
+_worker_engine = None
+
+
+def _get_product_by_name(products_by_id):
+    return {p.name: p for p in products_by_id.values()}
+
+
+def _index_products(products, compact=False):
+    """
+    Get (products_by_id, product_by_name) for products
+    """
+    if compact:
+        product_table = ProductTable(products)
+        return product_table.by_id, product_table.by_name
+
+    products_by_id = get_products_by_id(products)
+    return products_by_id, _get_product_by_name(products_by_id)
+
+
+def load_json_catalog(products_path, special_offers_path, compact=False):
+    """
+    If compact is true, the products are stored in a ProductTable (see
+    product.py), which uses far less memory for large catalogs
+
+    The special offers file is read and decoded in a thread while the
+    products are loaded; only resolving the special offers' product IDs
+    waits for the products.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        special_offer_objs_future = executor.submit(
+            _read_special_offer_objs,
+            special_offers_path,
+        )
+
+        products_by_id, product_by_name = _index_products(
+            _read_products(products_path).values(),
+            compact,
+        )
+
+        special_offer_objs = special_offer_objs_future.result()
+
+    special_offers = tuple(get_special_offers_from_json_objs(
+        special_offer_objs,
+        products_by_id,
     ))
 
+    return CatalogSnapshot(
+        products_by_id=products_by_id,
+        product_by_name=product_by_name,
+        special_offers=special_offers,
+        special_offers_by_product=get_special_offers_by_product(
+            special_offers,
+        ),
+    )
+
+
+def _read_products(products_path):
+    """
+    Get the products of one shard by product ID (the shard is streamed,
+    so only the products are kept, not the decoded JSON)
+    """
+    with open(products_path, 'rb') as file_obj:
+        return {p.product_id: p for p in Product.from_json(file_obj)}
+
+
+def _read_special_offer_objs(special_offers_path):
+    """
+    Get the decoded JSON objects of a special offers file (decoding
+    doesn't need the products, so it can be done while they are loaded)
+    """
+    with open(special_offers_path, 'rb') as file_obj:
+        return list(iter_json_array(file_obj))
+
+
+def _resolve_special_offers(special_offer_objs, products_by_id):
+    return tuple(get_special_offers_from_json_objs(
+        special_offer_objs,
+        products_by_id,
+    ))
+
+
+async def _load_products(products_paths, compact):
+    import asyncio
+
+    product_shards = await asyncio.gather(*(
+        asyncio.to_thread(_read_products, path)
+        for path in products_paths))
+
+    product_by_id = {}
+
+    for product_shard in product_shards:
+        product_by_id.update(product_shard)
+
+    return await asyncio.to_thread(
+        _index_products,
+        product_by_id.values(),
+        compact,
+    )
+
+
+async def _load_special_offers(special_offers_path, products_task):
+    import asyncio
+
+    # The file is read while the products are loaded, but the special
+    # offers can't be resolved without the products
+    special_offer_objs = await asyncio.to_thread(
+        _read_special_offer_objs,
+        special_offers_path,
+    )
+    products_by_id, _ = await products_task
+
+    return await asyncio.to_thread(
+        _resolve_special_offers,
+        special_offer_objs,
+        products_by_id,
+    )
+
+
+async def load_json_catalog_async(
+        products_paths,
+        special_offers_paths,
+        compact=False,
+):
+    """
+    Load a catalog from any number of products and special offers files
+    (shards), as load_json_catalog does for one of each
+
+    The products and special offers files are all read concurrently, in
+    threads. The special offers reference the products, so they are
+    resolved once the products are loaded, as in load_json_catalog. If
+    the same product ID is in more than one shard, the product from the
+    last shard is kept. Special offers keep their order, shard by shard.
+    """
+    import asyncio
+
+    products_task = asyncio.ensure_future(
+        _load_products(products_paths, compact),
+    )
 
-def _parse_args(products_by_id):
-    product_by_name = {
-        p.name: p for p in products_by_id if p is not None}
+    (products_by_id, product_by_name), *special_offer_shards = (
+        await asyncio.gather(
+            products_task,
+            *(
+                _load_special_offers(path, products_task)
+                for path in special_offers_paths),
+        ))
 
+    special_offers = tuple(chain.from_iterable(special_offer_shards))
+
+    return CatalogSnapshot(
+        products_by_id=products_by_id,
+        product_by_name=product_by_name,
+        special_offers=special_offers,
+        special_offers_by_product=get_special_offers_by_product(
+            special_offers,
+        ),
+    )
+
+
+def load_json_catalog_shards(
+        products_paths,
+        special_offers_paths,
+        compact=False,
+):
+    """
+    Run load_json_catalog_async (it can't be called from a running event
+    loop, so use a thread, e.g. with loop.run_in_executor)
+    """
+    import asyncio
+
+    return asyncio.run(load_json_catalog_async(
+        products_paths,
+        special_offers_paths,
+        compact,
+    ))
+
+
+def load_compiled_catalog(catalog_path):
+    catalog = CompiledCatalog(catalog_path)
+
+    return CatalogSnapshot(
+        products_by_id=catalog.products_by_id,
+        product_by_name=catalog.product_by_name,
+        special_offers=catalog.special_offers,
+        special_offers_by_product=catalog.special_offers_by_product,
+        close=catalog.close,
+    )
+
+
+def _parse_args():
     parser = argparse.ArgumentParser(
         description=(
             "Price a basket of goods, accounting for special offers"),
@@ -33,24 +248,335 @@ def _parse_args(products_by_id):
     parser.add_argument(
         "products",
         metavar="PRODUCT",
-        type=product_by_name.__getitem__,
-        nargs="+",
+        nargs="*",
         help="Name of product",
     )
 
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Read one basket per line from stdin, as a JSON list of "
+            "product names, and write one JSON result per line to "
+            "stdout"),
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes to price baskets with "
+            "(--stream only)"),
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help=(
+            "Number of baskets sent to a worker process at a time "
+            "(--stream only)"),
+    )
+
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Keep the catalog loaded and price baskets sent over a "
+            "socket, using the same protocol as --stream (one JSON "
+            "basket per line, one JSON result per line)"),
+    )
+
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        help="Path of the Unix domain socket to listen on (--serve only)",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Localhost TCP port to listen on (--serve only)",
+    )
+
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Check the catalog files for changes every SECONDS, and "
+            "reload them when they change (--serve only). The catalog "
+            "is also reloaded on SIGHUP."),
+    )
+
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=(
+            "Write the number of calls, hits (positive discounts) and "
+            "time of each special offer type and special offer to "
+            "stderr (not with --allocate)"),
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        metavar="N",
+        help=(
+            "Cache the results of up to N baskets, so that repeated "
+            "baskets are not priced again (--stream and --serve only; "
+            "each worker process has its own cache)"),
+    )
+
+    parser.add_argument(
+        "--allocate",
+        action="store_true",
+        help=(
+            "Count each unit of a basket towards at most one special "
+            "offer, choosing the special offers that give the largest "
+            "total discount"),
+    )
+
+    parser.add_argument(
+        "--allocation-budget",
+        type=float,
+        metavar="MS",
+        help=(
+            "Longest time to spend allocating a basket with --allocate, "
+            "in milliseconds, before falling back to a greedy allocation "
+            "(default: 50)"),
+    )
+
+    parser.add_argument(
+        "--products",
+        dest="products_paths",
+        type=Path,
+        action="append",
+        help=(
+            "Path of the products JSON (repeat for a catalog split "
+            "across several files, which are loaded concurrently)"),
+    )
+
+    parser.add_argument(
+        "--special-offers",
+        dest="special_offers_paths",
+        type=Path,
+        action="append",
+        help=(
+            "Path of the special offers JSON (repeat for a catalog split "
+            "across several files, which are loaded concurrently)"),
+    )
+
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help=(
+            "Store the JSON catalog's products in a compact, "
+            "column-oriented table"),
+    )
+
+    parser.add_argument(
+        "--catalog",
+        type=Path,
+        help=(
+            "Path of a compiled catalog (see compile_catalog.py) to use "
+            "instead of the JSON catalog"),
+    )
+
+    parser.add_argument(
+        "--pence",
+        action="store_true",
+        help="Use integer (pence) arithmetic rather than Decimal",
+    )
+
+    parser.add_argument(
+        "--format",
+        type=BillFormat,
+        choices=tuple(BillFormat),
+        metavar="{" + ",".join(f.value for f in BillFormat) + "}",
+        help=(
+            "Output format of the bills (default: text for PRODUCT, "
+            "json for --stream; --serve always writes json)"),
+    )
+
     args = parser.parse_args()
-    return Counter(args.products)
 
+    if args.serve:
+        if args.stream or args.products:
+            parser.error("--serve cannot be used with --stream or PRODUCT")
+
+        if (args.socket is None) == (args.port is None):
+            parser.error("--serve requires one of --socket or --port")
+    elif (
+            args.socket is not None or
+            args.port is not None or
+            args.watch is not None
+    ):
+        parser.error("--socket, --port and --watch require --serve")
+    elif not args.stream and not args.products:
+        parser.error("at least one PRODUCT is required")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    if args.watch is not None and not args.watch > 0:
+        parser.error("--watch must be positive")
+
+    if args.cache_size is not None and args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+
+    if args.format is not None and args.serve:
+        parser.error("--format cannot be used with --serve")
+
+    if args.format is None:
+        args.format = BillFormat.JSON if args.stream else BillFormat.TEXT
+
+    if args.allocation_budget is not None:
+        if not args.allocate:
+            parser.error("--allocation-budget requires --allocate")
+
+        if not args.allocation_budget > 0:
+            parser.error("--allocation-budget must be positive")
+
+    if args.stats and args.allocate:
+        # The allocator evaluates special offers by memo key, around the
+        # stats (see _get_discounts)
+        parser.error("--stats cannot be used with --allocate")
+
+    if args.products_paths is None:
+        args.products_paths = [_PRODUCTS_PATH]
+
+    if args.special_offers_paths is None:
+        args.special_offers_paths = [_SPECIAL_OFFERS_PATH]
+
+    return args
+
+
+def _get_original_total(quantity_by_product, in_pence=False):
+    if in_pence:
+        return sum(
+            quantity * product.price_pence
+            for product, quantity in quantity_by_product.items())
 
-def _get_original_total(quantity_by_product):
     return sum(
         quantity * product.price
         for product, quantity in quantity_by_product.items())
 
 
-def _get_discounts(special_offers, quantity_by_product):
-    for special_offer in special_offers:
-        discount = special_offer.get_discount(quantity_by_product)
+def _get_positioned_special_offers(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product=None,
+):
+    """
+    Get (position, special_offer) pairs for the special offers to
+    evaluate, in their original order: if special_offers_by_product is
+    given, only the special offers that reference at least one product
+    in the basket
+    """
+    if special_offers_by_product is None:
+        return enumerate(special_offers)
+
+    special_offer_by_position = {}
+
+    for product in quantity_by_product:
+        special_offer_by_position.update(
+            special_offers_by_product.get(product, ()),
+        )
+
+    return sorted(special_offer_by_position.items())
+
+
+def _iter_discounts_with_stats(
+        stats,
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product=None,
+        in_pence=False,
+):
+    for position, special_offer in _get_positioned_special_offers(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product,
+    ):
+        discount = stats.get_discount(
+            position,
+            special_offer,
+            quantity_by_product,
+            in_pence,
+        )
+
+        if discount.value > 0:
+            yield discount
+
+
+def _get_discounts(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product=None,
+        in_pence=False,
+        allocator=None,
+):
+    """
+    Get an iterator of the discounts with a positive value. Each special
+    offer evaluated is recorded if stats are being collected (see
+    stats.py).
+
+    If allocator is given (see allocation.py), each unit of the basket
+    counts towards at most one special offer (stats are not collected).
+    """
+    if allocator is not None:
+        return iter(allocator.get_discounts(
+            quantity_by_product,
+            _get_positioned_special_offers(
+                special_offers,
+                quantity_by_product,
+                special_offers_by_product,
+            ),
+            in_pence,
+        ))
+
+    stats = get_active_stats()
+
+    if stats is None:
+        return _iter_discounts(
+            special_offers,
+            quantity_by_product,
+            special_offers_by_product,
+            in_pence,
+        )
+
+    stats.baskets += 1
+
+    return _iter_discounts_with_stats(
+        stats,
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product,
+        in_pence,
+    )
+
+
+def _iter_discounts(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product=None,
+        in_pence=False,
+):
+    for _, special_offer in _get_positioned_special_offers(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product,
+    ):
+        if in_pence:
+            discount = special_offer.get_discount_pence(quantity_by_product)
+        else:
+            discount = special_offer.get_discount(quantity_by_product)
+
         if discount.value > 0:
             yield discount
 
@@ -58,33 +584,861 @@ def _get_discounts(special_offers, quantity_by_product):
 def get_original_total_and_discounts(
         quantity_by_product,
         special_offers,
+        special_offers_by_product=None,
+        in_pence=False,
+        allocator=None,
 ):
-    original_total = _get_original_total(quantity_by_product)
-    discounts = _get_discounts(special_offers, quantity_by_product)
+    """
+    If special_offers_by_product (see get_special_offers_by_product) is
+    given, only the special offers referencing a product in the basket
+    are evaluated. Otherwise, every special offer is evaluated.
+
+    If in_pence is true, the original total and the discount values are
+    integer amounts in pence, rather than Decimal amounts in pounds.
+
+    If allocator is given (an Allocator, see allocation.py), each unit
+    of the basket counts towards at most one special offer, rather than
+    every special offer being applied to the whole basket.
+    """
+    original_total = _get_original_total(quantity_by_product, in_pence)
+    discounts = _get_discounts(
+        special_offers,
+        quantity_by_product,
+        special_offers_by_product,
+        in_pence,
+        allocator,
+    )
 
     return original_total, discounts
 
 
-def _print_summary(original_total, discounts):
-    subtotal = original_total
+def price_baskets(
+        baskets,
+        special_offers,
+        special_offers_by_product=None,
+        in_pence=False,
+        allocator=None,
+):
+    """
+    Price a sequence of baskets (Counter objects) in one call
 
-    for discount in discounts:
-        print(f"Subtotal: {format_currency_gbp(subtotal)}")
-        print(f"{discount.description}")
-        subtotal -= discount.value
+    A convenience wrapper around get_original_total_and_discounts, which
+    does the same work for each basket. Only the index of the special
+    offers by product (unless special_offers_by_product is given) and
+    the choice of evaluator (whether stats are being collected, and
+    whether there is an allocator) are done once per call. The discounts
+    are returned as tuples rather than generators.
 
-    print(f"Total: {format_currency_gbp(subtotal)}")
+    Returns a list of (original_total, discounts) pairs, in basket order.
+    """
+    if special_offers_by_product is None:
+        special_offers_by_product = get_special_offers_by_product(
+            special_offers,
+        )
 
+    if allocator is None and get_active_stats() is None:
+        get_discounts = _iter_discounts
+    else:
+        get_discounts = partial(_get_discounts, allocator=allocator)
 
-def main():
-    quantity_by_product = _parse_args(_PRODUCTS_BY_ID)
+    return [
+        (
+            _get_original_total(quantity_by_product, in_pence),
+            tuple(get_discounts(
+                special_offers,
+                quantity_by_product,
+                special_offers_by_product,
+                in_pence,
+            )),
+        )
+        for quantity_by_product in baskets]
+
+
+class PricingEngine:
+    """
+    Prices baskets against one catalog of products and special offers
+
+    The catalog is loaded by calling load_catalog (which returns a
+    CatalogSnapshot) the first time it is needed, so creating an engine
+    is cheap. Use from_json or from_compiled_catalog to create an engine
+    from catalog files. Several engines, with different catalogs, can be
+    used in one process.
+
+    Call reload to swap in a newly loaded catalog. Each catalog is an
+    immutable snapshot, and each pricing call uses the snapshot that was
+    current when it started.
+
+    If cache_size is given, the results of up to cache_size baskets are
+    kept in an LRU cache (see basket_cache.py), so that a basket priced
+    again is not re-evaluated. The cache is cleared when the catalog is
+    reloaded.
+
+    If allocator is given (see allocation.py), each unit of a basket
+    counts towards at most one special offer. Baskets from create_basket
+    don't use the allocator.
+    """
+
+    def __init__(self, load_catalog, cache_size=None, allocator=None):
+        self._load_catalog = load_catalog
+        self._catalog = None
+        self._lock = threading.Lock()
+
+        self._cache_size = cache_size
+        self._allocator = allocator
+
+        if cache_size is None:
+            self._cache = None
+        else:
+            self._cache = BasketCache(cache_size)
+
+    def __repr__(self):
+        return f"PricingEngine({self._load_catalog!r})"
+
+    @classmethod
+    def from_json(
+            cls,
+            products_path=_PRODUCTS_PATH,
+            special_offers_path=_SPECIAL_OFFERS_PATH,
+            compact=False,
+            cache_size=None,
+            allocator=None,
+    ):
+        return cls(
+            partial(
+                load_json_catalog,
+                products_path,
+                special_offers_path,
+                compact,
+            ),
+            cache_size,
+            allocator,
+        )
+
+    @classmethod
+    def from_json_shards(
+            cls,
+            products_paths,
+            special_offers_paths,
+            compact=False,
+            cache_size=None,
+            allocator=None,
+    ):
+        """
+        Load the catalog with load_json_catalog_shards
+        """
+        return cls(
+            partial(
+                load_json_catalog_shards,
+                tuple(products_paths),
+                tuple(special_offers_paths),
+                compact,
+            ),
+            cache_size,
+            allocator,
+        )
+
+    @classmethod
+    def from_compiled_catalog(
+            cls,
+            catalog_path,
+            cache_size=None,
+            allocator=None,
+    ):
+        return cls(
+            partial(load_compiled_catalog, catalog_path),
+            cache_size,
+            allocator,
+        )
+
+    @property
+    def catalog(self):
+        catalog = self._catalog
+
+        if catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = self._load_catalog()
+
+                catalog = self._catalog
+
+        return catalog
+
+    def reload(self):
+        """
+        Load the catalog again, and swap it in for new pricing calls
+
+        Pricing is not paused while the catalog loads, and calls already
+        in progress finish with the previous catalog. If loading fails,
+        the exception is raised and the previous catalog is kept.
+
+        The previous catalog is not closed, as it may still be in use
+        (e.g. by a Basket); call its close, if it has one, once it is
+        not.
+        """
+        # Only concurrent reloads (and the first load) wait on the lock,
+        # so that the catalogs are swapped in the order they are loaded
+        with self._lock:
+            catalog = self._catalog = self._load_catalog()
+
+        if self._cache is not None:
+            self._cache.clear()
+
+        if self._allocator is not None:
+            self._allocator.clear_cache()
+
+        return catalog
+
+    def cache_info(self):
+        """
+        Get the cache's hits, misses, evictions and size (a CacheInfo),
+        or None if the engine has no cache
+        """
+        if self._cache is None:
+            return None
+
+        return self._cache.info()
+
+    def _get_cached_original_total_and_discounts(
+            self,
+            catalog,
+            quantity_by_product,
+            in_pence,
+    ):
+        cache = self._cache
+        key = get_basket_key(quantity_by_product, in_pence)
+
+        result = cache.get(catalog, key)
+
+        if result is None:
+            original_total, discounts = get_original_total_and_discounts(
+                quantity_by_product,
+                catalog.special_offers,
+                catalog.special_offers_by_product,
+                in_pence,
+                self._allocator,
+            )
+
+            result = original_total, tuple(discounts)
+            cache.put(catalog, key, result)
+
+        return result
+
+    def get_original_total_and_discounts(
+            self,
+            quantity_by_product,
+            in_pence=False,
+    ):
+        """
+        If the engine has a cache, the discounts are a tuple rather than
+        an iterator
+        """
+        catalog = self.catalog
+
+        if self._cache is not None:
+            return self._get_cached_original_total_and_discounts(
+                catalog,
+                quantity_by_product,
+                in_pence,
+            )
+
+        return get_original_total_and_discounts(
+            quantity_by_product,
+            catalog.special_offers,
+            catalog.special_offers_by_product,
+            in_pence,
+            self._allocator,
+        )
+
+    def price_baskets(self, baskets, in_pence=False):
+        catalog = self.catalog
+
+        if self._cache is not None:
+            return [
+                self._get_cached_original_total_and_discounts(
+                    catalog,
+                    quantity_by_product,
+                    in_pence,
+                )
+                for quantity_by_product in baskets]
+
+        return price_baskets(
+            baskets,
+            catalog.special_offers,
+            catalog.special_offers_by_product,
+            in_pence,
+            self._allocator,
+        )
+
+    def create_basket(self, in_pence=False):
+        """
+        Create an empty Basket (see basket.py), which is repriced as
+        products are added and removed
+        """
+        catalog = self.catalog
+
+        return Basket(
+            catalog.special_offers,
+            catalog.special_offers_by_product,
+            in_pence,
+        )
+
+
+def _parse_basket(line, product_by_name):
+    """
+    Parse a basket from a JSON list of product names, e.g.:
+
+    ["Soup", "Soup", "Bread"]
+    """
+    product_names = json.loads(line)
+
+    if type(product_names) is not list:
+        raise TypeError
+
+    return Counter(map(product_by_name.__getitem__, product_names))
+
+
+def _iter_lines_flushing(file_obj, out_file_obj, chunk_size=2 ** 16):
+    """
+    Yield the lines of file_obj, flushing out_file_obj before each read
+    that may wait for more input, so that a consumer that waits for the
+    result of each line it sends (e.g. a co-process) gets it without
+    waiting for EOF
+
+    The input is read in chunks of whatever is ready (up to chunk_size
+    bytes) from file_obj's binary buffer, so the output is flushed once
+    per chunk rather than once per line. Nothing must have been read
+    from file_obj before.
+    """
+    buffer = getattr(file_obj, "buffer", None)
+
+    if buffer is None:
+        # e.g. a StringIO, which is all in memory
+        yield from file_obj
+        return
+
+    decoder = codecs.getincrementaldecoder(file_obj.encoding)(
+        file_obj.errors,
+    )
+    partial_line = ""
+    is_first_read = True
+
+    while True:
+        if not is_first_read:
+            out_file_obj.flush()
+
+        is_first_read = False
+
+        # read1 returns as soon as some input is ready
+        chunk = buffer.read1(chunk_size)
+        text = partial_line + decoder.decode(chunk, final=not chunk)
+
+        if not chunk:
+            if text:
+                yield text
+
+            return
+
+        *lines, partial_line = text.split("\n")
+
+        for line in lines:
+            yield f"{line}\n"
+
+
+def _price_stream(lines, engine, in_pence=False, first_line_num=1):
+    """
+    Price one basket per line, yielding (original_total, discounts)
+    pairs in line order. None is yielded for a basket that is invalid,
+    including a blank line, so that there is one result per line.
+    """
+    product_by_name = engine.catalog.product_by_name
+
+    for line_num, line in enumerate(lines, first_line_num):
+        try:
+            quantity_by_product = _parse_basket(line, product_by_name)
+        except (KeyError, TypeError, ValueError):
+            logger.error("Basket on line %d is invalid", line_num)
+            yield None
+            continue
+
+        original_total, discounts = engine.get_original_total_and_discounts(
+            quantity_by_product,
+            in_pence,
+        )
+
+        yield original_total, tuple(discounts)
+
+
+def _write_bills(
+        results,
+        file_obj,
+        in_pence=False,
+        bill_format=BillFormat.JSON,
+        separate_first=False,
+):
+    """
+    Write the bill of each result (see bill_writer.py)
+    """
+    with BillWriter(
+        file_obj,
+        bill_format,
+        in_pence,
+        separate_first=separate_first,
+    ) as bill_writer:
+        bill_writer.write_many(results)
+
+
+def _init_worker(load_catalog, cache_size, allocator):
+    global _worker_engine
+    _worker_engine = PricingEngine(load_catalog, cache_size, allocator)
+
+
+def _price_chunk(
+        lines,
+        first_line_num,
+        in_pence,
+        with_stats=False,
+        bill_format=BillFormat.JSON,
+):
+    """
+    Price a chunk of lines in a worker process, returning the bills as
+    one string, and the chunk's PricingStats if with_stats is true
+    (otherwise None)
+    """
+    if with_stats:
+        stats_context = collect_stats()
+    else:
+        stats_context = contextlib.nullcontext()
+
+    with stats_context as stats:
+        results = _price_stream(
+            lines,
+            _worker_engine,
+            in_pence,
+            first_line_num,
+        )
+
+        with io.StringIO() as file_obj:
+            _write_bills(
+                results,
+                file_obj,
+                in_pence,
+                bill_format,
+                separate_first=first_line_num > 1,
+            )
+            return file_obj.getvalue(), stats
+
+
+def _get_chunks(lines, chunk_size):
+    """
+    Split lines into lists of at most chunk_size lines, yielding
+    (first_line_num, chunk) pairs
+    """
+    lines = iter(lines)
+
+    for first_line_num in count(1, chunk_size):
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
 
-    original_total, discounts = get_original_total_and_discounts(
+        yield first_line_num, chunk
+
+
+def _get_chunk_text(future, stats=None):
+    text, chunk_stats = future.result()
+
+    if stats is not None:
+        stats.update(chunk_stats)
+
+    return text
+
+
+def _price_stream_parallel(
+        lines,
+        engine,
+        workers,
+        chunk_size,
+        in_pence=False,
+        stats=None,
+        bill_format=BillFormat.JSON,
+):
+    """
+    Price one basket per line across a pool of worker processes, each of
+    which loads the engine's catalog once. Yields one string of bills
+    (in bill_format) per chunk, in input order.
+
+    If stats (a PricingStats) is given, the stats collected by the
+    workers are added to it.
+
+    If the engine uses a compiled catalog, each worker maps the same
+    file, so the catalog's pages are shared between them.
+
+    At most two chunks per worker are in flight at a time, so memory
+    stays bounded however many lines there are.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            engine._load_catalog,
+            engine._cache_size,
+            engine._allocator,
+        ),
+    ) as executor:
+        pending = deque()
+
+        for first_line_num, chunk in _get_chunks(lines, chunk_size):
+            pending.append(executor.submit(
+                _price_chunk,
+                chunk,
+                first_line_num,
+                in_pence,
+                stats is not None,
+                bill_format,
+            ))
+
+            if len(pending) >= workers * 2:
+                yield _get_chunk_text(pending.popleft(), stats)
+
+        while pending:
+            yield _get_chunk_text(pending.popleft(), stats)
+
+
+async def _handle_connection(reader, writer, engine, in_pence=False):
+    """
+    Price one basket per line received, writing one JSON result per
+    line (see bill_writer.py), until the client disconnects
+    """
+    try:
+        for line_num in count(1):
+            try:
+                line = await reader.readline()
+            except ValueError:
+                logger.error("Basket on line %d is too long", line_num)
+                break
+
+            if not line:
+                break
+
+            for result in _price_stream((line,), engine, in_pence, line_num):
+                writer.write(json.dumps(
+                    get_bill_obj(result, in_pence),
+                ).encode())
+                writer.write(b"\n")
+
+            await writer.drain()
+    except ConnectionError:
+        logger.info("Client disconnected")
+    finally:
+        writer.close()
+
+
+async def start_server(engine, socket_path=None, port=None, in_pence=False):
+    """
+    Start serving baskets on a Unix domain socket (socket_path) or a
+    localhost TCP port, returning the asyncio Server
+
+    The catalog is loaded before the server starts, so that the first
+    request is not delayed.
+    """
+    import asyncio
+
+    await asyncio.get_running_loop().run_in_executor(
+        None,
+        lambda: engine.catalog,
+    )
+
+    handle_connection = partial(
+        _handle_connection,
+        engine=engine,
+        in_pence=in_pence,
+    )
+
+    if socket_path is not None:
+        return await asyncio.start_unix_server(
+            handle_connection,
+            socket_path,
+        )
+
+    return await asyncio.start_server(
+        handle_connection,
+        "127.0.0.1",
+        port,
+    )
+
+
+def _reload_catalog(engine, is_retry=False):
+    """
+    Reload the engine's catalog, returning whether it succeeded
+
+    If is_retry is true (the previous reload failed too), a failure is
+    logged in one line rather than with its traceback.
+    """
+    try:
+        engine.reload()
+    except Exception as exc:
+        if is_retry:
+            logger.warning(
+                "Catalog reload failed again, keeping previous catalog: "
+                "%r",
+                exc,
+            )
+        else:
+            logger.exception(
+                "Catalog reload failed, keeping previous catalog")
+
+        return False
+
+    logger.info("Catalog reloaded")
+    return True
+
+
+async def _reload_catalog_async(engine, is_retry=False):
+    """
+    Reload the engine's catalog in a thread (see _reload_catalog), then
+    close the previous catalog (see CatalogSnapshot). The server prices
+    each basket synchronously on the event loop's thread, so once this
+    is back on it, no basket is still being priced with the previous
+    catalog.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    previous_catalog = engine._catalog
+
+    reloaded = await loop.run_in_executor(
+        None,
+        _reload_catalog,
+        engine,
+        is_retry,
+    )
+
+    if (
+            reloaded and
+            previous_catalog is not None and
+            previous_catalog.close is not None
+    ):
+        previous_catalog.close()
+
+    return reloaded
+
+
+def _get_mtimes(paths):
+    mtimes = []
+
+    for path in paths:
+        try:
+            mtimes.append(path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            # The file may be in the middle of being replaced
+            mtimes.append(None)
+
+    return tuple(mtimes)
+
+
+async def _watch_catalog(engine, paths, interval):
+    """
+    Reload the catalog in the background whenever the modification time
+    of one of the catalog files changes, checking every interval seconds
+    """
+    import asyncio
+
+    mtimes = _get_mtimes(paths)
+    is_retry = False
+
+    while True:
+        await asyncio.sleep(interval)
+
+        new_mtimes = _get_mtimes(paths)
+
+        if new_mtimes == mtimes:
+            continue
+
+        # If the reload fails (e.g. a file is half written), it is tried
+        # again at the next check, and only the first failure is logged
+        # with its traceback
+        if await _reload_catalog_async(engine, is_retry):
+            mtimes = new_mtimes
+            is_retry = False
+        else:
+            is_retry = True
+
+
+async def _serve(
+        engine,
+        socket_path=None,
+        port=None,
+        in_pence=False,
+        watch_paths=(),
+        watch_interval=None,
+):
+    """
+    Serve until interrupted. The catalog is reloaded in the background
+    on SIGHUP, and when a file in watch_paths changes (if watch_interval
+    is given).
+    """
+    import asyncio
+    import signal
+
+    loop = asyncio.get_running_loop()
+    server = await start_server(engine, socket_path, port, in_pence)
+
+    # The loop only keeps weak references to tasks
+    reload_tasks = set()
+
+    def reload_catalog():
+        task = loop.create_task(_reload_catalog_async(engine))
+        reload_tasks.add(task)
+        task.add_done_callback(reload_tasks.discard)
+
+    loop.add_signal_handler(signal.SIGHUP, reload_catalog)
+
+    async with server:
+        for sock in server.sockets:
+            logger.info("Listening on %s", sock.getsockname())
+
+        if watch_interval is None:
+            await server.serve_forever()
+        else:
+            await asyncio.gather(
+                server.serve_forever(),
+                _watch_catalog(engine, watch_paths, watch_interval),
+            )
+
+
+def _run(args, engine, catalog_paths, stats=None):
+    if args.serve:
+        # asyncio (and the other server modules) are only imported when
+        # they are used, as importing them takes far longer than pricing
+        # a basket
+        import asyncio
+
+        try:
+            asyncio.run(_serve(
+                engine,
+                args.socket,
+                args.port,
+                args.pence,
+                catalog_paths,
+                args.watch,
+            ))
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    if args.stream and args.workers > 1:
+        for text in _price_stream_parallel(
+            sys.stdin,
+            engine,
+            args.workers,
+            args.chunk_size,
+            args.pence,
+            stats,
+            args.format,
+        ):
+            sys.stdout.write(text)
+
+        return
+
+    if args.stream:
+        results = _price_stream(
+            _iter_lines_flushing(sys.stdin, sys.stdout),
+            engine,
+            args.pence,
+        )
+
+        # Bills are written through stdout's own buffer, which is
+        # flushed whenever the input runs dry
+        with BillWriter(
+            sys.stdout,
+            args.format,
+            args.pence,
+            buffer_size=None,
+        ) as bill_writer:
+            bill_writer.write_many(results)
+
+        return
+
+    try:
+        quantity_by_product = Counter(map(
+            engine.catalog.product_by_name.__getitem__,
+            args.products,
+        ))
+    except KeyError as exc:
+        sys.exit(f"Product not found: {exc.args[0]}")
+
+    original_total, discounts = engine.get_original_total_and_discounts(
         quantity_by_product,
-        _SPECIAL_OFFERS,
+        args.pence,
     )
 
-    _print_summary(original_total, discounts)
+    _write_bills(
+        ((original_total, discounts),),
+        sys.stdout,
+        args.pence,
+        args.format,
+    )
+
+
+def main():
+    args = _parse_args()
+
+    if not args.allocate:
+        allocator = None
+    elif args.allocation_budget is None:
+        allocator = Allocator()
+    else:
+        allocator = Allocator(max_seconds=args.allocation_budget / 1000)
+
+    if args.catalog is not None:
+        engine = PricingEngine.from_compiled_catalog(
+            args.catalog,
+            args.cache_size,
+            allocator,
+        )
+        catalog_paths = (args.catalog,)
+    elif (
+            len(args.products_paths) == 1 and
+            len(args.special_offers_paths) == 1
+    ):
+        engine = PricingEngine.from_json(
+            *args.products_paths,
+            *args.special_offers_paths,
+            args.compact,
+            args.cache_size,
+            allocator,
+        )
+        catalog_paths = (
+            *args.products_paths,
+            *args.special_offers_paths,
+        )
+    else:
+        engine = PricingEngine.from_json_shards(
+            args.products_paths,
+            args.special_offers_paths,
+            args.compact,
+            args.cache_size,
+            allocator,
+        )
+        catalog_paths = (
+            *args.products_paths,
+            *args.special_offers_paths,
+        )
+
+    if not args.stats:
+        _run(args, engine, catalog_paths)
+        return
+
+    with collect_stats() as stats:
+        try:
+            _run(args, engine, catalog_paths, stats)
+        finally:
+            print(
+                stats.format_report(engine.catalog.special_offers),
+                file=sys.stderr,
+            )
 
 
 if __name__ == '__main__':
@@ -1,8 +1,17 @@
-import json
 import logging
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
 
 from decimal import Decimal
 
+from money import (
+    from_coefficient_and_exponent,
+    to_coefficient_and_exponent,
+    to_pence,
+)
+from utils import iter_json_array
+
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +22,7 @@ class Product:
         self.product_id = product_id
         self.name = name
         self.price = price
+        self.price_pence = to_pence(price)
 
     def __repr__(self):
         return f"Product(id={self.product_id!r}, name={self.name!r})"
@@ -45,7 +55,7 @@ class Product:
 
     @classmethod
     def from_json(cls, file_obj):
-        product_obj_seq = json.load(file_obj)
+        product_obj_seq = iter_json_array(file_obj)
 
         product_id_set = set()
         name_set = set()
@@ -83,14 +93,323 @@ class Product:
             yield cls(product_id=product_id, name=name, price=price)
 
 
+class ProductsById(Mapping):
+    """
+    Products by product ID
+
+    If the IDs are dense (at least half of the IDs between the lowest
+    and highest are used), products are stored in a tuple indexed by ID
+    (offset by the lowest ID), for O(1) lookup. Otherwise, they are
+    stored in ID order alongside a sorted array of IDs, for O(log n)
+    lookup by binary search, so that a few very high IDs don't need a
+    huge tuple.
+    """
+
+    # Minimum ratio of the number of products to the range of IDs, for
+    # the dense layout to be used
+    _MIN_DENSITY = 0.5
+
+    def __init__(self, products=()):
+        products = sorted(products, key=lambda p: p.product_id)
+
+        self._len = len(products)
+        self._dense = None
+        self._ids = None
+        self._products = None
+
+        if not products:
+            self._products = ()
+            self._ids = array("q")
+            return
+
+        min_id = products[0].product_id
+        id_range = products[-1].product_id - min_id + 1
+
+        if self._len >= id_range * self._MIN_DENSITY:
+            dense = [None] * id_range
+            for product in products:
+                dense[product.product_id - min_id] = product
+
+            self._min_id = min_id
+            self._dense = tuple(dense)
+        else:
+            self._ids = array("q", (p.product_id for p in products))
+            self._products = tuple(products)
+
+    def __repr__(self):
+        layout = "sparse" if self._dense is None else "dense"
+        return f"ProductsById(len={self._len!r}, layout={layout!r})"
+
+    def __getitem__(self, product_id):
+        if self._dense is not None:
+            ix = product_id - self._min_id
+
+            if 0 <= ix < len(self._dense):
+                product = self._dense[ix]
+                if product is not None:
+                    return product
+
+            raise KeyError(product_id)
+
+        ix = bisect_left(self._ids, product_id)
+
+        if ix < self._len and self._ids[ix] == product_id:
+            return self._products[ix]
+
+        raise KeyError(product_id)
+
+    def __iter__(self):
+        for product in self._iter_products():
+            yield product.product_id
+
+    def __len__(self):
+        return self._len
+
+    def _iter_products(self):
+        if self._dense is not None:
+            return (p for p in self._dense if p is not None)
+
+        return iter(self._products)
+
+    def values(self):
+        """
+        Products, in product ID order
+        """
+        return list(self._iter_products())
+
+
+def get_products_by_id(products):
+    """
+    Get products by product ID (see ProductsById). If the same product ID
+    appears more than once, the last product with that ID is kept.
+    """
+    product_by_id = {p.product_id: p for p in products}
+
+    return ProductsById(product_by_id.values())
+
+
 def get_products_from_json(file_obj):
-    product_by_id = {
-        p.product_id: p for p in Product.from_json(file_obj)}
+    return get_products_by_id(Product.from_json(file_obj))
+
+
+class ProductRecord:
+    """
+    A product in a ProductTable, with the same attributes as Product
+
+    Records are views of a row of the table, created on access. Records
+    of the same row of the same table are equal (and hash equally), so
+    they can be used interchangeably, e.g. as keys of a basket.
+    """
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __repr__(self):
+        return f"Product(id={self.product_id!r}, name={self.name!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ProductRecord):
+            return NotImplemented
+
+        return self._table is other._table and self._row == other._row
+
+    def __hash__(self):
+        return hash((id(self._table), self._row))
+
+    @property
+    def product_id(self):
+        return self._table._ids[self._row]
+
+    @property
+    def name(self):
+        return self._table._get_name(self._row)
+
+    @property
+    def price(self):
+        row = self._row
+        table = self._table
+        return from_coefficient_and_exponent(
+            table._price_coefficients[row],
+            table._price_exponents[row],
+        )
+
+    @property
+    def price_pence(self):
+        row = self._row
+        table = self._table
+        exponent = table._price_exponents[row]
+
+        if exponent >= -2:
+            return table._price_coefficients[row] * 10 ** (exponent + 2)
+
+        return to_pence(self.price)
+
+
+class _ProductTableById(Mapping):
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, product_id):
+        row = self._table._get_row_by_id(product_id)
+        if row is None:
+            raise KeyError(product_id)
+
+        return ProductRecord(self._table, row)
+
+    def __iter__(self):
+        return iter(self._table._ids)
+
+    def __len__(self):
+        return len(self._table)
+
+
+class _ProductTableByName(Mapping):
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, name):
+        row = self._table._get_row_by_name(name)
+        if row is None:
+            raise KeyError(name)
+
+        return ProductRecord(self._table, row)
+
+    def __iter__(self):
+        return map(self._table._get_name, range(len(self._table)))
+
+    def __len__(self):
+        return len(self._table)
+
+
+class ProductTable(Sequence):
+    """
+    Products stored column-wise in packed arrays, sorted by product ID
+
+    Each product takes a few dozen bytes (plus the length of its name),
+    rather than a Product object with its own __dict__, name and
+    Decimal price. Indexing the table by row gives a ProductRecord.
+    Products can also be looked up by ID or by name (binary search),
+    through the by_id and by_name mappings.
+
+    If the same product ID appears more than once, the last product
+    with that ID is kept (as with get_products_from_json).
+    """
+
+    def __init__(self, products=()):
+        ids = array("q")
+        price_coefficients = array("q")
+        price_exponents = array("b")
+        name_offsets = array("I", (0,))
+        names = bytearray()
+
+        for product in products:
+            coefficient, exponent = to_coefficient_and_exponent(
+                product.price,
+            )
+
+            ids.append(product.product_id)
+            price_coefficients.append(coefficient)
+            price_exponents.append(exponent)
+            names += product.name.encode("utf-8")
+            name_offsets.append(len(names))
+
+        rows = self._get_sorted_unique_rows(ids)
+
+        self._ids = array("q", map(ids.__getitem__, rows))
+        self._price_coefficients = array(
+            "q",
+            map(price_coefficients.__getitem__, rows),
+        )
+        self._price_exponents = array(
+            "b",
+            map(price_exponents.__getitem__, rows),
+        )
+
+        self._name_offsets = array("I", (0,))
+        sorted_names = bytearray()
+
+        for row in rows:
+            sorted_names += names[name_offsets[row]:name_offsets[row + 1]]
+            self._name_offsets.append(len(sorted_names))
+
+        self._names = bytes(sorted_names)
+
+        self._name_rows = array("I", sorted(
+            range(len(self._ids)),
+            key=self._get_name_bytes,
+        ))
+
+        self.by_id = _ProductTableById(self)
+        self.by_name = _ProductTableByName(self)
+
+    def __repr__(self):
+        return f"ProductTable(len={len(self)!r})"
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[ix] for ix in range(len(self))[row]]
+
+        if row < 0:
+            row += len(self)
+
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+
+        return ProductRecord(self, row)
+
+    @staticmethod
+    def _get_sorted_unique_rows(ids):
+        # Stable, so the last of any duplicate IDs is last in its run
+        rows = sorted(range(len(ids)), key=ids.__getitem__)
+
+        return [
+            row
+            for row, next_row in zip(rows, rows[1:] + [None])
+            if next_row is None or ids[row] != ids[next_row]]
+
+    def _get_name_bytes(self, row):
+        return self._names[
+            self._name_offsets[row]:self._name_offsets[row + 1]]
+
+    def _get_name(self, row):
+        return self._get_name_bytes(row).decode("utf-8")
+
+    def _get_row_by_id(self, product_id):
+        row = bisect_left(self._ids, product_id)
+
+        if row < len(self._ids) and self._ids[row] == product_id:
+            return row
+
+        return None
+
+    def _get_row_by_name(self, name):
+        name_bytes = name.encode("utf-8")
+        name_rows = self._name_rows
+        lo, hi = 0, len(name_rows)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._get_name_bytes(name_rows[mid]) < name_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(name_rows):
+            row = name_rows[lo]
+            if self._get_name_bytes(row) == name_bytes:
+                return row
 
-    if len(product_by_id) == 0:
-        return ()
+        return None
 
-    max_product_id = max(product_by_id.keys())
 
-    return tuple(
-        product_by_id.get(ix) for ix in range(max_product_id + 1))
+def get_product_table_from_json(file_obj):
+    return ProductTable(Product.from_json(file_obj))
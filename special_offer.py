@@ -8,14 +8,22 @@ For details of the JSON format, check the docstring for each
 _SpecialOffer subclass.
 """
 
-import json
 import logging
 from collections import namedtuple
 
 from decimal import Decimal
 from enum import Enum
 
-from utils import format_currency_gbp
+from money import from_pence, to_pence
+from offer_rule import (
+    DiscountedSet,
+    OfferRule,
+    PriceRuleType,
+    TriggerSet,
+    compile_rule,
+    iter_rule_allocations,
+)
+from utils import format_currency_gbp, format_pence_gbp, iter_json_array
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +32,8 @@ logger = logging.getLogger(__name__)
 class SpecialOfferType(Enum):
     FRACTION_OF_PRICE = "fraction_of_price"
     FRACTION_OF_PRICE_PER_QUANTITY = "fraction_of_price_per_quantity"
+    MULTI_BUY = "multi_buy"
+    BUNDLE = "bundle"
 
 
 FractionOfPriceProduct = namedtuple(
@@ -41,9 +51,59 @@ FractionOfPricePerQuantityShared = namedtuple(
     ("fraction_of_price",),
 )
 
-Discount = namedtuple(
+MultiBuyShared = namedtuple(
+    "MultiBuyShared",
+    ("buy_quantity", "pay_quantity"),
+)
+
+BundleProduct = namedtuple(
+    "BundleProduct",
+    ("quantity",),
+)
+
+BundleShared = namedtuple(
+    "BundleShared",
+    ("price",),
+)
+
+
+class Discount(namedtuple(
     "Discount",
-    ("value", "description"),
+    ("value", "description", "special_offer", "format_currency"),
+    defaults=(None, None),
+)):
+    """
+    A discount from a special offer, e.g. Discount(value, description)
+
+    A special offer's discounts are created with a description of None,
+    and the special_offer and format_currency to render it with, so that
+    the description is only rendered when it is accessed, as most
+    discounts are only ever summed.
+    """
+
+    __slots__ = ()
+
+    @property
+    def description(self):
+        description = self[1]
+
+        if description is None and self.special_offer is not None:
+            return self.special_offer._get_discount_description(
+                self.value,
+                self.format_currency,
+            )
+
+        return description
+
+
+# Attributes set by SpecialOffer._compile
+_COMPILED_ATTR_NAMES = (
+    "_memo",
+    "_memo_pence",
+    "_get_discount_by_key_decimal",
+    "_get_discount_by_key_pence",
+    "_get_discount",
+    "_get_discount_pence",
 )
 
 
@@ -53,16 +113,35 @@ class SpecialOffer:
     ProductValues = NotImplemented
     SharedValues = NotImplemented
 
+    # Largest number of quantity combinations memoized by each special
+    # offer
+    _MEMO_SIZE = 1024
+
     def __init__(self, products, value_matrix, shared_values=()):
         self._products = products
         self._value_matrix = value_matrix
         self._shared_values = shared_values
+        self._compile()
 
     def __repr__(self):
         return (
             f"SpecialOffer(type={self.SPECIAL_OFFER_TYPE!r}) at "
             f"{hash(self)}")
 
+    def __getstate__(self):
+        # The compiled evaluators are closures, which can't be pickled,
+        # so they are compiled again by __setstate__
+        state = self.__dict__.copy()
+
+        for name in _COMPILED_ATTR_NAMES:
+            del state[name]
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
     @staticmethod
     def _parse_special_offer_type(special_offer_obj):
         value = special_offer_obj["special_offer_type"]
@@ -77,7 +156,7 @@ class SpecialOffer:
         for product_id in col:
             try:
                 product = product_by_id[product_id]
-            except IndexError:
+            except LookupError:
                 logger.exception("Product not found")
                 raise
             else:
@@ -132,8 +211,14 @@ class SpecialOffer:
 
     @classmethod
     def from_json(cls, file_obj, product_by_id):
-        special_offer_obj_seq = json.load(file_obj)
+        return cls.from_json_objs(iter_json_array(file_obj), product_by_id)
 
+    @classmethod
+    def from_json_objs(cls, special_offer_obj_seq, product_by_id):
+        """
+        Yield special offers from decoded JSON objects (decoding doesn't
+        need the products, so it can be done while they are loaded)
+        """
         for special_offer_obj in special_offer_obj_seq:
             try:
                 special_offer_type = cls._parse_special_offer_type(
@@ -149,16 +234,169 @@ class SpecialOffer:
             kwargs = sub_cls._parse(special_offer_obj, product_by_id)
             yield sub_cls(**kwargs)
 
-    def _get_quantities(self, quantity_by_product):
-        for product in self._products:
-            yield quantity_by_product.get(product, 0)
+    def _compile_get_key(self):
+        """
+        Compile a function that gets the memo key of a basket: the
+        quantity of the special offer's product, or a tuple of the
+        quantities of its products
+        """
+        products = self._products
+
+        if len(products) == 1:
+            product, = products
+
+            def get_key(quantity_by_product):
+                return quantity_by_product.get(product, 0)
+
+        elif len(products) == 2:
+            product_0, product_1 = products
+
+            def get_key(quantity_by_product):
+                get_quantity = quantity_by_product.get
+                return get_quantity(product_0, 0), get_quantity(product_1, 0)
+
+        else:
+            def get_key(quantity_by_product):
+                return tuple(quantity_by_product.get(p, 0) for p in products)
 
-    def _get_discount_description(self, value):
+        return get_key
+
+    @property
+    def rule(self):
+        """
+        The OfferRule that the special offer's discount is evaluated from
+        (see offer_rule.py)
+        """
         raise NotImplementedError
 
-    def get_discount(self, quantity_by_product):
+    def _compile_evaluators(self):
+        """
+        Compile the evaluators of the discount's value, from a memo key
+        (see _compile_get_key), from the special offer's rule:
+
+        get_value(key): Decimal amount in pounds
+        get_value_pence(key): Integer amount in pence
+
+        Prices, quotas and the discount ratio are looked up once here,
+        so that evaluating a basket only does the arithmetic.
+        """
+        get_value, get_value_pence = compile_rule(self.rule, self._products)
+
+        if len(self._products) != 1:
+            return get_value, get_value_pence
+
+        # The memo key of a single product is its quantity, rather than
+        # a tuple (see _compile_get_key)
+        def get_value_single(quantity):
+            return get_value((quantity,))
+
+        def get_value_pence_single(quantity):
+            return get_value_pence((quantity,))
+
+        return get_value_single, get_value_pence_single
+
+    def _compile(self):
+        """
+        Compile get_discount and get_discount_pence
+
+        A discount only depends on the quantities of the special offer's
+        products, so the discounts are memoized by those quantities, and
+        popular combinations (e.g. 2 soups and 1 loaf of bread) are only
+        evaluated once. The memo is bounded by _MEMO_SIZE, and is cleared
+        when it is full.
+        """
+        get_key = self._compile_get_key()
+        get_value, get_value_pence = self._compile_evaluators()
+        memo_size = self._MEMO_SIZE
+
+        memo = self._memo = {}
+        memo_pence = self._memo_pence = {}
+
+        def get_discount_by_key(key):
+            discount = memo.get(key)
+
+            if discount is None:
+                if len(memo) >= memo_size:
+                    memo.clear()
+
+                # _make skips the keyword argument handling of
+                # Discount(...)
+                discount = memo[key] = Discount._make((
+                    get_value(key),
+                    None,
+                    self,
+                    format_currency_gbp,
+                ))
+
+            return discount
+
+        def get_discount_pence_by_key(key):
+            discount = memo_pence.get(key)
+
+            if discount is None:
+                if len(memo_pence) >= memo_size:
+                    memo_pence.clear()
+
+                discount = memo_pence[key] = Discount._make((
+                    get_value_pence(key),
+                    None,
+                    self,
+                    format_pence_gbp,
+                ))
+
+            return discount
+
+        def get_discount(quantity_by_product):
+            return get_discount_by_key(get_key(quantity_by_product))
+
+        def get_discount_pence(quantity_by_product):
+            return get_discount_pence_by_key(get_key(quantity_by_product))
+
+        self._get_discount_by_key_decimal = get_discount_by_key
+        self._get_discount_by_key_pence = get_discount_pence_by_key
+        self._get_discount = get_discount
+        self._get_discount_pence = get_discount_pence
+
+    def clear_memo(self):
+        self._memo.clear()
+        self._memo_pence.clear()
+
+    def _get_discount_by_key(self, key, in_pence=False):
+        """
+        Get the discount for a memo key (see _compile_get_key) rather than
+        a basket, e.g. for the units allocated to this special offer (see
+        _iter_allocations)
+        """
+        if in_pence:
+            return self._get_discount_by_key_pence(key)
+
+        return self._get_discount_by_key_decimal(key)
+
+    def _iter_allocations(self, quantity_by_product):
+        """
+        Yield each way this special offer can use units of the basket, as
+        (quantity_by_product, key) pairs, where quantity_by_product is
+        the units used up and key is the memo key of the discount they
+        give (see _get_discount_by_key). Units that wouldn't add to the
+        discount are left out, and the allocations are in order of
+        increasing size. A special offer without triggers only yields
+        the allocation of all of its units.
+        """
+        raise NotImplementedError
+
+    def _get_discount_description(self, value, format_currency):
         raise NotImplementedError
 
+    def get_discount(self, quantity_by_product):
+        return self._get_discount(quantity_by_product)
+
+    def get_discount_pence(self, quantity_by_product):
+        """
+        The same as get_discount, except the value of the discount is an
+        integer amount in pence (see money.py for the rounding rule)
+        """
+        return self._get_discount_pence(quantity_by_product)
+
 
 class FractionOfPrice(SpecialOffer):
     """
@@ -196,6 +434,17 @@ class FractionOfPrice(SpecialOffer):
         row_ix = self._ROW_IX_DISCOUNTED_PRODUCT
         return self._value_matrix[row_ix].fraction_of_price
 
+    @property
+    def rule(self):
+        return OfferRule(
+            trigger_sets=(),
+            discounted_sets=(
+                DiscountedSet((self.discounted_product,), None),
+            ),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=self.fraction_of_price,
+        )
+
     @classmethod
     def _parse_product_matrix_values(cls, cols):
         col, = cols
@@ -207,23 +456,22 @@ class FractionOfPrice(SpecialOffer):
 
             yield cls.ProductValues(fraction_of_price=Decimal(value))
 
-    def _get_discount_description(self, value):
+    def _get_discount_description(self, value, format_currency):
         return (
             f"{self.discounted_product.name} "
             f"{(1 - self.fraction_of_price):.0%} off: "
-            f"{format_currency_gbp(value * -1)}")
-
-    def get_discount(self, quantity_by_product):
-        quantity, = self._get_quantities(quantity_by_product)
+            f"{format_currency(value * -1)}")
 
-        value = (
-            quantity *
-            self.discounted_product.price *
-            (1 - self.fraction_of_price))
-
-        description = self._get_discount_description(value)
+    def _iter_allocations(self, quantity_by_product):
+        """
+        Each unit is discounted on its own, so only the allocation of
+        every unit is yielded (see Allocator._solve)
+        """
+        product = self.discounted_product
+        quantity = quantity_by_product.get(product, 0)
 
-        return Discount(value=value, description=description)
+        if quantity > 0:
+            yield {product: quantity}, quantity
 
 
 class FractionOfPricePerQuantity(SpecialOffer):
@@ -310,6 +558,34 @@ class FractionOfPricePerQuantity(SpecialOffer):
     def fraction_of_price(self):
         return self._shared_values.fraction_of_price
 
+    @property
+    def rule(self):
+        """
+        For every trigger product quota of the trigger product (T),
+        discount up to the discounted product quota of the discounted
+        product (D), e.g. for each 4 apples (A), discount 2 bananas (B):
+
+        4A + 2B => 2D
+        8A + 4B => 4D
+        8A + 3B => 3D
+        """
+        return OfferRule(
+            trigger_sets=(
+                TriggerSet(
+                    (self.trigger_product,),
+                    self.trigger_product_quantity,
+                ),
+            ),
+            discounted_sets=(
+                DiscountedSet(
+                    (self.discounted_product,),
+                    self.discounted_product_quantity,
+                ),
+            ),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=self.fraction_of_price,
+        )
+
     @classmethod
     def _parse_product_matrix_values(cls, cols):
         col, = cols
@@ -337,72 +613,295 @@ class FractionOfPricePerQuantity(SpecialOffer):
             fraction_of_price=Decimal(fraction_of_price_str),
         )
 
-    def _get_discount_description(self, value):
+    def _get_discount_description(self, value, format_currency):
         return (
             f"{self.discounted_product.name} "
             f"{(1 - self.fraction_of_price):.0%} off: "
-            f"{format_currency_gbp(value * -1)}")
+            f"{format_currency(value * -1)}")
 
-    def get_discount(self, quantity_by_product):
+    def _iter_allocations(self, quantity_by_product):
+        """
+        Each allocation uses the fewest trigger products needed for its
+        discounted products. If the trigger product and the discounted
+        product are the same, a unit is either a trigger or discounted,
+        not both.
         """
-        Trigger product (T)
-        Discountable product (D)
+        trigger_product = self.trigger_product
+        discounted_product = self.discounted_product
+        tq = self.trigger_product_quantity
+        dq_per_tq = self.discounted_product_quantity
 
-        For every X products (T), discount Y products (D). If the
-        quantity of products (D) in the basket is less than Y, then the
-        quantity in the basket is used instead.
+        if tq <= 0 or dq_per_tq <= 0:
+            return
 
-        Example:
+        num_discounted = 0
 
-        For each 4 apples (A), discount 2 bananas (B). D will represent
-        1 discount from a banana.
+        while True:
+            num_discounted += 1
 
-        4A + 2B => 2D
-        8A + 4B => 4D
-        8A + 3B => 3D
-        """
+            # Round up to a whole number of trigger quotas
+            num_triggers = -(-num_discounted // dq_per_tq) * tq
 
-        # Quantity of trigger products (A)
-        tq = self.trigger_product_quantity
+            used = {trigger_product: num_triggers}
+            used[discounted_product] = (
+                used.get(discounted_product, 0) + num_discounted)
 
-        # Number of products (B) to discount, for each quantity of
-        # trigger products (A)
-        dq_per_tq = self.discounted_product_quantity
+            if any(
+                    quantity > quantity_by_product.get(product, 0)
+                    for product, quantity in used.items()
+            ):
+                return
+
+            yield used, (num_triggers, num_discounted)
+
+
+class RuleSpecialOffer(SpecialOffer):
+    """
+    A special offer over a set of distinct products, whose allocations
+    (see _iter_allocations) are found by the rule engine too
+
+    Subclasses only parse their JSON format into products and values,
+    build the rule from them (the rule property), and describe their
+    discount.
+    """
 
-        # Actual quantities requested
-        (trigger_product_quantity,
-         discounted_product_quantity) = self._get_quantities(
-            quantity_by_product,
+    @property
+    def products(self):
+        return self._products
+
+    @classmethod
+    def _parse_product_matrix(cls, special_offer_obj, product_by_id):
+        products, value_matrix = super()._parse_product_matrix(
+            special_offer_obj,
+            product_by_id,
         )
+        products = tuple(products)
+        value_matrix = tuple(value_matrix)
+
+        # Each product must be in the offer once, with one row of values
+        # (if the offer has product values)
+        if (
+                not products or
+                len(set(products)) != len(products) or
+                (value_matrix and len(value_matrix) != len(products))
+        ):
+            logger.exception("'product_matrix' field is invalid")
+            raise ValueError
+
+        return products, value_matrix
 
-        # Ratio of discounted cost to original cost
-        # (e.g. 0.75 would be 75% of original cost)
-        fraction_of_price = self.fraction_of_price
+    def _iter_allocations(self, quantity_by_product):
+        products = self._products
 
-        # The maximum number of products (B) that can be discounted,
-        # based on the number of trigger products requested
-        if trigger_product_quantity > 0:
-            max_num_discountable = (
-                (trigger_product_quantity // tq) * dq_per_tq)
-        else:
-            max_num_discountable = 0
+        for used in iter_rule_allocations(self.rule, quantity_by_product):
+            key = tuple(used.get(p, 0) for p in products)
+
+            if len(products) == 1:
+                key, = key
+
+            yield used, key
+
+    @staticmethod
+    def _get_product_names(products):
+        return ", ".join(p.name for p in products)
+
+
+class MultiBuy(RuleSpecialOffer):
+    """
+    Buy a number of units of a set of products, and only pay for some of
+    them (the cheapest units are free), e.g. "3 for 2"
+
+    JSON format:
+
+    {
+        "special_offer_type": "multi_buy",
+        "product_matrix": [[PRODUCT_ID, ...]],
+        "shared_values": [BUY_QUANTITY, PAY_QUANTITY]
+    }
+
+    PRODUCT_ID:     Products that count towards the offer (integer)
+    BUY_QUANTITY:   Quantity (integer)
+    PAY_QUANTITY:   Quantity paid for, less than BUY_QUANTITY (integer)
+
+    Units of any of the products count towards BUY_QUANTITY, e.g.:
+
+    {
+        "special_offer_type": "multi_buy",
+        "product_matrix": [[1, 2]],  # Soup ID, Bread ID
+        "shared_values": [3, 2]
+    }
+
+    If 2 soups and 1 bread are requested, the cheapest unit is free
+    If 6 soups are requested, 2 soups are free
+    """
+
+    SPECIAL_OFFER_TYPE = SpecialOfferType.MULTI_BUY
+    SharedValues = MultiBuyShared
+
+    @property
+    def buy_quantity(self):
+        return self._shared_values.buy_quantity
+
+    @property
+    def pay_quantity(self):
+        return self._shared_values.pay_quantity
+
+    @property
+    def rule(self):
+        return OfferRule(
+            trigger_sets=(TriggerSet(self._products, self.buy_quantity),),
+            discounted_sets=(
+                DiscountedSet(
+                    self._products,
+                    self.buy_quantity - self.pay_quantity,
+                ),
+            ),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=Decimal(0),
+        )
+
+    @staticmethod
+    def _parse_product_matrix_values(cols):
+        if cols:
+            logger.exception("'product_matrix' field is invalid")
+            raise ValueError
+
+        return ()
+
+    @classmethod
+    def _parse_shared_values(cls, special_offer_obj):
+        shared_values = special_offer_obj['shared_values']
+
+        if type(shared_values) != list:
+            raise TypeError
+
+        buy_quantity, pay_quantity = shared_values
+
+        if type(buy_quantity) != int or type(pay_quantity) != int:
+            raise TypeError
+
+        if not buy_quantity > pay_quantity >= 0:
+            raise ValueError
+
+        return cls.SharedValues(
+            buy_quantity=buy_quantity,
+            pay_quantity=pay_quantity,
+        )
 
-        # The actual number of products (B) that can be discounted,
-        # taking into account the quantity requested
-        num_discountable = min(
-            max_num_discountable,
-            discounted_product_quantity,
+    def _get_discount_description(self, value, format_currency):
+        return (
+            f"{self._get_product_names(self._products)} "
+            f"{self.buy_quantity} for {self.pay_quantity}: "
+            f"{format_currency(value * -1)}")
+
+
+class Bundle(RuleSpecialOffer):
+    """
+    Buy a set of products together for a fixed price
+
+    JSON format:
+
+    {
+        "special_offer_type": "bundle",
+        "product_matrix": [
+            [PRODUCT_ID, ...],
+            [PRODUCT_QUANTITY, ...]
+        ],
+        "shared_values": [BUNDLE_PRICE]
+    }
+
+    PRODUCT_ID:       Product in the bundle (integer)
+    PRODUCT_QUANTITY: Quantity of the product in the bundle (integer)
+    BUNDLE_PRICE:     Price of the whole bundle, a positive whole
+                      number of pence (decimal string)
+
+    For example, a soup and 2 breads for £2.00:
+
+    {
+        "special_offer_type": "bundle",
+        "product_matrix": [
+            [1, 2],  # Soup ID, Bread ID
+            [1, 2]
+        ],
+        "shared_values": ["2.00"]
+    }
+
+    The bundle is discounted once for each complete bundle in the
+    basket. If the bundle costs more than its products, there is no
+    discount.
+    """
+
+    SPECIAL_OFFER_TYPE = SpecialOfferType.BUNDLE
+    ProductValues = BundleProduct
+    SharedValues = BundleShared
+
+    @property
+    def price(self):
+        return self._shared_values.price
+
+    @property
+    def rule(self):
+        product_quantities = tuple(zip(
+            self._products,
+            (values.quantity for values in self._value_matrix),
+        ))
+
+        return OfferRule(
+            trigger_sets=tuple(
+                TriggerSet((product,), quantity)
+                for product, quantity in product_quantities),
+            discounted_sets=tuple(
+                DiscountedSet((product,), quantity)
+                for product, quantity in product_quantities),
+            price_rule_type=PriceRuleType.FIXED_PRICE,
+            price_rule_value=self.price,
         )
 
-        # The discount
-        value = (
-            num_discountable *
-            self.discounted_product.price *
-            (1 - fraction_of_price))
+    @classmethod
+    def _parse_product_matrix_values(cls, cols):
+        col, = cols
+
+        for value in col:
+            if type(value) is not int or value <= 0:
+                logger.exception("'product_matrix' field is invalid")
+                raise ValueError
+
+            yield cls.ProductValues(quantity=value)
+
+    @classmethod
+    def _parse_shared_values(cls, special_offer_obj):
+        shared_values = special_offer_obj['shared_values']
+
+        if type(shared_values) != list:
+            raise TypeError
+
+        price_str, = shared_values
 
-        description = self._get_discount_description(value)
+        if type(price_str) != str:
+            raise TypeError
+
+        price = Decimal(price_str)
 
-        return Discount(value=value, description=description)
+        # A price in fractions of a penny would give different Decimal
+        # and pence discounts
+        if (
+                not price.is_finite() or
+                price <= 0 or
+                from_pence(to_pence(price)) != price
+        ):
+            raise ValueError
+
+        return cls.SharedValues(price=price)
+
+    def _get_discount_description(self, value, format_currency):
+        names = " + ".join(
+            p.name if values.quantity == 1
+            else f"{values.quantity} x {p.name}"
+            for p, values in zip(self._products, self._value_matrix))
+
+        return (
+            f"{names} for {format_currency_gbp(self.price)}: "
+            f"{format_currency(value * -1)}")
 
 
 _CLS_BY_TYPE = {
@@ -410,7 +909,35 @@ _CLS_BY_TYPE = {
     for cls in (
         FractionOfPrice,
         FractionOfPricePerQuantity,
+        MultiBuy,
+        Bundle,
     )}
 
 
+def get_special_offers_by_product(special_offers):
+    """
+    Index special offers by each product they reference, so that only
+    the offers relevant to a basket need to be evaluated.
+
+    Each value is a tuple of (position, special_offer) pairs, where
+    position is the offer's index in special_offers. This allows the
+    original order of the offers to be restored when the offers of
+    several products are combined.
+    """
+    special_offers_by_product = {}
+
+    for position, special_offer in enumerate(special_offers):
+        # The same product may appear more than once in one offer
+        for product in dict.fromkeys(special_offer._products):
+            special_offers_by_product.setdefault(product, []).append(
+                (position, special_offer),
+            )
+
+    return {
+        product: tuple(positioned_special_offers)
+        for product, positioned_special_offers
+        in special_offers_by_product.items()}
+
+
 get_special_offers_from_json = SpecialOffer.from_json
+get_special_offers_from_json_objs = SpecialOffer.from_json_objs
@@ -0,0 +1,209 @@
+"""
+stats.py
+===
+
+Optional profiling of special offer evaluation.
+
+While stats are being collected (see collect_stats), each special offer
+evaluation records a call, whether it produced a discount (a hit) and
+the time it took, both per special offer type and per special offer.
+Special offers are identified by their position in the catalog's
+special offers, so stats from several processes with the same catalog
+can be merged.
+
+When stats are not being collected, pricing only checks one global per
+basket, so the cost is negligible.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+
+
+# The PricingStats being collected, if any (see collect_stats)
+_active_stats = None
+
+
+class OfferStats:
+    """
+    Counters for a special offer, or a type of special offer
+    """
+
+    __slots__ = ("calls", "hits", "seconds")
+
+    def __init__(self, calls=0, hits=0, seconds=0.0):
+        self.calls = calls
+        self.hits = hits
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (
+            f"OfferStats(calls={self.calls!r}, hits={self.hits!r}, "
+            f"seconds={self.seconds!r})")
+
+    def _update(self, other):
+        self.calls += other.calls
+        self.hits += other.hits
+        self.seconds += other.seconds
+
+
+class PricingStats:
+    """
+    Special offer evaluation stats
+
+    by_type: OfferStats by SpecialOfferType
+    by_position: OfferStats by the special offer's position in the
+                 catalog's special offers
+    baskets: Number of baskets priced
+    """
+
+    def __init__(self):
+        self.by_type = {}
+        self.by_position = {}
+        self.baskets = 0
+
+    def __repr__(self):
+        return (
+            f"PricingStats(baskets={self.baskets!r}, "
+            f"offers={len(self.by_position)!r})")
+
+    def get_discount(
+            self,
+            position,
+            special_offer,
+            quantity_by_product,
+            in_pence=False,
+    ):
+        """
+        Call special_offer.get_discount (or get_discount_pence), and
+        record the call
+        """
+        start = perf_counter()
+
+        if in_pence:
+            discount = special_offer.get_discount_pence(quantity_by_product)
+        else:
+            discount = special_offer.get_discount(quantity_by_product)
+
+        seconds = perf_counter() - start
+        hit = discount.value > 0
+
+        for key, stats_by_key in (
+                (special_offer.SPECIAL_OFFER_TYPE, self.by_type),
+                (position, self.by_position),
+        ):
+            offer_stats = stats_by_key.get(key)
+
+            if offer_stats is None:
+                offer_stats = stats_by_key[key] = OfferStats()
+
+            offer_stats.calls += 1
+            offer_stats.hits += hit
+            offer_stats.seconds += seconds
+
+        return discount
+
+    def update(self, other):
+        """
+        Add the stats from other (e.g. from a worker process)
+        """
+        self.baskets += other.baskets
+
+        for stats_by_key, other_stats_by_key in (
+                (self.by_type, other.by_type),
+                (self.by_position, other.by_position),
+        ):
+            for key, other_stats in other_stats_by_key.items():
+                offer_stats = stats_by_key.get(key)
+
+                if offer_stats is None:
+                    offer_stats = stats_by_key[key] = OfferStats()
+
+                offer_stats._update(other_stats)
+
+    def format_report(self, special_offers=None, limit=10):
+        """
+        Format the stats as a table per special offer type, and a table
+        of the limit special offers that took the most time. If
+        special_offers is given, the type of each special offer is
+        included.
+        """
+        lines = [
+            f"Baskets: {self.baskets}",
+            "",
+            _format_row("Special offer type", "Calls", "Hits", "Time (ms)"),
+        ]
+
+        for special_offer_type, offer_stats in sorted(
+                self.by_type.items(),
+                key=lambda item: item[1].seconds,
+                reverse=True,
+        ):
+            lines.append(_format_stats_row(
+                special_offer_type.value,
+                offer_stats,
+            ))
+
+        lines.extend((
+            "",
+            _format_row("Special offer", "Calls", "Hits", "Time (ms)"),
+        ))
+
+        for position, offer_stats in sorted(
+                self.by_position.items(),
+                key=lambda item: item[1].seconds,
+                reverse=True,
+        )[:limit]:
+            label = f"#{position}"
+
+            if special_offers is not None:
+                special_offer = special_offers[position]
+                label = f"{label} ({special_offer.SPECIAL_OFFER_TYPE.value})"
+
+            lines.append(_format_stats_row(label, offer_stats))
+
+        return "\n".join(lines)
+
+
+def _format_row(label, calls, hits, milliseconds):
+    return f"{label:<40}{calls:>10}{hits:>10}{milliseconds:>12}"
+
+
+def _format_stats_row(label, offer_stats):
+    return _format_row(
+        label,
+        offer_stats.calls,
+        offer_stats.hits,
+        f"{offer_stats.seconds * 1000:.3f}",
+    )
+
+
+def get_active_stats():
+    """
+    Get the PricingStats being collected, or None
+    """
+    return _active_stats
+
+
+@contextmanager
+def collect_stats(stats=None):
+    """
+    Collect special offer evaluation stats for all pricing in this
+    process (in any thread) until the context exits, e.g.:
+
+    with collect_stats() as stats:
+        price_baskets(baskets, special_offers)
+
+    print(stats.format_report(special_offers))
+    """
+    global _active_stats
+
+    if stats is None:
+        stats = PricingStats()
+
+    previous_stats = _active_stats
+    _active_stats = stats
+
+    try:
+        yield stats
+    finally:
+        _active_stats = previous_stats
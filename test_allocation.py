@@ -0,0 +1,301 @@
+import pickle
+import unittest
+from collections import Counter
+from decimal import Decimal
+from time import perf_counter
+
+import factory
+from parameterized import parameterized
+
+from allocation import Allocator, _group_special_offers
+from factories import (
+    BundleFactory,
+    FractionOfPriceFactory,
+    FractionOfPricePerQuantityFactory,
+    MultiBuyFactory,
+    ProductFactory,
+    create_basket,
+    create_products,
+    create_special_offers,
+)
+from price_basket import get_original_total_and_discounts
+
+
+def _create_fraction_of_price(product, fraction_of_price):
+    return FractionOfPriceFactory.stub_to_obj(
+        FractionOfPriceFactory.stub(
+            discounted_product=product,
+            fraction_of_price=Decimal(fraction_of_price),
+        ),
+        (product,),
+    )
+
+
+def _create_per_quantity(
+        trigger_product,
+        trigger_product_quantity,
+        discounted_product,
+        discounted_product_quantity,
+        fraction_of_price,
+):
+    return FractionOfPricePerQuantityFactory.stub_to_obj(
+        FractionOfPricePerQuantityFactory.stub(
+            trigger_product=trigger_product,
+            trigger_product_quantity=trigger_product_quantity,
+            discounted_product=discounted_product,
+            discounted_product_quantity=discounted_product_quantity,
+            fraction_of_price=Decimal(fraction_of_price),
+        ),
+        (trigger_product, discounted_product),
+    )
+
+
+class TestAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.apple = ProductFactory.stub_to_obj(
+            ProductFactory.stub(price=Decimal("1.00")))
+        self.banana = ProductFactory.stub_to_obj(
+            ProductFactory.stub(price=Decimal("2.00")))
+
+    def get_discount_values(self, basket, special_offers, **kwargs):
+        _, discounts = get_original_total_and_discounts(
+            basket,
+            special_offers,
+            in_pence=True,
+            allocator=Allocator(**kwargs),
+        )
+
+        return [(d.special_offer, d.value) for d in discounts]
+
+    def test_competing(self):
+        apples_half_price = _create_fraction_of_price(self.apple, "0.5")
+        banana_per_apple = _create_per_quantity(
+            self.apple, 1,
+            self.banana, 1,
+            "0.5",
+        )
+        special_offers = (apples_half_price, banana_per_apple)
+
+        # The apple either triggers the banana discount or is discounted
+        # itself, and the banana discount is larger
+        self.assertEqual(
+            [(banana_per_apple, 100)],
+            self.get_discount_values(
+                Counter({self.apple: 1, self.banana: 1}),
+                special_offers,
+            ),
+        )
+
+        self.assertEqual(
+            [(apples_half_price, 50), (banana_per_apple, 100)],
+            self.get_discount_values(
+                Counter({self.apple: 2, self.banana: 1}),
+                special_offers,
+            ),
+        )
+
+    @parameterized.expand([
+        (2, 0),
+        (3, 1),
+        (5, 1),
+        (6, 2),
+    ])
+    def test_same_trigger_and_discounted(self, quantity, num_discounted):
+        # Buy 2 apples, get 1 half price
+        special_offer = _create_per_quantity(
+            self.apple, 2,
+            self.apple, 1,
+            "0.5",
+        )
+
+        expected = []
+
+        if num_discounted:
+            expected.append((special_offer, num_discounted * 50))
+
+        self.assertEqual(
+            expected,
+            self.get_discount_values(
+                Counter({self.apple: quantity}),
+                (special_offer,),
+            ),
+        )
+
+    def test_rule_special_offers(self):
+        # 3 for 2, or an apple and a banana for £2.50
+        multi_buy = MultiBuyFactory.stub_to_obj(
+            MultiBuyFactory.stub(buy_quantity=3, pay_quantity=2),
+            (self.apple, self.banana),
+        )
+        bundle = BundleFactory.stub_to_obj(
+            BundleFactory.stub(quantities=[1, 1], price=Decimal("2.50")),
+            (self.apple, self.banana),
+        )
+
+        self.assertEqual(
+            [(multi_buy, 100), (bundle, 50)],
+            self.get_discount_values(
+                Counter({self.apple: 4, self.banana: 1}),
+                (multi_buy, bundle),
+            ),
+        )
+
+    def test_budget_exceeded(self):
+        special_offers = (
+            _create_fraction_of_price(self.apple, "0.9"),
+            _create_per_quantity(self.apple, 1, self.banana, 1, "0.5"),
+        )
+        basket = Counter({self.apple: 1, self.banana: 1})
+
+        with self.assertLogs("allocation", "DEBUG"):
+            values = self.get_discount_values(
+                basket,
+                special_offers,
+                max_states=1,
+            )
+
+        # The largest single discount is taken first
+        self.assertEqual([(special_offers[1], 100)], values)
+
+    def test_large_basket(self):
+        special_offers = (
+            _create_fraction_of_price(self.apple, "0.5"),
+            _create_per_quantity(self.apple, 1, self.banana, 1, "0.5"),
+            _create_per_quantity(self.banana, 2, self.apple, 1, "0.9"),
+        )
+        basket = Counter({self.apple: 1000000, self.banana: 1000000})
+
+        start = perf_counter()
+
+        with self.assertLogs("allocation", "DEBUG"):
+            values = self.get_discount_values(
+                basket,
+                special_offers,
+                max_seconds=0.05,
+            )
+
+        # The greedy allocation gets as long again as the budget
+        self.assertLess(perf_counter() - start, 0.5)
+        self.assertTrue(values)
+
+    def test_bounds(self):
+        products = create_products(4)
+        special_offers = create_special_offers(
+            products,
+            0,
+            6,
+            trigger_product_quantity=factory.Faker(
+                'random_int', min=1, max=3),
+            discounted_product_quantity=factory.Faker(
+                'random_int', min=1, max=3),
+            fraction_of_price=factory.Faker(
+                'pydecimal',
+                left_digits=0,
+                right_digits=2,
+                positive=True,
+            ),
+        )
+
+        for _ in range(20):
+            basket = create_basket(products, max_quantity=6)
+
+            def get_total_discount(allocator=None):
+                _, discounts = get_original_total_and_discounts(
+                    basket,
+                    special_offers,
+                    in_pence=True,
+                    allocator=allocator,
+                )
+
+                return sum(d.value for d in discounts)
+
+            optimal = get_total_discount(Allocator())
+
+            # Groups of one special offer are still solved optimally
+            greedy = get_total_discount(Allocator(max_states=1))
+
+            self.assertLessEqual(greedy, optimal)
+            self.assertLessEqual(optimal, get_total_discount())
+
+    def test_independent(self):
+        special_offers = (
+            _create_fraction_of_price(self.apple, "0.5"),
+            _create_fraction_of_price(self.banana, "0.75"),
+        )
+        basket = Counter({self.apple: 3, self.banana: 2})
+
+        for in_pence in (False, True):
+            expected_total, expected_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    special_offers,
+                    in_pence=in_pence,
+                ))
+            original_total, discounts = get_original_total_and_discounts(
+                basket,
+                special_offers,
+                in_pence=in_pence,
+                allocator=Allocator(),
+            )
+
+            self.assertEqual(expected_total, original_total)
+            self.assertEqual(
+                [(d.value, d.description) for d in expected_discounts],
+                [(d.value, d.description) for d in discounts],
+            )
+
+    def test_cache(self):
+        allocator = Allocator()
+        special_offers = (_create_fraction_of_price(self.apple, "0.5"),)
+        positioned_special_offers = tuple(enumerate(special_offers))
+        basket = Counter({self.apple: 2})
+
+        discounts = allocator.get_discounts(basket, positioned_special_offers)
+
+        self.assertIs(
+            discounts,
+            allocator.get_discounts(basket, positioned_special_offers),
+        )
+
+        allocator.clear_cache()
+
+        self.assertIsNot(
+            discounts,
+            allocator.get_discounts(basket, positioned_special_offers),
+        )
+
+    def test_pickle(self):
+        allocator = Allocator(max_states=10, max_seconds=1, cache_size=2)
+        allocator.get_discounts(
+            Counter({self.apple: 1}),
+            enumerate((_create_fraction_of_price(self.apple, "0.5"),)),
+        )
+
+        unpickled = pickle.loads(pickle.dumps(allocator))
+
+        self.assertEqual(repr(allocator), repr(unpickled))
+        self.assertEqual({}, unpickled._cache)
+
+
+class TestGroupSpecialOffers(unittest.TestCase):
+
+    def test_group(self):
+        products = create_products(5)
+        special_offers = (
+            _create_fraction_of_price(products[0], "0.5"),
+            _create_per_quantity(products[1], 1, products[2], 1, "0.5"),
+            _create_fraction_of_price(products[3], "0.5"),
+            _create_per_quantity(products[0], 1, products[1], 1, "0.5"),
+            _create_fraction_of_price(products[4], "0.5"),
+        )
+        positioned_special_offers = list(enumerate(special_offers))
+
+        self.assertEqual(
+            [
+                [positioned_special_offers[i] for i in (0, 1, 3)],
+                [positioned_special_offers[2]],
+                [positioned_special_offers[4]],
+            ],
+            sorted(_group_special_offers(positioned_special_offers)),
+        )
@@ -0,0 +1,80 @@
+import unittest
+from collections import Counter
+
+from parameterized import parameterized
+
+from basket import Basket
+from factories import BasketsTestCaseMixin, fake
+from price_basket import get_original_total_and_discounts
+
+
+class TestBasket(BasketsTestCaseMixin, unittest.TestCase):
+
+    def assertBasketEqual(self, expected, basket, in_pence):
+        expected_total, expected_discounts = (
+            get_original_total_and_discounts(
+                expected,
+                self.special_offers,
+                in_pence=in_pence,
+            ))
+        expected_discounts = tuple(expected_discounts)
+
+        self.assertEqual(+expected, dict(basket))
+        self.assertEqual(expected_total, basket.original_total)
+        self.assertEqual(
+            tuple((d.value, d.description) for d in expected_discounts),
+            tuple((d.value, d.description) for d in basket.discounts),
+        )
+        self.assertEqual(
+            expected_total - sum(d.value for d in expected_discounts),
+            basket.total,
+        )
+
+    @parameterized.expand([
+        ("decimal", False),
+        ("pence", True),
+    ])
+    def test_add_and_remove(self, _, in_pence):
+        basket = Basket(self.special_offers, in_pence=in_pence)
+        expected = Counter()
+
+        self.assertBasketEqual(expected, basket, in_pence)
+
+        for _ in range(64):
+            product = fake.random_element(self.product_seq)
+
+            if expected[product] > 0 and fake.pybool():
+                quantity = fake.random_int(min=1, max=expected[product])
+                basket.remove(product, quantity)
+                expected[product] -= quantity
+            else:
+                quantity = fake.random_int(min=1, max=4)
+                basket.add(product, quantity)
+                expected[product] += quantity
+
+            self.assertBasketEqual(expected, basket, in_pence)
+
+        for product, quantity in (+expected).items():
+            basket.remove(product, quantity)
+
+        self.assertEqual(0, len(basket))
+        self.assertEqual(0, basket.original_total)
+        self.assertEqual(0, basket.total)
+        self.assertEqual((), basket.discounts)
+
+    def test_remove_invalid(self):
+        basket = Basket(self.special_offers)
+        product = self.product_seq[0]
+
+        with self.assertRaises(KeyError):
+            basket.remove(product)
+
+        basket.add(product, 2)
+
+        with self.assertRaises(ValueError):
+            basket.remove(product, 3)
+
+        with self.assertRaises(ValueError):
+            basket.add(product, 0)
+
+        self.assertEqual({product: 2}, dict(basket))
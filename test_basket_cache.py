@@ -0,0 +1,96 @@
+import unittest
+from collections import Counter
+from unittest.mock import sentinel
+
+from basket_cache import BasketCache, CacheInfo, get_basket_key
+from factories import ProductFactory
+
+
+class TestGetBasketKey(unittest.TestCase):
+
+    def test_order_independent(self):
+        product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(4),
+        ))
+
+        basket = Counter(product_seq + product_seq[:2])
+        other_basket = Counter(reversed(product_seq[:2] + product_seq))
+
+        self.assertEqual(
+            get_basket_key(basket),
+            get_basket_key(other_basket),
+        )
+        self.assertNotEqual(
+            get_basket_key(basket),
+            get_basket_key(basket, in_pence=True),
+        )
+        self.assertNotEqual(
+            get_basket_key(basket),
+            get_basket_key(Counter(product_seq)),
+        )
+
+    def test_zero_quantity(self):
+        product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(2),
+        ))
+
+        basket = Counter(product_seq)
+        basket[product_seq[1]] -= 1
+
+        self.assertEqual(
+            get_basket_key(Counter(product_seq[:1])),
+            get_basket_key(basket),
+        )
+
+
+class TestBasketCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = BasketCache(2)
+        catalog = sentinel.catalog
+
+        cache.put(catalog, "a", sentinel.a)
+        cache.put(catalog, "b", sentinel.b)
+
+        # "a" is used more recently than "b", so "b" is evicted
+        self.assertIs(sentinel.a, cache.get(catalog, "a"))
+        cache.put(catalog, "c", sentinel.c)
+
+        self.assertIsNone(cache.get(catalog, "b"))
+        self.assertIs(sentinel.a, cache.get(catalog, "a"))
+        self.assertIs(sentinel.c, cache.get(catalog, "c"))
+
+        self.assertEqual(
+            CacheInfo(hits=3, misses=1, evictions=1, size=2, max_size=2),
+            cache.info(),
+        )
+
+    def test_other_catalog(self):
+        cache = BasketCache(2)
+
+        cache.put(sentinel.catalog, "a", sentinel.a)
+
+        self.assertIsNone(cache.get(sentinel.other_catalog, "a"))
+
+        cache.put(sentinel.other_catalog, "a", sentinel.other_a)
+
+        self.assertIs(
+            sentinel.other_a,
+            cache.get(sentinel.other_catalog, "a"),
+        )
+        self.assertIsNone(cache.get(sentinel.catalog, "a"))
+
+    def test_clear(self):
+        cache = BasketCache(2)
+
+        cache.put(sentinel.catalog, "a", sentinel.a)
+        cache.clear()
+
+        self.assertIsNone(cache.get(sentinel.catalog, "a"))
+        self.assertEqual(0, cache.info().size)
+
+    def test_invalid_max_size(self):
+        with self.assertRaises(ValueError):
+            BasketCache(0)
@@ -0,0 +1,82 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmark import BenchmarkResult, _print_result, run_benchmarks
+
+
+class TestRunBenchmarks(unittest.TestCase):
+
+    def test_success(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            data_dir = Path(dir_path)
+
+            results = list(run_benchmarks(
+                num_products_seq=(20, 40),
+                max_special_offers=30,
+                num_baskets=5,
+                repeat=1,
+                data_dir=data_dir,
+            ))
+
+            self.assertEqual(4, len(list(data_dir.iterdir())))
+
+        names = [r.name for r in results]
+
+        self.assertEqual(
+            [(20, 20), (40, 30)],
+            sorted({
+                (r.num_products, r.num_special_offers)
+                for r in results}),
+        )
+        self.assertEqual(names[:len(names) // 2], names[len(names) // 2:])
+
+        for result in results:
+            self.assertGreater(result.ops, 0)
+            self.assertGreater(result.ops_per_sec, 0)
+            self.assertGreaterEqual(result.peak_memory_bytes, 0)
+
+    def test_reuse_catalog(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            data_dir = Path(dir_path)
+
+            def run():
+                for _ in run_benchmarks(
+                    num_products_seq=(20,),
+                    max_special_offers=10,
+                    num_baskets=1,
+                    repeat=1,
+                    data_dir=data_dir,
+                    measure_memory=False,
+                ):
+                    pass
+
+                return {
+                    p: p.stat().st_mtime_ns
+                    for p in data_dir.iterdir()}
+
+            self.assertEqual(run(), run())
+
+
+class TestPrintResult(unittest.TestCase):
+
+    def test_untimed(self):
+        result = BenchmarkResult(
+            name="price_baskets",
+            num_products=20,
+            num_special_offers=10,
+            ops=5,
+            seconds=0,
+            ops_per_sec=None,
+            peak_memory_bytes=None,
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()) as file_obj:
+            _print_result(result)
+
+        self.assertEqual(
+            ["price_baskets", "20", "10", "-", "ops/s", "-"],
+            file_obj.getvalue().split(),
+        )
@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+import unittest
+from collections import Counter
+from decimal import Decimal
+from unittest.mock import Mock
+
+from parameterized import parameterized
+
+from bill_writer import BillFormat, BillWriter
+from factories import FractionOfPriceFactory, ProductFactory
+from price_basket import get_original_total_and_discounts
+
+
+class TestBillWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.product = ProductFactory.stub_to_obj(
+            ProductFactory.stub(name="Apples", price=Decimal("1.00")))
+        self.special_offers = (
+            FractionOfPriceFactory.stub_to_obj(
+                FractionOfPriceFactory.stub(
+                    fraction_of_price=Decimal("0.9"),
+                ),
+                (self.product,),
+            ),
+        )
+
+    def get_result(self, quantity, in_pence=False):
+        original_total, discounts = get_original_total_and_discounts(
+            Counter({self.product: quantity}),
+            self.special_offers,
+            in_pence=in_pence,
+        )
+
+        return original_total, tuple(discounts)
+
+    def write(self, results, bill_format, in_pence=False, **kwargs):
+        with io.StringIO() as file_obj:
+            with BillWriter(
+                file_obj,
+                bill_format,
+                in_pence,
+                **kwargs,
+            ) as bill_writer:
+                bill_writer.write_many(results)
+
+            return file_obj.getvalue()
+
+    def test_text(self):
+        self.assertEqual(
+            (
+                "Subtotal: £3.00\n"
+                "Apples 10% off: -30p\n"
+                "Total: £2.70\n"
+                "\n"
+                "Basket is invalid\n"
+                "\n"
+                "Subtotal: £1.00\n"
+                "Apples 10% off: -10p\n"
+                "Total: 90p\n"),
+            self.write(
+                [self.get_result(3), None, self.get_result(1)],
+                BillFormat.TEXT,
+            ),
+        )
+
+    def test_text_separate_first(self):
+        self.assertEqual(
+            "\nTotal: £1.50\n",
+            self.write(
+                [(150, ())],
+                BillFormat.TEXT,
+                True,
+                separate_first=True,
+            ),
+        )
+
+    @parameterized.expand([
+        ("decimal", False, "3.00", "0.30", "2.70"),
+        ("pence", True, 300, 30, 270),
+    ])
+    def test_json(self, _, in_pence, original_total, value, total):
+        original_total_, discounts = self.get_result(3, in_pence)
+
+        text = self.write(
+            [(original_total_, iter(discounts)), None],
+            BillFormat.JSON,
+            in_pence,
+        )
+
+        self.assertEqual(
+            [
+                {
+                    "original_total": original_total,
+                    "discounts": [
+                        {
+                            "value": value,
+                            "description": "Apples 10% off: -30p",
+                        },
+                    ],
+                    "total": total,
+                },
+                {"error": "Basket is invalid"},
+            ],
+            list(map(json.loads, text.splitlines())),
+        )
+
+    def test_csv(self):
+        text = self.write(
+            [self.get_result(3, True), (0, ()), None],
+            BillFormat.CSV,
+            True,
+        )
+
+        self.assertEqual(
+            [
+                ["300", "30", "Apples 10% off: -30p", "270"],
+                ["0", "0"],
+                ["error", "Basket is invalid"],
+            ],
+            list(csv.reader(io.StringIO(text))),
+        )
+
+    @parameterized.expand([
+        ("json", BillFormat.JSON),
+        ("csv", BillFormat.CSV),
+    ])
+    def test_rounding(self, _, bill_format):
+        # 25% off £0.65 is 16.25p
+        product = ProductFactory.stub_to_obj(
+            ProductFactory.stub(name="Soup", price=Decimal("0.65")))
+        special_offer = FractionOfPriceFactory.stub_to_obj(
+            FractionOfPriceFactory.stub(
+                fraction_of_price=Decimal("0.75"),
+            ),
+            (product,),
+        )
+        original_total, discounts = get_original_total_and_discounts(
+            Counter({product: 1}),
+            (special_offer,),
+        )
+
+        text = self.write([(original_total, discounts)], bill_format)
+
+        # The same amounts as the text bill (-16p, and a total of 49p)
+        if bill_format is BillFormat.JSON:
+            bill_obj = json.loads(text)
+            values = [
+                bill_obj["original_total"],
+                bill_obj["discounts"][0]["value"],
+                bill_obj["total"],
+            ]
+        else:
+            row, = csv.reader(io.StringIO(text))
+            values = [row[0], row[1], row[3]]
+
+        self.assertEqual(["0.65", "0.16", "0.49"], values)
+
+    def test_buffered(self):
+        file_obj = Mock()
+        bill_writer = BillWriter(file_obj, BillFormat.JSON, buffer_size=1000)
+
+        for _ in range(100):
+            bill_writer.write(self.get_result(3))
+
+        self.assertLess(0, file_obj.write.call_count)
+        self.assertLess(file_obj.write.call_count, 100)
+
+        bill_writer.flush()
+
+        text = "".join(c.args[0] for c in file_obj.write.call_args_list)
+
+        self.assertEqual(100, len(text.splitlines()))
+
+    def test_unbuffered(self):
+        file_obj = Mock()
+        bill_writer = BillWriter(file_obj, BillFormat.CSV, buffer_size=None)
+
+        bill_writer.write(None)
+
+        file_obj.write.assert_called_once_with("error,Basket is invalid\n")
+
+        bill_writer.flush()
+
+        file_obj.write.assert_called_once()
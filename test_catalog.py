@@ -0,0 +1,209 @@
+import io
+import json
+import os
+import struct
+import tempfile
+import unittest
+from collections import Counter
+from operator import attrgetter
+from random import sample
+
+import factory
+from parameterized import parameterized
+
+from catalog import CompiledCatalog, compile_catalog
+from factories import (
+    FractionOfPriceFactory,
+    FractionOfPricePerQuantityFactory,
+    MultiBuyFactory,
+    ProductFactory,
+    fake,
+)
+from product import get_products_from_json
+from special_offer import (
+    get_special_offers_by_product,
+    get_special_offers_from_json,
+)
+
+
+class TestCompiledCatalog(unittest.TestCase):
+
+    def setUp(self):
+        product_stub_seq = ProductFactory.stub_batch(
+            8,
+            product_id=factory.Iterator(sample(range(1, 100), 8)),
+        )
+
+        special_offer_obj_seq = [
+            FractionOfPriceFactory.stub_to_dict(s)
+            for s in FractionOfPriceFactory.stub_batch(
+                4,
+                discounted_product=factory.Faker(
+                    'random_element', elements=product_stub_seq),
+            )]
+
+        special_offer_obj_seq.extend(
+            FractionOfPricePerQuantityFactory.stub_to_dict(s)
+            for s in FractionOfPricePerQuantityFactory.stub_batch(
+                4,
+                trigger_product=factory.Faker(
+                    'random_element', elements=product_stub_seq),
+                discounted_product=factory.Faker(
+                    'random_element', elements=product_stub_seq),
+            ))
+
+        self.products_json = json.dumps(
+            list(map(ProductFactory.stub_to_dict, product_stub_seq)))
+        self.special_offers_json = json.dumps(special_offer_obj_seq)
+
+        with tempfile.NamedTemporaryFile(delete=False) as out_file_obj:
+            self.path = out_file_obj.name
+
+            compile_catalog(
+                io.StringIO(self.products_json),
+                io.StringIO(self.special_offers_json),
+                out_file_obj,
+            )
+
+        self.catalog = CompiledCatalog(self.path)
+
+        self.products_by_id = get_products_from_json(
+            io.StringIO(self.products_json))
+        self.special_offers = tuple(get_special_offers_from_json(
+            io.StringIO(self.special_offers_json),
+            self.products_by_id,
+        ))
+
+    def tearDown(self):
+        self.catalog.close()
+        os.remove(self.path)
+
+    def test_products(self):
+        getter = attrgetter("product_id", "name", "price")
+
+        expected = sorted(
+            map(getter, self.products_by_id.values()))
+
+        self.assertEqual(
+            expected,
+            sorted(map(getter, self.catalog.products_by_id.values())),
+        )
+
+        for product_id, name, price in expected:
+            product = self.catalog.product_by_name[name]
+            self.assertIs(product, self.catalog.products_by_id[product_id])
+            self.assertEqual((product_id, name, price), getter(product))
+
+        self.assertNotIn(0, self.catalog.products_by_id)
+        self.assertNotIn("Not a product", self.catalog.product_by_name)
+
+    def test_special_offers(self):
+        self.assertEqual(
+            len(self.special_offers),
+            len(self.catalog.special_offers),
+        )
+
+        for expected, actual in zip(
+            self.special_offers,
+            self.catalog.special_offers,
+        ):
+            self.assertEqual(
+                expected.SPECIAL_OFFER_TYPE,
+                actual.SPECIAL_OFFER_TYPE,
+            )
+            self.assertEqual(
+                tuple(p.product_id for p in expected._products),
+                tuple(p.product_id for p in actual._products),
+            )
+            self.assertEqual(expected._value_matrix, actual._value_matrix)
+            self.assertEqual(expected._shared_values, actual._shared_values)
+
+    def test_special_offers_by_product(self):
+        expected = get_special_offers_by_product(self.special_offers)
+
+        for product in self.products_by_id.values():
+            actual = self.catalog.special_offers_by_product.get(
+                self.catalog.products_by_id[product.product_id],
+                (),
+            )
+
+            self.assertEqual(
+                tuple(ix for ix, _ in expected.get(product, ())),
+                tuple(ix for ix, _ in actual),
+            )
+
+    def test_get_discount(self):
+        quantity_by_product_id = {
+            product_id: fake.random_int(min=1, max=8)
+            for product_id in self.catalog.products_by_id}
+
+        expected_quantity_by_product = Counter({
+            self.products_by_id[product_id]: quantity
+            for product_id, quantity in quantity_by_product_id.items()})
+
+        actual_quantity_by_product = Counter({
+            self.catalog.products_by_id[product_id]: quantity
+            for product_id, quantity in quantity_by_product_id.items()})
+
+        for expected, actual in zip(
+            self.special_offers,
+            self.catalog.special_offers,
+        ):
+            self.assertEqual(
+                expected.get_discount(expected_quantity_by_product).value,
+                actual.get_discount(actual_quantity_by_product).value,
+            )
+
+    def test_not_a_catalog(self):
+        with tempfile.NamedTemporaryFile() as file_obj:
+            file_obj.write(b"\0" * 256)
+            file_obj.flush()
+
+            with self.assertRaises(ValueError):
+                CompiledCatalog(file_obj.name)
+
+    @parameterized.expand([
+        ("empty", 0),
+        ("header", 64),
+        ("products", 128),
+        ("last_byte", -1),
+    ])
+    def test_truncated(self, _, end):
+        with open(self.path, "rb") as file_obj:
+            data = file_obj.read()
+
+        with tempfile.NamedTemporaryFile() as file_obj:
+            file_obj.write(data[:end])
+            file_obj.flush()
+
+            with self.assertRaisesRegex(ValueError, file_obj.name):
+                CompiledCatalog(file_obj.name)
+
+    def test_corrupt_offset(self):
+        with open(self.path, "rb") as file_obj:
+            data = bytearray(file_obj.read())
+
+        # The special offers section's offset, in the header
+        struct.pack_into("<Q", data, 44, len(data))
+
+        with tempfile.NamedTemporaryFile() as file_obj:
+            file_obj.write(data)
+            file_obj.flush()
+
+            with self.assertRaisesRegex(ValueError, "special offers"):
+                CompiledCatalog(file_obj.name)
+
+    def test_unsupported_type(self):
+        product_stub_seq = ProductFactory.stub_batch(2)
+        special_offers_json = json.dumps([MultiBuyFactory.stub_to_dict(
+            MultiBuyFactory.stub(products=product_stub_seq),
+        )])
+
+        with self.assertRaises(ValueError):
+            compile_catalog(
+                io.StringIO(json.dumps(
+                    list(map(ProductFactory.stub_to_dict, product_stub_seq)),
+                )),
+                io.StringIO(special_offers_json),
+                io.BytesIO(),
+            )
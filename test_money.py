@@ -0,0 +1,59 @@
+import unittest
+from decimal import Decimal
+
+from parameterized import parameterized
+
+from money import from_pence, multiply_pence, to_pence, to_ratio
+
+
+class TestToPence(unittest.TestCase):
+
+    @parameterized.expand([
+        ("0", 0),
+        ("0.01", 1),
+        ("1.30", 130),
+        ("1.3", 130),
+        ("-0.65", -65),
+        ("0.325", 32),
+        ("0.335", 34),
+        ("123456.78", 12345678),
+    ])
+    def test_success(self, dec_str, expected):
+        self.assertEqual(expected, to_pence(Decimal(dec_str)))
+
+    @parameterized.expand([(0,), (1,), (130,), (-65,), (12345678,)])
+    def test_round_trip(self, pence):
+        self.assertEqual(pence, to_pence(from_pence(pence)))
+
+
+class TestMultiplyPence(unittest.TestCase):
+
+    @parameterized.expand([
+        # Whole pence
+        (100, "0.1", 10),
+        (80, "0.5", 40),
+
+        # Ties are rounded to the nearest even penny
+        (65, "0.5", 32),
+        (75, "0.5", 38),
+        (-65, "0.5", -32),
+        (-75, "0.5", -38),
+
+        # Not ties
+        (65, "0.333", 22),
+        (-65, "0.333", -22),
+        (0, "0.75", 0),
+    ])
+    def test_success(self, pence, ratio_str, expected):
+        actual = multiply_pence(pence, *to_ratio(Decimal(ratio_str)))
+        self.assertEqual(expected, actual)
+
+    def test_matches_decimal(self):
+        for pence in range(-250, 250):
+            for ratio_str in ("0.1", "0.25", "0.5", "0.333", "1.125"):
+                ratio = Decimal(ratio_str)
+
+                expected = to_pence(from_pence(pence) * ratio)
+                actual = multiply_pence(pence, *to_ratio(ratio))
+
+                self.assertEqual(expected, actual)
@@ -0,0 +1,260 @@
+import unittest
+from collections import Counter
+from decimal import Decimal
+
+import factory
+from parameterized import parameterized
+
+from factories import (
+    BundleFactory,
+    FractionOfPriceFactory,
+    FractionOfPricePerQuantityFactory,
+    MultiBuyFactory,
+    ProductFactory,
+    fake,
+)
+from offer_rule import (
+    DiscountedSet,
+    OfferRule,
+    PriceRuleType,
+    TriggerSet,
+    compile_rule,
+    get_rule_products,
+    iter_rule_allocations,
+)
+
+
+def _create_product(price):
+    return ProductFactory.stub_to_obj(
+        ProductFactory.stub(price=Decimal(price)))
+
+
+class TestCompileRule(unittest.TestCase):
+
+    def setUp(self):
+        self.product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(4),
+        ))
+
+    def get_baskets(self):
+        for _ in range(32):
+            yield Counter({
+                product: fake.random_int(min=0, max=9)
+                for product in self.product_seq})
+
+    def assertRuleEqual(self, special_offer):
+        products = get_rule_products(special_offer.rule)
+        get_value, get_value_pence = compile_rule(
+            special_offer.rule,
+            products,
+        )
+
+        for basket in self.get_baskets():
+            quantities = tuple(basket[p] for p in products)
+
+            self.assertEqual(
+                special_offer.get_discount(basket).value,
+                get_value(quantities),
+            )
+            self.assertEqual(
+                special_offer.get_discount_pence(basket).value,
+                get_value_pence(quantities),
+            )
+
+    def test_fraction_of_price(self):
+        for stub in FractionOfPriceFactory.stub_batch(
+            8,
+            discounted_product=factory.Faker(
+                'random_element', elements=self.product_seq),
+        ):
+            self.assertRuleEqual(FractionOfPriceFactory.stub_to_obj(
+                stub,
+                (stub.discounted_product,),
+            ))
+
+    def test_fraction_of_price_per_quantity(self):
+        for stub in FractionOfPricePerQuantityFactory.stub_batch(
+            8,
+            trigger_product=factory.Faker(
+                'random_element', elements=self.product_seq),
+            discounted_product=factory.Faker(
+                'random_element', elements=self.product_seq),
+        ):
+            self.assertRuleEqual(
+                FractionOfPricePerQuantityFactory.stub_to_obj(
+                    stub,
+                    (stub.trigger_product, stub.discounted_product),
+                ))
+
+    def test_several_products(self):
+        soup = _create_product("0.65")
+        bread = _create_product("0.80")
+        rule = OfferRule(
+            trigger_sets=(),
+            discounted_sets=(DiscountedSet((soup, bread), None),),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=Decimal("0.5"),
+        )
+        get_value, get_value_pence = compile_rule(
+            rule,
+            (soup, bread),
+        )
+
+        self.assertEqual(Decimal("0.725"), get_value((1, 1)))
+        self.assertEqual(72, get_value_pence((1, 1)))
+
+    def test_separate_trigger_and_discounted_quantities(self):
+        apple = _create_product("1.00")
+
+        # Buy 1 apple, get 2 half price
+        rule = OfferRule(
+            trigger_sets=(TriggerSet((apple,), 1),),
+            discounted_sets=(DiscountedSet((apple,), 2),),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=Decimal("0.5"),
+        )
+        _, get_value_pence = compile_rule(rule, (apple, apple))
+
+        # 2 apples as triggers, 3 discounted
+        self.assertEqual(150, get_value_pence((2, 3)))
+
+    def test_zero_quota(self):
+        apple = _create_product("1.00")
+        rule = OfferRule(
+            trigger_sets=(TriggerSet((apple,), 0),),
+            discounted_sets=(DiscountedSet((apple,), 1),),
+            price_rule_type=PriceRuleType.FRACTION_OF_PRICE,
+            price_rule_value=Decimal("0.5"),
+        )
+        get_value, get_value_pence = compile_rule(rule, (apple,))
+
+        self.assertEqual(Decimal(0), get_value((3,)))
+        self.assertEqual(0, get_value_pence((3,)))
+        self.assertEqual(
+            [],
+            list(iter_rule_allocations(rule, Counter({apple: 3}))),
+        )
+
+    def test_invalid(self):
+        rule = OfferRule(
+            trigger_sets=(),
+            discounted_sets=(),
+            price_rule_type=PriceRuleType.FIXED_PRICE,
+            price_rule_value=Decimal("1.00"),
+        )
+
+        with self.assertRaises(ValueError):
+            compile_rule(rule, get_rule_products(rule))
+
+
+class TestMultiBuy(unittest.TestCase):
+
+    def setUp(self):
+        self.soup = _create_product("0.65")
+        self.bread = _create_product("0.80")
+
+        # 3 for 2
+        self.special_offer = MultiBuyFactory.stub_to_obj(
+            MultiBuyFactory.stub(buy_quantity=3, pay_quantity=2),
+            (self.soup, self.bread),
+        )
+
+    @parameterized.expand([
+        ("too_few", 2, 0, 0),
+        ("one_product", 3, 0, 65),
+        ("cheapest_free", 2, 1, 65),
+        ("twice", 4, 2, 130),
+        ("bread", 0, 7, 160),
+    ])
+    def test_get_discount(self, _, num_soups, num_breads, expected):
+        basket = Counter({self.soup: num_soups, self.bread: num_breads})
+
+        discount = self.special_offer.get_discount_pence(basket)
+
+        self.assertEqual(expected, discount.value)
+        self.assertEqual(
+            Decimal(expected) / 100,
+            self.special_offer.get_discount(basket).value,
+        )
+
+    def test_description(self):
+        discount = self.special_offer.get_discount(Counter({self.soup: 3}))
+
+        self.assertEqual(
+            f"{self.soup.name}, {self.bread.name} 3 for 2: -65p",
+            discount.description,
+        )
+
+    def test_allocations(self):
+        basket = Counter({self.soup: 2, self.bread: 2})
+
+        self.assertEqual(
+            [{self.soup: 2, self.bread: 1}],
+            list(iter_rule_allocations(self.special_offer.rule, basket)),
+        )
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.soup = _create_product("0.65")
+        self.bread = _create_product("0.80")
+
+        # A soup and 2 breads for £2.00
+        self.special_offer = BundleFactory.stub_to_obj(
+            BundleFactory.stub(quantities=[1, 2], price=Decimal("2.00")),
+            (self.soup, self.bread),
+        )
+
+    @parameterized.expand([
+        ("incomplete", 1, 1, 0),
+        ("one", 1, 2, 25),
+        ("extra", 2, 3, 25),
+        ("two", 2, 4, 50),
+    ])
+    def test_get_discount(self, _, num_soups, num_breads, expected):
+        basket = Counter({self.soup: num_soups, self.bread: num_breads})
+
+        self.assertEqual(
+            expected,
+            self.special_offer.get_discount_pence(basket).value,
+        )
+        self.assertEqual(
+            Decimal(expected) / 100,
+            self.special_offer.get_discount(basket).value,
+        )
+
+    def test_more_than_original_cost(self):
+        special_offer = BundleFactory.stub_to_obj(
+            BundleFactory.stub(quantities=[1, 1], price=Decimal("10.00")),
+            (self.soup, self.bread),
+        )
+        basket = Counter({self.soup: 1, self.bread: 1})
+
+        self.assertEqual(0, special_offer.get_discount_pence(basket).value)
+        self.assertEqual(
+            Decimal(0),
+            special_offer.get_discount(basket).value,
+        )
+
+    def test_description(self):
+        discount = self.special_offer.get_discount_pence(
+            Counter({self.soup: 1, self.bread: 2}),
+        )
+
+        self.assertEqual(
+            f"{self.soup.name} + 2 x {self.bread.name} for £2.00: -25p",
+            discount.description,
+        )
+
+    def test_allocations(self):
+        basket = Counter({self.soup: 3, self.bread: 5})
+
+        self.assertEqual(
+            [
+                {self.soup: 1, self.bread: 2},
+                {self.soup: 2, self.bread: 4},
+            ],
+            list(iter_rule_allocations(self.special_offer.rule, basket)),
+        )
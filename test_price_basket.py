@@ -0,0 +1,846 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from parameterized import parameterized
+
+from allocation import Allocator
+from factories import (
+    BasketsTestCaseMixin,
+    ProductFactory,
+    create_products_by_id,
+    fake,
+)
+from money import to_pence
+from price_basket import (
+    _PRODUCTS_PATH,
+    _SPECIAL_OFFERS_PATH,
+    CatalogSnapshot,
+    PricingEngine,
+    _iter_lines_flushing,
+    _parse_args,
+    _price_stream,
+    _price_stream_parallel,
+    _read_products,
+    _read_special_offer_objs,
+    _reload_catalog_async,
+    _watch_catalog,
+    _write_bills,
+    get_original_total_and_discounts,
+    load_json_catalog,
+    load_json_catalog_async,
+    load_json_catalog_shards,
+    price_baskets,
+    start_server,
+)
+from special_offer import get_special_offers_by_product
+from stats import PricingStats, collect_stats
+
+
+class BasketsTestCase(BasketsTestCaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.catalog = CatalogSnapshot(
+            products_by_id=create_products_by_id(self.product_seq),
+            product_by_name={p.name: p for p in self.product_seq},
+            special_offers=self.special_offers,
+            special_offers_by_product=get_special_offers_by_product(
+                self.special_offers,
+            ),
+        )
+
+
+class TestPriceBaskets(BasketsTestCase):
+
+    def test_matches_single_basket(self):
+        expected = [
+            (original_total, tuple(discounts))
+            for original_total, discounts in (
+                get_original_total_and_discounts(b, self.special_offers)
+                for b in self.baskets)]
+
+        actual = price_baskets(self.baskets, self.special_offers)
+
+        self.assertEqual(
+            [(t, tuple(d.value for d in ds)) for t, ds in expected],
+            [(t, tuple(d.value for d in ds)) for t, ds in actual],
+        )
+
+    def test_empty(self):
+        self.assertEqual([], price_baskets([], self.special_offers))
+
+    def test_stats(self):
+        with collect_stats() as stats:
+            price_baskets(self.baskets, self.special_offers)
+
+        self.assertEqual(len(self.baskets), stats.baskets)
+
+
+class TestGetOriginalTotalAndDiscounts(BasketsTestCase):
+
+    def test_stats(self):
+        with collect_stats() as stats:
+            for basket in self.baskets:
+                _, discounts = get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                    self.catalog.special_offers_by_product,
+                )
+
+                for _ in discounts:
+                    pass
+
+        expected = Counter()
+        expected_hits = Counter()
+
+        for basket in self.baskets:
+            for position, special_offer in enumerate(self.special_offers):
+                if any(p in basket for p in special_offer._products):
+                    expected[position] += 1
+                    expected_hits[position] += (
+                        special_offer.get_discount(basket).value > 0)
+
+        self.assertEqual(len(self.baskets), stats.baskets)
+        self.assertEqual(
+            expected,
+            Counter({p: s.calls for p, s in stats.by_position.items()}),
+        )
+        self.assertEqual(
+            +expected_hits,
+            +Counter({p: s.hits for p, s in stats.by_position.items()}),
+        )
+        self.assertEqual(
+            sum(expected.values()),
+            sum(s.calls for s in stats.by_type.values()),
+        )
+
+    def test_special_offers_by_product(self):
+        special_offers_by_product = get_special_offers_by_product(
+            self.special_offers,
+        )
+
+        for basket in self.baskets:
+            expected_total, expected_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                ))
+
+            actual_total, actual_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                    special_offers_by_product,
+                ))
+
+            self.assertEqual(expected_total, actual_total)
+            self.assertEqual(
+                tuple(d.value for d in expected_discounts),
+                tuple(d.value for d in actual_discounts),
+            )
+
+    def test_in_pence(self):
+        for basket in self.baskets:
+            expected_total, expected_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                ))
+
+            actual_total, actual_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                    in_pence=True,
+                ))
+
+            self.assertEqual(
+                to_pence(Decimal(expected_total)),
+                actual_total,
+            )
+
+            # Each discount is rounded to the nearest penny, so a
+            # discount of less than half a penny is dropped
+            self.assertEqual(
+                tuple(
+                    to_pence(d.value) for d in expected_discounts
+                    if to_pence(d.value) > 0),
+                tuple(d.value for d in actual_discounts),
+            )
+
+
+class TestPriceStream(BasketsTestCase):
+
+    def test_success(self):
+        engine = PricingEngine(lambda: self.catalog)
+
+        lines = [
+            json.dumps([p.name for p in b.elements()]) + "\n"
+            for b in self.baskets]
+
+        lines.insert(1, "\n")
+        lines.insert(2, json.dumps(["Not a product"]) + "\n")
+        lines.insert(3, "{}\n")
+
+        with io.StringIO() as file_obj:
+            with self.assertLogs("price_basket"):
+                _write_bills(
+                    _price_stream(lines, engine),
+                    file_obj,
+                )
+
+            actual = list(map(json.loads, file_obj.getvalue().splitlines()))
+
+        # One result per line, including the blank line
+        for _ in range(3):
+            self.assertEqual({"error": "Basket is invalid"}, actual.pop(1))
+
+        self.assertEqual(len(self.baskets), len(actual))
+
+        for basket, result_obj in zip(self.baskets, actual):
+            original_total, discounts = get_original_total_and_discounts(
+                basket,
+                self.special_offers,
+            )
+            discounts = tuple(discounts)
+
+            self.assertEqual(
+                Decimal(original_total),
+                Decimal(result_obj["original_total"]),
+            )
+            self.assertEqual(
+                [d.value for d in discounts],
+                [Decimal(d["value"]) for d in result_obj["discounts"]],
+            )
+            self.assertEqual(
+                original_total - sum(d.value for d in discounts),
+                Decimal(result_obj["total"]),
+            )
+
+
+class TestIterLinesFlushing(unittest.TestCase):
+
+    def test_flush_when_input_runs_dry(self):
+        read_fd, write_fd = os.pipe()
+
+        with open(read_fd) as in_file_obj, \
+                open(write_fd, "w") as pipe_file_obj:
+            pipe_file_obj.write("1\n")
+            pipe_file_obj.flush()
+
+            def flush():
+                # The next line only arrives once the output is flushed,
+                # as from a co-process
+                if not pipe_file_obj.closed:
+                    pipe_file_obj.write("2\n")
+                    pipe_file_obj.close()
+
+            out_file_obj = Mock()
+            out_file_obj.flush.side_effect = flush
+
+            lines = _iter_lines_flushing(in_file_obj, out_file_obj)
+
+            self.assertEqual("1\n", next(lines))
+            out_file_obj.flush.assert_not_called()
+
+            self.assertEqual("2\n", next(lines))
+            out_file_obj.flush.assert_called_once()
+
+            self.assertEqual([], list(lines))
+
+    def test_flush_per_chunk(self):
+        read_fd, write_fd = os.pipe()
+
+        with open(read_fd) as in_file_obj:
+            with open(write_fd, "w") as pipe_file_obj:
+                pipe_file_obj.write("[\"Soup\"]\n" * 1000)
+
+            out_file_obj = Mock()
+
+            self.assertEqual(
+                ["[\"Soup\"]\n"] * 1000,
+                list(_iter_lines_flushing(in_file_obj, out_file_obj)),
+            )
+
+        # Not once per line
+        self.assertLessEqual(out_file_obj.flush.call_count, 2)
+
+    def test_in_memory(self):
+        out_file_obj = Mock()
+
+        self.assertEqual(
+            ["1\n", "2\n"],
+            list(_iter_lines_flushing(io.StringIO("1\n2\n"), out_file_obj)),
+        )
+        out_file_obj.flush.assert_not_called()
+
+
+class TestPriceStreamParallel(unittest.TestCase):
+
+    def test_matches_serial(self):
+        engine = PricingEngine.from_json()
+
+        lines = [
+            json.dumps(fake.random_elements(
+                tuple(engine.catalog.product_by_name),
+                length=fake.random_int(min=0, max=6),
+            )) + "\n"
+            for _ in range(64)]
+
+        lines.insert(fake.random_int(min=0, max=64), "[1]\n")
+
+        with io.StringIO() as file_obj:
+            with self.assertLogs("price_basket"):
+                _write_bills(
+                    _price_stream(lines, engine),
+                    file_obj,
+                )
+
+            expected = file_obj.getvalue()
+
+        with collect_stats() as expected_stats:
+            with self.assertLogs("price_basket"):
+                for _ in _price_stream(lines, engine):
+                    pass
+
+        stats = PricingStats()
+
+        actual = "".join(_price_stream_parallel(
+            lines,
+            engine,
+            workers=2,
+            chunk_size=5,
+            stats=stats,
+        ))
+
+        self.assertEqual(expected, actual)
+
+        self.assertEqual(expected_stats.baskets, stats.baskets)
+        self.assertEqual(
+            {p: s.calls for p, s in expected_stats.by_position.items()},
+            {p: s.calls for p, s in stats.by_position.items()},
+        )
+
+    def test_allocator(self):
+        engine = PricingEngine.from_json(allocator=Allocator())
+
+        lines = [
+            json.dumps(fake.random_elements(
+                tuple(engine.catalog.product_by_name),
+                length=fake.random_int(min=0, max=6),
+            )) + "\n"
+            for _ in range(64)]
+
+        with io.StringIO() as file_obj:
+            _write_bills(_price_stream(lines, engine), file_obj)
+            expected = file_obj.getvalue()
+
+        self.assertEqual(expected, "".join(_price_stream_parallel(
+            lines,
+            engine,
+            workers=2,
+            chunk_size=5,
+        )))
+
+
+class TestPricingEngine(BasketsTestCase):
+
+    def test_lazy(self):
+        load_catalog = Mock(return_value=self.catalog)
+        engine = PricingEngine(load_catalog)
+
+        load_catalog.assert_not_called()
+
+        for basket in self.baskets:
+            original_total, discounts = (
+                engine.get_original_total_and_discounts(basket))
+
+            expected_total, expected_discounts = (
+                get_original_total_and_discounts(
+                    basket,
+                    self.special_offers,
+                ))
+
+            self.assertEqual(expected_total, original_total)
+            self.assertEqual(
+                tuple(d.value for d in expected_discounts),
+                tuple(d.value for d in discounts),
+            )
+
+        self.assertEqual(
+            price_baskets(self.baskets, self.special_offers),
+            engine.price_baskets(self.baskets),
+        )
+
+        load_catalog.assert_called_once_with()
+
+    def test_reload(self):
+        other_catalog = self.catalog._replace(special_offers=())
+        load_catalog = Mock(side_effect=[self.catalog, other_catalog])
+        engine = PricingEngine(load_catalog)
+
+        basket = self.baskets[0]
+        original_total, discounts = engine.get_original_total_and_discounts(
+            basket,
+        )
+
+        self.assertIs(other_catalog, engine.reload())
+        self.assertIs(other_catalog, engine.catalog)
+
+        # A call in progress finishes with the previous catalog
+        expected_total, expected_discounts = (
+            get_original_total_and_discounts(
+                basket,
+                self.special_offers,
+            ))
+
+        self.assertEqual(expected_total, original_total)
+        self.assertEqual(
+            tuple(d.value for d in expected_discounts),
+            tuple(d.value for d in discounts),
+        )
+
+    def test_reload_failed(self):
+        load_catalog = Mock(side_effect=[self.catalog, ValueError])
+        engine = PricingEngine(load_catalog)
+
+        self.assertIs(self.catalog, engine.catalog)
+
+        with self.assertRaises(ValueError):
+            engine.reload()
+
+        self.assertIs(self.catalog, engine.catalog)
+
+    def test_cache(self):
+        other_catalog = self.catalog._replace(
+            special_offers=(),
+            special_offers_by_product={},
+        )
+        load_catalog = Mock(side_effect=[self.catalog, other_catalog])
+
+        engine = PricingEngine(load_catalog, cache_size=len(self.baskets))
+        keys = {frozenset(b.items()) for b in self.baskets}
+
+        for _ in range(2):
+            for basket in self.baskets:
+                expected_total, expected_discounts = (
+                    get_original_total_and_discounts(
+                        basket,
+                        self.special_offers,
+                    ))
+
+                # A copy, so that only equal baskets (rather than the
+                # same basket) are cached
+                actual_total, actual_discounts = (
+                    engine.get_original_total_and_discounts(
+                        Counter(dict(reversed(basket.items()))),
+                    ))
+
+                self.assertEqual(expected_total, actual_total)
+                self.assertEqual(
+                    tuple(d.value for d in expected_discounts),
+                    tuple(d.value for d in actual_discounts),
+                )
+
+        cache_info = engine.cache_info()
+
+        self.assertEqual(len(keys), cache_info.misses)
+        self.assertEqual(len(self.baskets) * 2 - len(keys), cache_info.hits)
+        self.assertEqual(0, cache_info.evictions)
+
+        engine.reload()
+
+        for original_total, discounts in engine.price_baskets(self.baskets):
+            self.assertEqual((), discounts)
+
+        self.assertEqual(len(keys) * 2, engine.cache_info().misses)
+
+    def test_no_cache(self):
+        self.assertIsNone(PricingEngine(lambda: self.catalog).cache_info())
+
+    def test_many_engines(self):
+        engine = PricingEngine.from_json()
+        other_engine = PricingEngine(lambda: self.catalog)
+
+        self.assertIsNot(
+            engine.catalog.special_offers,
+            other_engine.catalog.special_offers,
+        )
+        self.assertEqual(
+            self.catalog.product_by_name,
+            other_engine.catalog.product_by_name,
+        )
+
+
+class TestServer(BasketsTestCase, unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.engine = PricingEngine(lambda: self.catalog)
+
+        self.lines = [
+            json.dumps([p.name for p in b.elements()]) + "\n"
+            for b in self.baskets]
+
+        self.lines.insert(1, json.dumps(["Not a product"]) + "\n")
+        self.lines.insert(2, "\n")
+
+    async def _request(self, reader, writer):
+        writer.write("".join(self.lines).encode())
+        writer.write_eof()
+
+        data = await reader.read()
+
+        writer.close()
+        await writer.wait_closed()
+
+        return data.decode()
+
+    def _get_expected(self, in_pence):
+        with io.StringIO() as file_obj:
+            with self.assertLogs("price_basket"):
+                _write_bills(
+                    _price_stream(self.lines, self.engine, in_pence),
+                    file_obj,
+                    in_pence,
+                )
+
+            return file_obj.getvalue()
+
+    @parameterized.expand([
+        ("decimal", False),
+        ("pence", True),
+    ])
+    async def test_tcp(self, _, in_pence):
+        server = await start_server(self.engine, port=0, in_pence=in_pence)
+
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+
+            with self.assertLogs("price_basket"):
+                actual = await self._request(
+                    *await asyncio.open_connection("127.0.0.1", port),
+                )
+
+        self.assertEqual(self._get_expected(in_pence), actual)
+        self.assertEqual(len(self.lines), len(actual.splitlines()))
+
+    async def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            socket_path = Path(dir_path) / "price_basket.sock"
+
+            server = await start_server(self.engine, socket_path)
+
+            async with server:
+                with self.assertLogs("price_basket"):
+                    actual = await self._request(
+                        *await asyncio.open_unix_connection(socket_path),
+                    )
+
+        self.assertEqual(self._get_expected(False), actual)
+
+
+class TestWatchCatalog(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reload_on_change(self):
+        with tempfile.TemporaryDirectory() as dir_path:
+            products_path = Path(dir_path) / "products.json"
+            special_offers_path = Path(dir_path) / "special_offers.json"
+
+            shutil.copy(_PRODUCTS_PATH, products_path)
+            shutil.copy(_SPECIAL_OFFERS_PATH, special_offers_path)
+
+            engine = PricingEngine.from_json(
+                products_path,
+                special_offers_path,
+            )
+            previous_catalog = engine.catalog
+
+            self.assertTrue(previous_catalog.special_offers)
+
+            watch_task = asyncio.create_task(_watch_catalog(
+                engine,
+                (products_path, special_offers_path),
+                0.01,
+            ))
+
+            try:
+                await asyncio.sleep(0.05)
+
+                special_offers_path.write_text("[]")
+                stat = special_offers_path.stat()
+                os.utime(
+                    special_offers_path,
+                    ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9),
+                )
+
+                with self.assertLogs("price_basket"):
+                    for _ in range(100):
+                        if engine.catalog is not previous_catalog:
+                            break
+
+                        await asyncio.sleep(0.01)
+            finally:
+                watch_task.cancel()
+
+        self.assertEqual((), engine.catalog.special_offers)
+        self.assertEqual(
+            list(previous_catalog.product_by_name),
+            list(engine.catalog.product_by_name),
+        )
+
+    async def test_retry_failed_reload(self):
+        catalogs = [CatalogSnapshot({}, {}, (), {}) for _ in range(2)]
+        load_catalog = Mock(side_effect=[
+            catalogs[0],
+            ValueError("Half written"),
+            ValueError("Half written"),
+            catalogs[1],
+        ])
+        engine = PricingEngine(load_catalog)
+
+        self.assertIs(catalogs[0], engine.catalog)
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            path = Path(dir_path) / "special_offers.json"
+            path.write_text("[]")
+
+            watch_task = asyncio.create_task(
+                _watch_catalog(engine, (path,), 0.01),
+            )
+
+            try:
+                await asyncio.sleep(0.05)
+
+                stat = path.stat()
+                os.utime(
+                    path,
+                    ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9),
+                )
+
+                # The file only changes once, but the failed reload is
+                # tried again
+                with self.assertLogs("price_basket") as logs:
+                    for _ in range(100):
+                        if engine.catalog is catalogs[1]:
+                            break
+
+                        await asyncio.sleep(0.01)
+            finally:
+                watch_task.cancel()
+
+        self.assertIs(catalogs[1], engine.catalog)
+        self.assertEqual(4, load_catalog.call_count)
+
+        # Only the first failure is logged with its traceback
+        self.assertEqual(
+            [("ERROR", True), ("WARNING", False), ("INFO", False)],
+            [(r.levelname, bool(r.exc_info)) for r in logs.records],
+        )
+
+    async def test_close_previous_catalog(self):
+        catalogs = [
+            CatalogSnapshot({}, {}, (), {}, Mock())
+            for _ in range(2)]
+        engine = PricingEngine(Mock(side_effect=[
+            catalogs[0],
+            ValueError("Invalid catalog"),
+            catalogs[1],
+        ]))
+        engine.catalog
+
+        with self.assertLogs("price_basket"):
+            self.assertFalse(await _reload_catalog_async(engine))
+
+        catalogs[0].close.assert_not_called()
+
+        with self.assertLogs("price_basket"):
+            self.assertTrue(await _reload_catalog_async(engine))
+
+        catalogs[0].close.assert_called_once_with()
+        catalogs[1].close.assert_not_called()
+
+
+class TestLoadJsonCatalogAsync(unittest.IsolatedAsyncioTestCase):
+
+    def _write_shards(self, dir_path, path, num_shards):
+        with open(path) as file_obj:
+            objs = json.load(file_obj)
+
+        shard_paths = []
+
+        for i in range(num_shards):
+            shard_path = Path(dir_path) / f"{i}-{path.name}"
+            shard_path.write_text(json.dumps(objs[i::num_shards]))
+            shard_paths.append(shard_path)
+
+        return shard_paths
+
+    def assertCatalogEqual(self, expected, catalog):
+        self.assertEqual(
+            sorted(expected.product_by_name),
+            sorted(catalog.product_by_name),
+        )
+
+        basket = Counter({
+            product: 3
+            for product in catalog.products_by_id.values()})
+        expected_basket = Counter({
+            product: 3
+            for product in expected.products_by_id.values()})
+
+        (original_total, discounts), = price_baskets(
+            [basket],
+            catalog.special_offers,
+            catalog.special_offers_by_product,
+        )
+        (expected_original_total, expected_discounts), = price_baskets(
+            [expected_basket],
+            expected.special_offers,
+            expected.special_offers_by_product,
+        )
+
+        self.assertEqual(expected_original_total, original_total)
+        self.assertEqual(
+            sorted((d.value, d.description) for d in expected_discounts),
+            sorted((d.value, d.description) for d in discounts),
+        )
+
+    @parameterized.expand([
+        ("one_shard", 1, False),
+        ("shards", 3, False),
+        ("shards_compact", 3, True),
+    ])
+    async def test_shards(self, _, num_shards, compact):
+        expected = load_json_catalog(
+            _PRODUCTS_PATH,
+            _SPECIAL_OFFERS_PATH,
+            compact,
+        )
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            catalog = await load_json_catalog_async(
+                self._write_shards(dir_path, _PRODUCTS_PATH, num_shards),
+                self._write_shards(
+                    dir_path,
+                    _SPECIAL_OFFERS_PATH,
+                    num_shards,
+                ),
+                compact,
+            )
+
+        self.assertCatalogEqual(expected, catalog)
+
+    async def test_last_shard_wins(self):
+        product_stub = ProductFactory.stub()
+        product_obj = ProductFactory.stub_to_dict(product_stub)
+        override_obj = dict(product_obj, name=f"{product_stub.name} 2")
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            products_paths = []
+
+            for i, obj in enumerate((product_obj, override_obj)):
+                products_path = Path(dir_path) / f"products-{i}.json"
+                products_path.write_text(json.dumps([obj]))
+                products_paths.append(products_path)
+
+            special_offers_path = Path(dir_path) / "special_offers.json"
+            special_offers_path.write_text("[]")
+
+            catalog = await load_json_catalog_async(
+                products_paths,
+                [special_offers_path],
+            )
+
+        self.assertEqual([override_obj["name"]], list(
+            catalog.product_by_name))
+
+    async def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            await load_json_catalog_async(
+                [_PRODUCTS_PATH],
+                [Path("missing.json")],
+            )
+
+    def patch_overlap(self):
+        """
+        Patch the file readers so that the products can only be read
+        once reading the special offers has started
+        """
+        started = threading.Event()
+
+        def read_special_offer_objs(special_offers_path):
+            started.set()
+            return _read_special_offer_objs(special_offers_path)
+
+        def read_products(products_path):
+            self.assertTrue(started.wait(5))
+            return _read_products(products_path)
+
+        return patch.multiple(
+            "price_basket",
+            _read_products=read_products,
+            _read_special_offer_objs=read_special_offer_objs,
+        )
+
+    async def test_overlap(self):
+        expected = load_json_catalog(_PRODUCTS_PATH, _SPECIAL_OFFERS_PATH)
+
+        with self.patch_overlap():
+            catalog = await load_json_catalog_async(
+                [_PRODUCTS_PATH],
+                [_SPECIAL_OFFERS_PATH],
+            )
+
+        self.assertCatalogEqual(expected, catalog)
+
+    def test_overlap_one_pair(self):
+        expected = load_json_catalog_shards(
+            [_PRODUCTS_PATH],
+            [_SPECIAL_OFFERS_PATH],
+        )
+
+        with self.patch_overlap():
+            catalog = load_json_catalog(_PRODUCTS_PATH, _SPECIAL_OFFERS_PATH)
+
+        self.assertCatalogEqual(expected, catalog)
+
+    def test_sync(self):
+        catalog = load_json_catalog_shards(
+            [_PRODUCTS_PATH],
+            [_SPECIAL_OFFERS_PATH],
+        )
+
+        self.assertCatalogEqual(
+            load_json_catalog(_PRODUCTS_PATH, _SPECIAL_OFFERS_PATH),
+            catalog,
+        )
+
+
+class TestParseArgs(unittest.TestCase):
+
+    def test_stats_with_allocate(self):
+        argv = ["price_basket.py", "--stats", "--allocate", "ItemA"]
+
+        with patch("sys.argv", argv), \
+                contextlib.redirect_stderr(io.StringIO()) as file_obj, \
+                self.assertRaises(SystemExit):
+            _parse_args()
+
+        self.assertIn(
+            "--stats cannot be used with --allocate",
+            file_obj.getvalue(),
+        )
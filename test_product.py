@@ -1,15 +1,21 @@
 import io
 import json
 import unittest
-from itertools import chain, repeat
+from decimal import Decimal
 from operator import attrgetter
 from random import sample
 from unittest.mock import patch, sentinel
 
 import factory
+from parameterized import parameterized
 
 from factories import ProductFactory, fake
-from product import Product, get_products_from_json
+from product import (
+    Product,
+    ProductTable,
+    get_product_table_from_json,
+    get_products_from_json,
+)
 
 
 class TestProductFromJson(unittest.TestCase):
@@ -61,6 +67,28 @@ class TestProductFromJson(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_invalid_product(self):
+        stub_seq = ProductFactory.stub_batch(2)
+
+        with io.StringIO() as file_obj:
+            product_obj_seq = [
+                {
+                    "product_id": stub.product_id,
+                    "name": stub.name,
+                    "price": str(stub.price)
+                }
+                for stub in stub_seq
+            ]
+            product_obj_seq[0]["price"] = 1
+            json.dump(product_obj_seq, file_obj)
+            file_obj.seek(0)
+
+            with self.assertLogs("product") as logs:
+                product, = Product.from_json(file_obj)
+
+        self.assertEqual(stub_seq[1].product_id, product.product_id)
+        self.assertIn("'price' field is invalid", logs.output[0])
+
 
 class TestGetProductsFromJson(unittest.TestCase):
 
@@ -82,18 +110,24 @@ class TestGetProductsFromJson(unittest.TestCase):
         from_json = product_cls.from_json
         from_json.return_value.__iter__.return_value = product_seq
 
-        expected = (None, ) + product_seq
-
         actual = get_products_from_json(file_obj)
 
-        self.assertEqual(expected, actual)
+        self.assertEqual({p.product_id: p for p in product_seq}, actual)
+        self.assertEqual(list(product_seq), actual.values())
+
+        with self.assertRaises(KeyError):
+            actual[0]
 
+    @parameterized.expand([
+        ("dense", (3, 6, 4, 5)),
+        ("unconsecutive", (3, 6, 10, 15)),
+        ("sparse", (7, 10 ** 12, 42, 999999999)),
+    ])
     @patch("product.Product")
-    def test_id_unconsecutive_and_unordered(self, product_cls):
+    def test_id_unconsecutive_and_unordered(
+            self, _, product_id_seq, product_cls):
         file_obj = sentinel.file_obj
 
-        product_id_seq = (3, 6, 10, 15)
-
         stub_seq = ProductFactory.stub_batch(
             len(product_id_seq),
             product_id=factory.Iterator(product_id_seq, cycle=False),
@@ -110,17 +144,95 @@ class TestGetProductsFromJson(unittest.TestCase):
             k=len(product_id_seq),
         )
 
-        expected = tuple(chain(
-            repeat(None, 3),
-            (product_seq[0],),
-            repeat(None, 2),
-            (product_seq[1],),
-            repeat(None, 3),
-            (product_seq[2],),
-            repeat(None, 4),
-            (product_seq[3],),
+        actual = get_products_from_json(file_obj)
+
+        self.assertEqual({p.product_id: p for p in product_seq}, actual)
+        self.assertEqual(sorted(product_id_seq), list(actual))
+        self.assertEqual(
+            sorted(product_seq, key=attrgetter("product_id")),
+            actual.values(),
+        )
+
+        for product_id in (0, 8, 16, 10 ** 12 + 1):
+            self.assertNotIn(product_id, actual)
+
+
+class TestProductTable(unittest.TestCase):
+
+    def setUp(self):
+        product_id_seq = sample(range(1, 10 ** 9), 8)
+
+        self.product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(
+                len(product_id_seq),
+                product_id=factory.Iterator(product_id_seq, cycle=False),
+            ),
         ))
 
-        actual = get_products_from_json(file_obj)
+        self.table = ProductTable(self.product_seq)
+
+    def test_rows(self):
+        getter = attrgetter("product_id", "name", "price", "price_pence")
+
+        expected = sorted(map(getter, self.product_seq))
+        actual = list(map(getter, self.table))
 
         self.assertEqual(expected, actual)
+
+    def test_by_id(self):
+        for product in self.product_seq:
+            record = self.table.by_id[product.product_id]
+
+            self.assertEqual(product.product_id, record.product_id)
+            self.assertEqual(product.name, record.name)
+            self.assertEqual(product.price, record.price)
+
+        self.assertNotIn(0, self.table.by_id)
+        self.assertEqual(
+            sorted(p.product_id for p in self.product_seq),
+            list(self.table.by_id),
+        )
+
+    def test_by_name(self):
+        for product in self.product_seq:
+            record = self.table.by_name[product.name]
+            self.assertEqual(product.product_id, record.product_id)
+
+        self.assertNotIn("Not a product", self.table.by_name)
+
+    def test_record_equality(self):
+        product = fake.random_element(self.product_seq)
+
+        record = self.table.by_id[product.product_id]
+        other_record = self.table.by_name[product.name]
+
+        self.assertEqual(record, other_record)
+        self.assertEqual(hash(record), hash(other_record))
+        self.assertEqual(1, len({record, other_record}))
+
+        self.assertNotEqual(
+            record,
+            ProductTable(self.product_seq).by_id[product.product_id],
+        )
+
+    def test_duplicate_ids(self):
+        product = Product(1, "A", Decimal("1.00"))
+        other_product = Product(1, "B", Decimal("2.00"))
+
+        table = ProductTable((product, other_product))
+
+        self.assertEqual(1, len(table))
+        self.assertEqual("B", table[0].name)
+
+    def test_from_json(self):
+        with io.StringIO() as file_obj:
+            json.dump(
+                [ProductFactory.stub_to_dict(p) for p in self.product_seq],
+                file_obj,
+            )
+            file_obj.seek(0)
+
+            table = get_product_table_from_json(file_obj)
+
+        self.assertEqual(len(self.product_seq), len(table))
@@ -1,31 +1,37 @@
 import io
 import json
+import pickle
 import unittest
 from collections import Counter
 from decimal import Decimal
-from functools import partial
 from itertools import chain, repeat
-from operator import is_not, attrgetter, itemgetter
+from operator import attrgetter, itemgetter
 from random import shuffle
+from unittest.mock import patch
 
 import factory
 from parameterized import parameterized
 
 from factories import (
+    BasketsTestCaseMixin,
+    BundleFactory,
     FractionOfPriceFactory,
     FractionOfPricePerQuantityFactory,
+    MultiBuyFactory,
     ProductFactory,
-    create_sparse_list,
+    create_products_by_id,
     fake,
 )
 from product import Product
 from special_offer import (
+    Discount,
     FractionOfPrice,
     FractionOfPriceProduct,
     FractionOfPricePerQuantity,
     FractionOfPricePerQuantityProduct,
     FractionOfPricePerQuantityShared,
     SpecialOfferType,
+    get_special_offers_by_product,
     get_special_offers_from_json,
 )
 
@@ -37,22 +43,17 @@ class TestFractionOfPriceFromJson(unittest.TestCase):
             fake.random_int(min=2, max=8),
         )
 
-        self.product_by_id = create_sparse_list(
-            (
-                s.product_id,
-                Product(
-                    product_id=s.product_id,
-                    name=s.name,
-                    price=s.price,
-                ),
+        self.product_by_id = create_products_by_id(
+            Product(
+                product_id=s.product_id,
+                name=s.name,
+                price=s.price,
             )
             for s in product_stub_seq)
 
     def test_one_special_offer(self):
-        discounted_product = fake.random_element(tuple(filter(
-            partial(is_not, None),
-            self.product_by_id,
-        )))
+        discounted_product = fake.random_element(
+            tuple(self.product_by_id.values()))
 
         fraction_of_price_str = f"0.{fake.random_int(min=1, max=99):02d}"
         fraction_of_price = Decimal(fraction_of_price_str)
@@ -90,29 +91,22 @@ class TestFractionOfPricePerQuantityFromJson(unittest.TestCase):
             fake.random_int(min=2, max=8),
         )
 
-        self.product_by_id = create_sparse_list(
-            (
-                s.product_id,
-                Product(
-                    product_id=s.product_id,
-                    name=s.name,
-                    price=s.price,
-                ),
+        self.product_by_id = create_products_by_id(
+            Product(
+                product_id=s.product_id,
+                name=s.name,
+                price=s.price,
             )
             for s in product_stub_seq)
 
     def test_one_special_offer(self):
-        trigger_product = fake.random_element(tuple(filter(
-            partial(is_not, None),
-            self.product_by_id,
-        )))
+        trigger_product = fake.random_element(
+            tuple(self.product_by_id.values()))
 
         trigger_product_quota = fake.random_int(min=1, max=4)
 
-        discounted_product = fake.random_element(tuple(filter(
-            partial(is_not, None),
-            self.product_by_id,
-        )))
+        discounted_product = fake.random_element(
+            tuple(self.product_by_id.values()))
 
         discounted_product_quota = fake.random_int(min=1, max=4)
 
@@ -205,6 +199,45 @@ class TestFractionOfPriceGetDiscount(unittest.TestCase):
 
         self.assertEqual(expected_value, actual.value)
 
+    def test_description(self):
+        discounted_product = Product(
+            product_id=fake.random_int(),
+            name="Apples",
+            price=Decimal("1.00"),
+        )
+
+        special_offer = FractionOfPrice(
+            (discounted_product,),
+            (FractionOfPriceProduct(fraction_of_price=Decimal("0.9")),),
+        )
+
+        with patch("special_offer.format_currency_gbp") as format_currency:
+            format_currency.return_value = "-20p"
+
+            discount = special_offer.get_discount(
+                Counter({discounted_product: 2}),
+            )
+
+            # The description is rendered on access only
+            format_currency.assert_not_called()
+
+            self.assertEqual("Apples 10% off: -20p", discount.description)
+
+        format_currency.assert_called_once_with(discount.value * -1)
+
+    def test_discount_fields(self):
+        # As created outside of a special offer
+        for discount in (
+                Discount(Decimal("0.10"), "Apples 10% off: -10p"),
+                Discount(
+                    value=Decimal("0.10"),
+                    description="Apples 10% off: -10p",
+                ),
+        ):
+            self.assertEqual(Decimal("0.10"), discount.value)
+            self.assertEqual("Apples 10% off: -10p", discount.description)
+            self.assertIsNone(discount.special_offer)
+
 
 class TestFractionOfPricePerQuantityGetDiscount(unittest.TestCase):
 
@@ -311,6 +344,173 @@ class TestFractionOfPricePerQuantityGetDiscount(unittest.TestCase):
         self.assertEqual(expected_value, actual.value)
 
 
+class TestCompiledEvaluators(BasketsTestCaseMixin, unittest.TestCase):
+
+    num_products = 4
+    num_per_quantity = 8
+
+    num_baskets = 16
+    min_quantity = 0
+    max_quantity = 20
+    max_num_basket_products = None
+
+    @staticmethod
+    def _get_reference_value(special_offer, quantity_by_product):
+        """
+        The discount's value, evaluated as it was before the special
+        offers were compiled
+        """
+        discounted_product = special_offer.discounted_product
+        quantity = quantity_by_product.get(discounted_product, 0)
+
+        if isinstance(special_offer, FractionOfPricePerQuantity):
+            trigger_quantity = quantity_by_product.get(
+                special_offer.trigger_product,
+                0,
+            )
+
+            if trigger_quantity > 0:
+                max_quantity = (
+                    (trigger_quantity //
+                     special_offer.trigger_product_quantity) *
+                    special_offer.discounted_product_quantity)
+            else:
+                max_quantity = 0
+
+            quantity = min(max_quantity, quantity)
+
+        return (
+            quantity *
+            discounted_product.price *
+            (1 - special_offer.fraction_of_price))
+
+    def test_identical(self):
+        for special_offer in self.special_offers:
+            for basket in self.baskets:
+                expected = self._get_reference_value(special_offer, basket)
+                actual = special_offer.get_discount(basket).value
+
+                # Compare the representations, so that the exponents
+                # must be identical too
+                self.assertEqual(str(expected), str(actual))
+
+    def test_pickle(self):
+        for special_offer in self.special_offers:
+            for basket in self.baskets:
+                # Pickled together, so that the unpickled basket holds
+                # the unpickled special offer's products
+                unpickled, unpickled_basket = pickle.loads(
+                    pickle.dumps((special_offer, basket)))
+
+                self.assertEqual(
+                    special_offer.get_discount(basket).value,
+                    unpickled.get_discount(unpickled_basket).value,
+                )
+                self.assertEqual(
+                    special_offer.get_discount_pence(basket).value,
+                    unpickled.get_discount_pence(unpickled_basket).value,
+                )
+
+
+class TestMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(3),
+        ))
+
+        self.stub = FractionOfPricePerQuantityFactory.stub(
+            trigger_product=self.product_seq[0],
+            discounted_product=self.product_seq[1],
+        )
+
+        self.special_offer = FractionOfPricePerQuantityFactory.stub_to_obj(
+            self.stub,
+            self.product_seq[:2],
+        )
+
+    def test_same_quantities(self):
+        trigger_product, discounted_product, other_product = (
+            self.product_seq)
+
+        discount = self.special_offer.get_discount(
+            Counter({trigger_product: 2, discounted_product: 1}))
+
+        # Only the quantities of the special offer's products matter
+        other_discount = self.special_offer.get_discount(
+            Counter({
+                trigger_product: 2,
+                discounted_product: 1,
+                other_product: fake.random_int(min=1, max=8),
+            }))
+
+        self.assertIs(discount, other_discount)
+
+        self.assertIsNot(
+            discount,
+            self.special_offer.get_discount(
+                Counter({trigger_product: 1, discounted_product: 2})),
+        )
+        self.assertIsNot(
+            discount,
+            self.special_offer.get_discount_pence(
+                Counter({trigger_product: 2, discounted_product: 1})),
+        )
+
+        self.special_offer.clear_memo()
+
+        self.assertIsNot(
+            discount,
+            self.special_offer.get_discount(
+                Counter({trigger_product: 2, discounted_product: 1})),
+        )
+
+    @parameterized.expand([
+        ("decimal", False),
+        ("pence", True),
+    ])
+    def test_by_key(self, _, in_pence):
+        trigger_product, discounted_product, _ = self.product_seq
+
+        quantity_by_product = Counter({
+            trigger_product: 2,
+            discounted_product: 1,
+        })
+
+        if in_pence:
+            discount = self.special_offer.get_discount_pence(
+                quantity_by_product)
+        else:
+            discount = self.special_offer.get_discount(quantity_by_product)
+
+        # The same memo is used for a basket and for its memo key
+        self.assertIs(
+            discount,
+            self.special_offer._get_discount_by_key((2, 1), in_pence),
+        )
+
+    def test_bounded(self):
+        with patch.object(FractionOfPricePerQuantity, "_MEMO_SIZE", 4):
+            special_offer = FractionOfPricePerQuantityFactory.stub_to_obj(
+                self.stub,
+                self.product_seq[:2],
+            )
+
+        for quantity in range(16):
+            quantity_by_product = Counter(dict.fromkeys(
+                self.product_seq[:2],
+                quantity,
+            ))
+
+            self.assertEqual(
+                self.special_offer.get_discount_pence(
+                    quantity_by_product).value,
+                special_offer.get_discount_pence(quantity_by_product).value,
+            )
+            self.assertLessEqual(len(special_offer._memo_pence), 4)
+
+
 class TestFromJson(unittest.TestCase):
 
     def setUp(self):
@@ -341,11 +541,24 @@ class TestFromJson(unittest.TestCase):
                 elements=self.product_seq,
             )
 
+        def sample_products():
+            return fake.random_sample(self.product_seq, length=2)
+
+        class LocalMultiBuyFactory(MultiBuyFactory):
+            products = factory.LazyFunction(sample_products)
+
+        class LocalBundleFactory(BundleFactory):
+            products = factory.LazyFunction(sample_products)
+
         self.special_offer_factory_cls_by_type = {
             SpecialOfferType.FRACTION_OF_PRICE:
                 LocalFractionOfPriceFactory,
             SpecialOfferType.FRACTION_OF_PRICE_PER_QUANTITY:
                 LocalFractionOfPricePerQuantityFactory,
+            SpecialOfferType.MULTI_BUY:
+                LocalMultiBuyFactory,
+            SpecialOfferType.BUNDLE:
+                LocalBundleFactory,
         }
 
         self.special_offer_stub_seq_by_type = {
@@ -369,6 +582,10 @@ class TestFromJson(unittest.TestCase):
                     "trigger_product.product_id",
                     "discounted_product.product_id",
                 ),
+            SpecialOfferType.MULTI_BUY:
+                lambda s: tuple(p.product_id for p in s.products),
+            SpecialOfferType.BUNDLE:
+                lambda s: tuple(p.product_id for p in s.products),
         }
 
     def test_many(self):
@@ -382,8 +599,7 @@ class TestFromJson(unittest.TestCase):
 
         shuffle(data)
 
-        product_by_id = create_sparse_list(
-            ((p.product_id, p) for p in self.product_seq))
+        product_by_id = create_products_by_id(self.product_seq)
 
         with io.StringIO() as file_obj:
             special_offer_seq = list(map(itemgetter(2), data))
@@ -417,6 +633,48 @@ class TestFromJson(unittest.TestCase):
                 for s in special_offer_seq),
         )
 
+    @parameterized.expand([
+        ("repeated_product", "multi_buy", (0, 0), [], [3, 2]),
+        ("pay_too_much", "multi_buy", (0, 1), [], [2, 2]),
+        ("missing_quantity", "bundle", (0, 1), [[1]], ["1.00"]),
+        ("zero_quantity", "bundle", (0, 1), [[1, 0]], ["1.00"]),
+        ("negative_price", "bundle", (0, 1), [[1, 1]], ["-5"]),
+        ("zero_price", "bundle", (0, 1), [[1, 1]], ["0.00"]),
+        ("sub_penny_price", "bundle", (0, 1), [[1, 1]], ["0.005"]),
+        ("infinite_price", "bundle", (0, 1), [[1, 1]], ["Infinity"]),
+    ])
+    def test_invalid_rule(
+            self,
+            _,
+            special_offer_type,
+            product_ixs,
+            value_cols,
+            shared_values,
+    ):
+        product_by_id = create_products_by_id(self.product_seq)
+        product_matrix = [
+            [self.product_seq[ix].product_id for ix in product_ixs],
+            *value_cols,
+        ]
+
+        with io.StringIO() as file_obj:
+            json.dump(
+                [{
+                    "special_offer_type": special_offer_type,
+                    "product_matrix": product_matrix,
+                    "shared_values": shared_values,
+                }],
+                file_obj,
+            )
+            file_obj.seek(0)
+
+            with self.assertLogs("special_offer"):
+                with self.assertRaises(ValueError):
+                    tuple(get_special_offers_from_json(
+                        file_obj,
+                        product_by_id,
+                    ))
+
     def test_empty(self):
         with io.StringIO() as file_obj:
             json.dump([], file_obj)
@@ -428,3 +686,43 @@ class TestFromJson(unittest.TestCase):
             ))
 
         self.assertEqual((), special_offer_seq)
+
+
+class TestGetSpecialOffersByProduct(unittest.TestCase):
+
+    def test_success(self):
+        product_seq = tuple(map(
+            ProductFactory.stub_to_obj,
+            ProductFactory.stub_batch(3),
+        ))
+
+        special_offer_seq = (
+            FractionOfPrice(
+                (product_seq[0],),
+                (FractionOfPriceProduct(fraction_of_price=Decimal("0.5")),),
+            ),
+            FractionOfPricePerQuantity(
+                (product_seq[0], product_seq[1]),
+                (
+                    FractionOfPricePerQuantityProduct(quantity=2),
+                    FractionOfPricePerQuantityProduct(quantity=1),
+                ),
+                FractionOfPricePerQuantityShared(
+                    fraction_of_price=Decimal("0.5"),
+                ),
+            ),
+        )
+
+        expected = {
+            product_seq[0]: (
+                (0, special_offer_seq[0]),
+                (1, special_offer_seq[1]),
+            ),
+            product_seq[1]: (
+                (1, special_offer_seq[1]),
+            ),
+        }
+
+        actual = get_special_offers_by_product(special_offer_seq)
+
+        self.assertEqual(expected, actual)
@@ -0,0 +1,87 @@
+import pickle
+import unittest
+from collections import Counter
+from decimal import Decimal
+
+from factories import ProductFactory, fake
+from special_offer import FractionOfPrice, FractionOfPriceProduct
+from stats import OfferStats, PricingStats, collect_stats, get_active_stats
+
+
+class TestPricingStats(unittest.TestCase):
+
+    def setUp(self):
+        self.product = ProductFactory.stub_to_obj(ProductFactory.stub())
+
+        self.special_offers = tuple(
+            FractionOfPrice(
+                (self.product,),
+                (FractionOfPriceProduct(fraction_of_price=Decimal(f)),),
+            )
+            for f in ("0.5", "1"))
+
+    def test_get_discount(self):
+        stats = PricingStats()
+        quantity = fake.random_int(min=1, max=8)
+
+        for _ in range(quantity):
+            for position, special_offer in enumerate(self.special_offers):
+                discount = stats.get_discount(
+                    position,
+                    special_offer,
+                    Counter({self.product: 1}),
+                )
+
+                self.assertEqual(
+                    special_offer.get_discount(
+                        Counter({self.product: 1})).value,
+                    discount.value,
+                )
+
+        offer_stats, = stats.by_type.values()
+
+        self.assertEqual(quantity * 2, offer_stats.calls)
+        self.assertEqual(quantity, offer_stats.hits)
+
+        self.assertEqual(
+            [(0, quantity, quantity), (1, quantity, 0)],
+            [
+                (position, s.calls, s.hits)
+                for position, s in sorted(stats.by_position.items())],
+        )
+
+        report = stats.format_report(self.special_offers)
+        self.assertIn("#0 (fraction_of_price)", report)
+
+    def test_update(self):
+        stats = PricingStats()
+        stats.baskets = 1
+        stats.by_position[0] = OfferStats(1, 1, 0.5)
+
+        other_stats = PricingStats()
+        other_stats.baskets = 2
+        other_stats.by_position[0] = OfferStats(2, 0, 0.25)
+        other_stats.by_position[1] = OfferStats(3, 3, 1.0)
+
+        stats.update(pickle.loads(pickle.dumps(other_stats)))
+
+        self.assertEqual(3, stats.baskets)
+        self.assertEqual(
+            {0: (3, 1, 0.75), 1: (3, 3, 1.0)},
+            {
+                position: (s.calls, s.hits, s.seconds)
+                for position, s in stats.by_position.items()},
+        )
+
+    def test_collect_stats(self):
+        self.assertIsNone(get_active_stats())
+
+        with collect_stats() as stats:
+            self.assertIs(stats, get_active_stats())
+
+            with collect_stats() as inner_stats:
+                self.assertIs(inner_stats, get_active_stats())
+
+            self.assertIs(stats, get_active_stats())
+
+        self.assertIsNone(get_active_stats())
@@ -0,0 +1,173 @@
+import io
+import json
+import unittest
+from decimal import Decimal, ROUND_HALF_EVEN
+from random import randint
+
+from parameterized import parameterized
+
+from utils import (
+    format_currency_gbp,
+    format_many,
+    format_pence_gbp,
+    iter_json_array,
+)
+
+
+def reference_format_currency_gbp(dec):
+    """
+    The original, digit-based implementation of format_currency_gbp
+    """
+    quantized_dec = dec.quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+    sign, digits, exponent = quantized_dec.as_tuple()
+    left_digits = digits[:exponent]
+    right_digits = digits[exponent:]
+    lt_1 = all(d == 0 for d in left_digits)
+
+    return "".join((
+        ("", "-")[sign],
+        "" if lt_1 else "£",
+        "" if lt_1 else "".join(map(str, left_digits)),
+        "" if lt_1 else ".",
+        "".join(map(str, right_digits)).ljust(2, "0"),
+        "p" if lt_1 else "",
+    ))
+
+
+class TestFormatCurrencyGbp(unittest.TestCase):
+
+    @parameterized.expand([
+        ("1", "£1.00"),
+        ("1.2", "£1.20"),
+        ("1.23", "£1.23"),
+        ("1.234", "£1.23"),
+        ("1.235", "£1.24"),
+        ("1.225", "£1.22"),
+        ("0.2", "20p"),
+        ("0.23", "23p"),
+        ("0.234", "23p"),
+        ("0.235", "24p"),
+        ("-0.40", "-40p"),
+        ("-1.5", "-£1.50"),
+        ("1E+3", "£1000.00"),
+        ("0", "00p"),
+        ("-0", "-00p"),
+    ])
+    def test_success(self, dec_str, expected):
+        self.assertEqual(expected, format_currency_gbp(Decimal(dec_str)))
+
+    def test_matches_reference(self):
+        for _ in range(1000):
+            dec = Decimal(randint(-10 ** 6, 10 ** 6)).scaleb(-randint(0, 4))
+
+            self.assertEqual(
+                reference_format_currency_gbp(dec),
+                format_currency_gbp(dec),
+            )
+
+
+class TestFormatPenceGbp(unittest.TestCase):
+
+    def test_matches_format_currency_gbp(self):
+        for pence in range(-1000, 1000):
+            self.assertEqual(
+                format_currency_gbp(Decimal(pence).scaleb(-2)),
+                format_pence_gbp(pence),
+            )
+
+
+class TestFormatMany(unittest.TestCase):
+
+    def test_decimal(self):
+        decs = [Decimal("1.30"), Decimal("0.1"), Decimal("1.30")]
+        self.assertEqual(["£1.30", "10p", "£1.30"], format_many(decs))
+
+    def test_pence(self):
+        self.assertEqual(
+            ["£1.30", "-10p", "£1.30"],
+            format_many([130, -10, 130], in_pence=True),
+        )
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    @parameterized.expand([(1,), (2,), (7,), (64 * 1024,)])
+    def test_success(self, chunk_size):
+        obj_seq = [
+            {"product_id": 1, "name": "Soup", "price": "0.65"},
+            -1.5e10,
+            123,
+            "Br\u00f6d",
+            [],
+            {},
+            [True, False, None],
+        ]
+
+        for indent in (None, 2):
+            text = json.dumps(obj_seq, indent=indent)
+
+            self.assertEqual(
+                obj_seq,
+                list(iter_json_array(io.StringIO(text), chunk_size)),
+            )
+            self.assertEqual(
+                obj_seq,
+                list(iter_json_array(
+                    io.BytesIO(text.encode("utf-8")),
+                    chunk_size,
+                )),
+            )
+
+    @parameterized.expand([(1,), (2,), (3,)])
+    def test_multibyte(self, chunk_size):
+        obj_seq = [{"name": "Caf\u00e9 \u2615"}, "\U0001f34e", float("-inf")]
+        text = json.dumps(obj_seq, ensure_ascii=False)
+
+        self.assertEqual(
+            obj_seq,
+            list(iter_json_array(
+                io.BytesIO(text.encode("utf-8")),
+                chunk_size,
+            )),
+        )
+
+    def test_empty(self):
+        self.assertEqual([], list(iter_json_array(io.StringIO(" [ ] "))))
+
+    @parameterized.expand([
+        ("",),
+        ("{}",),
+        ("[",),
+        ("[1",),
+        ("[1,",),
+        ("[1,]",),
+        ("[,1]",),
+        ("[1 2]",),
+        ("[1.]",),
+        ("[1] 2",),
+    ])
+    def test_invalid(self, text):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO(text), 1))
+
+    def test_invalid_fails_fast(self):
+        file_obj = io.StringIO("[1, x, " + "2, " * 100000 + "3]")
+
+        with self.assertRaises(ValueError):
+            list(iter_json_array(file_obj, 16))
+
+        # The rest of the file isn't read after the bad data
+        self.assertLess(file_obj.tell(), 64)
+
+    def test_incremental(self):
+        file_obj = io.StringIO('[1, 2, [')
+
+        obj_iter = iter_json_array(file_obj, 1)
+
+        # Elements are yielded before the bad data is reached
+        self.assertEqual(1, next(obj_iter))
+        self.assertEqual(2, next(obj_iter))
+
+        with self.assertRaises(ValueError):
+            next(obj_iter)
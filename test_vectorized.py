@@ -0,0 +1,175 @@
+import unittest
+from collections import Counter
+from decimal import Decimal
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+import vectorized
+from factories import (
+    BasketsTestCaseMixin,
+    FractionOfPriceFactory,
+    FractionOfPricePerQuantityFactory,
+    MultiBuyFactory,
+    ProductFactory,
+    fake,
+)
+from price_basket import price_baskets
+from vectorized import VectorizedSpecialOffers
+
+
+class TestVectorizedSpecialOffers(BasketsTestCaseMixin, unittest.TestCase):
+
+    num_fraction_of_price = 8
+    num_per_quantity = 8
+    max_quantity = 20
+    max_num_basket_products = 6
+
+    def setUp(self):
+        super().setUp()
+
+        special_offer_seq = list(self.special_offers)
+        fake.random.shuffle(special_offer_seq)
+        self.special_offers = tuple(special_offer_seq)
+
+    def assertResultsEqual(self, expected, actual):
+        self.assertEqual(
+            [
+                (t, tuple((d.value, d.special_offer) for d in ds))
+                for t, ds in expected],
+            [
+                (t, tuple((d.value, d.special_offer) for d in ds))
+                for t, ds in actual],
+        )
+
+    @parameterized.expand([
+        ("numpy", vectorized.numpy),
+        ("python", None),
+    ])
+    def test_price_baskets(self, _, numpy):
+        if vectorized.numpy is None and numpy is not None:
+            self.skipTest("NumPy is not installed")
+
+        with patch("vectorized.numpy", numpy):
+            vectorized_special_offers = VectorizedSpecialOffers(
+                self.special_offers,
+            )
+
+            actual = vectorized_special_offers.price_baskets(self.baskets)
+
+        expected = price_baskets(
+            self.baskets,
+            self.special_offers,
+            in_pence=True,
+        )
+
+        self.assertResultsEqual(expected, actual)
+
+    @unittest.skipIf(vectorized.numpy is None, "NumPy is not installed")
+    def test_get_discount_values(self):
+        vectorized_special_offers = VectorizedSpecialOffers(
+            self.special_offers,
+        )
+
+        actual = vectorized_special_offers.get_discount_values(self.baskets)
+
+        self.assertEqual(
+            (len(self.baskets), len(self.special_offers)),
+            actual.shape,
+        )
+        self.assertEqual(
+            [
+                [o.get_discount_pence(b).value for o in self.special_offers]
+                for b in self.baskets],
+            actual.tolist(),
+        )
+
+    @unittest.skipIf(vectorized.numpy is None, "NumPy is not installed")
+    def test_chunks(self):
+        vectorized_special_offers = VectorizedSpecialOffers(
+            self.special_offers,
+        )
+
+        expected = vectorized_special_offers.price_baskets(self.baskets)
+
+        with patch.object(
+            VectorizedSpecialOffers,
+            "_MAX_MATRIX_SIZE",
+            len(self.special_offers) * 3,
+        ):
+            actual = vectorized_special_offers.price_baskets(self.baskets)
+
+        self.assertResultsEqual(expected, actual)
+
+    def test_empty(self):
+        vectorized_special_offers = VectorizedSpecialOffers(())
+
+        self.assertEqual(
+            [(0, ())],
+            vectorized_special_offers.price_baskets([Counter()]),
+        )
+
+    @unittest.skipIf(vectorized.numpy is None, "NumPy is not installed")
+    def test_zero_trigger_quota(self):
+        special_offer = FractionOfPricePerQuantityFactory.stub_to_obj(
+            FractionOfPricePerQuantityFactory.stub(
+                trigger_product_quantity=0,
+            ),
+            self.product_seq[:2],
+        )
+        basket = Counter({p: 3 for p in self.product_seq[:2]})
+
+        self.assertEqual(
+            [[0]],
+            VectorizedSpecialOffers((special_offer,)).get_discount_values(
+                [basket],
+            ).tolist(),
+        )
+        self.assertEqual(0, special_offer.get_discount_pence(basket).value)
+
+    @parameterized.expand([
+        ("many_decimal_places", "0.333333333333", "100.00", 10 ** 6),
+        ("large_price_and_quantity", "0.5", "1000000.00", 10 ** 12),
+    ])
+    @unittest.skipIf(vectorized.numpy is None, "NumPy is not installed")
+    def test_overflow(self, _, fraction_of_price, price, quantity):
+        product = ProductFactory.stub_to_obj(
+            ProductFactory.stub(price=Decimal(price)),
+        )
+        special_offers = (
+            FractionOfPriceFactory.stub_to_obj(
+                FractionOfPriceFactory.stub(
+                    fraction_of_price=Decimal(fraction_of_price),
+                ),
+                (product,),
+            ),
+            FractionOfPricePerQuantityFactory.stub_to_obj(
+                FractionOfPricePerQuantityFactory.stub(
+                    trigger_product_quantity=1,
+                    discounted_product_quantity=1,
+                    fraction_of_price=Decimal(fraction_of_price),
+                ),
+                (product, product),
+            ),
+        )
+        baskets = [Counter({product: 1}), Counter({product: quantity})]
+
+        actual = VectorizedSpecialOffers(
+            special_offers,
+        ).get_discount_values(baskets)
+
+        self.assertEqual(
+            [
+                [o.get_discount_pence(b).value for o in special_offers]
+                for b in baskets],
+            actual.tolist(),
+        )
+
+    def test_unsupported_type(self):
+        special_offer = MultiBuyFactory.stub_to_obj(
+            MultiBuyFactory.stub(),
+            self.product_seq[:2],
+        )
+
+        with self.assertRaises(TypeError):
+            VectorizedSpecialOffers((special_offer,))
@@ -1,11 +1,41 @@
+import codecs
+import json
+import re
 from decimal import Decimal, ROUND_HALF_EVEN
-from math import log10
+from functools import lru_cache
+
+from money import PENCE_PER_POUND
 
-_INT_ZERO = 0
 _GBP_SMALLEST_DENOMINATION = Decimal("0.01")
-_GBP_DECIMAL_PLACES = abs(int(log10(_GBP_SMALLEST_DENOMINATION)))
 
-_format_base_10 = "{:d}".format
+# Enough for the distinct amounts on a typical run of bills
+_FORMAT_CACHE_SIZE = 4096
+
+_JSON_CHUNK_SIZE = 64 * 1024
+_JSON_WHITESPACE = " \t\n\r"
+
+# A value cut off by the end of a chunk can fail to parse up to this
+# many characters before the end of the buffer (e.g. "-Infin" of
+# "-Infinity", or "\u00" of an escape in a string)
+_JSON_MAX_CUT_LEN = len("-Infinity")
+
+_match_json_whitespace = re.compile(f"[{_JSON_WHITESPACE}]*").match
+_match_json_separator = re.compile(
+    f"[{_JSON_WHITESPACE}]*([,\\]])[{_JSON_WHITESPACE}]*").match
+
+
+@lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_pence(pence, is_signed):
+    pounds, pence = divmod(abs(pence), PENCE_PER_POUND)
+    sign_str = "-" if is_signed else ""
+
+    if pounds:
+        return f"{sign_str}£{pounds}.{pence:02d}"
+
+    # Less than £1 is shown in pence. This pads on the right, e.g. 5p
+    # is shown as "50p", for compatibility with the original Decimal
+    # digit-based implementation
+    return f"{sign_str}{str(pence).ljust(2, '0')}p"
 
 
 def format_currency_gbp(dec):
@@ -28,34 +58,167 @@ def format_currency_gbp(dec):
         rounding=ROUND_HALF_EVEN,
     )
 
-    sign, digits, exponent = quantized_dec.as_tuple()
-    sign_str = ("", "-")[sign]
-
-    left_digits = digits[:exponent]
-    right_digits = digits[exponent:]
-
-    lt_1 = all(map(_INT_ZERO.__eq__, left_digits))
-
-    currency_prefix_str = "" if lt_1 else "£"
-    decimal_point_str = "" if lt_1 else "."
-    currency_suffix_str = "p" if lt_1 else ""
-
-    left_digits_str = "" if lt_1 else "".join(map(
-        _format_base_10,
-        left_digits,
-    ))
-
-    right_digits_str = (
-        "".join(map(_format_base_10, right_digits)).ljust(
-            _GBP_DECIMAL_PLACES,
-            "0",
-        ))
-
-    return "".join((
-        sign_str,
-        currency_prefix_str,
-        left_digits_str,
-        decimal_point_str,
-        right_digits_str,
-        currency_suffix_str,
-    ))
+    # The sign is kept separately, so that negative zero is shown as
+    # "-00p", as it was originally
+    return _format_pence(
+        int(quantized_dec.scaleb(2)),
+        quantized_dec.is_signed(),
+    )
+
+
+def format_pence_gbp(pence):
+    """
+    The same as format_currency_gbp, except it takes an integer amount
+    in pence. Examples:
+
+    100 => £1.00
+    123 => £1.23
+    23 => 23p
+    """
+    return _format_pence(pence, pence < 0)
+
+
+def format_many(amounts, in_pence=False):
+    """
+    Format a column of amounts, returning a list of strings. The amounts
+    are integers in pence if in_pence is true, otherwise Decimal objects.
+    """
+    if in_pence:
+        return [_format_pence(pence, pence < 0) for pence in amounts]
+
+    return list(map(format_currency_gbp, amounts))
+
+
+class _JsonArrayReader:
+    """
+    Buffer for iter_json_array. Text is read from the file object in
+    chunks, and the buffer is trimmed as elements are consumed.
+    """
+
+    def __init__(self, file_obj, chunk_size):
+        self._file_obj = file_obj
+        self._chunk_size = chunk_size
+        self._bytes_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read(self):
+        """
+        Append the next chunk to the buffer. Returns False at EOF.
+        """
+        if self.eof:
+            return False
+
+        raw_chunk = self._file_obj.read(self._chunk_size)
+
+        # A chunk of bytes can end part way through a character, so EOF
+        # is detected from the bytes rather than the decoded text
+        if isinstance(raw_chunk, bytes):
+            chunk = self._bytes_decoder.decode(raw_chunk, final=not raw_chunk)
+        else:
+            chunk = raw_chunk
+
+        if not raw_chunk:
+            # The buffer is left as it is, so positions in it are still
+            # valid
+            self.eof = True
+            return False
+
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        """
+        Skip whitespace, and return the next character ("" at EOF)
+        """
+        while True:
+            pos = self.pos = _match_json_whitespace(self.text, self.pos).end()
+
+            if pos < len(self.text) or not self.read():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.skip_whitespace()
+
+        if char == "" or char not in chars:
+            raise json.JSONDecodeError(
+                f"Expecting one of {chars!r}",
+                self.text,
+                self.pos,
+            )
+
+        self.pos += 1
+        return char
+
+
+def _is_cut_off(exc, text):
+    """
+    Whether the JSONDecodeError exc, from parsing text, may be because
+    the value is cut off by the end of text
+    """
+    return (
+        exc.pos >= len(text) - _JSON_MAX_CUT_LEN or
+        exc.msg == "Unterminated string starting at"
+    )
+
+
+def iter_json_array(file_obj, chunk_size=_JSON_CHUNK_SIZE):
+    """
+    Parse a JSON array from a file object (text or binary, UTF-8),
+    yielding one element at a time. Unlike json.load, only the element
+    being parsed (and one chunk of the file) is held in memory.
+
+    Raises json.JSONDecodeError (a ValueError) if the file is not a JSON
+    array, but only when the parser reaches the bad data.
+    """
+    raw_decode = json.JSONDecoder().raw_decode
+    reader = _JsonArrayReader(file_obj, chunk_size)
+
+    reader.expect("[")
+
+    if reader.skip_whitespace() == "]":
+        reader.pos += 1
+    else:
+        reader.skip_whitespace()
+
+        while True:
+            text = reader.text
+
+            try:
+                value, end = raw_decode(text, reader.pos)
+            except json.JSONDecodeError as exc:
+                # The element may continue in the next chunk, but only if
+                # it was cut off by the end of the buffer, so that bad
+                # data fails without reading the rest of the file
+                if _is_cut_off(exc, text) and reader.read():
+                    continue
+                raise
+
+            separator_match = _match_json_separator(text, end)
+
+            # The element, or the separator after it, may continue in
+            # the next chunk (e.g. "1" of "1.5"), unless the separator
+            # is followed by more data
+            if (
+                    separator_match is None or
+                    separator_match.end() == len(text)
+            ) and reader.read():
+                continue
+
+            if separator_match is None:
+                raise json.JSONDecodeError(
+                    "Expecting ',' or ']'",
+                    text,
+                    end,
+                )
+
+            reader.pos = separator_match.end()
+            yield value
+
+            if separator_match.group(1) == "]":
+                break
+
+    if reader.skip_whitespace() != "":
+        raise json.JSONDecodeError("Extra data", reader.text, reader.pos)
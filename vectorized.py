@@ -0,0 +1,391 @@
+"""
+vectorized.py
+===
+
+Evaluate every special offer of a type at once, with NumPy.
+
+The special offers of each type only differ by their parameters, so the
+parameters are packed into arrays (one element per special offer), and
+the baskets into a quantity matrix (one row per basket, one column per
+product referenced by a special offer). Each type's discounts are then
+calculated for a whole batch of baskets in a few array operations.
+
+NumPy arrays can't hold Decimal values exactly, so the discounts are
+calculated with integer (pence) arithmetic, and are identical to those
+of SpecialOffer.get_discount_pence (see money.py for the rounding rule).
+
+NumPy is optional: if it is not installed, each special offer is
+evaluated in Python instead (the reference implementation).
+"""
+
+from money import to_ratio
+from special_offer import (
+    Discount,
+    FractionOfPrice,
+    FractionOfPricePerQuantity,
+)
+from utils import format_pence_gbp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _multiply_pence(pence, numerator, denominator):
+    """
+    Vectorized money.multiply_pence
+    """
+    quotient, remainder = numpy.divmod(pence * numerator, denominator)
+    twice_remainder = remainder * 2
+
+    quotient += (
+        (twice_remainder > denominator) |
+        ((twice_remainder == denominator) & (quotient % 2 == 1)))
+
+    return quotient
+
+
+def _get_bound(price_pence, numerator, denominator, discounted_quota=0):
+    """
+    Get the largest factor that a quantity is multiplied by when a
+    special offer is evaluated, or None if the special offer can't be
+    evaluated in int64 arithmetic at all (e.g. a fraction of price with
+    many decimal places)
+    """
+    bound = max(
+        abs(price_pence) * max(abs(numerator), 1),
+        abs(discounted_quota),
+    )
+
+    # multiply_pence doubles the remainder, which is below the
+    # denominator
+    if bound > _INT64_MAX or denominator * 2 > _INT64_MAX:
+        return None
+
+    return bound
+
+
+class VectorizedSpecialOffers:
+    """
+    Special offers packed into arrays by type, for evaluating against
+    many baskets at once
+
+    Every method gives the same discounts as calling get_discount_pence
+    on each special offer.
+
+    Every special offer is evaluated against every basket, so this
+    suits batches of baskets against a moderate number of special
+    offers. For a few special offers per basket, the index of
+    get_special_offers_by_product is faster.
+    """
+
+    # Largest number of elements in a values matrix in price_baskets
+    _MAX_MATRIX_SIZE = 2 ** 22
+
+    def __init__(self, special_offers):
+        self._special_offers = tuple(special_offers)
+
+        # Columns of the quantity matrix, by product
+        self._column_by_product = {}
+
+        fraction_of_price_rows = []
+        per_quantity_rows = []
+
+        # Positions of the special offers that are always evaluated in
+        # Python, as int64 arithmetic would overflow
+        self._python_positions = []
+
+        for position, special_offer in enumerate(self._special_offers):
+            # Other types (e.g. MultiBuy) have no fraction of price
+            if not isinstance(
+                    special_offer,
+                    (FractionOfPrice, FractionOfPricePerQuantity),
+            ):
+                raise TypeError(
+                    f"Special offer type is not supported: "
+                    f"{special_offer.SPECIAL_OFFER_TYPE!r}")
+
+            numerator, denominator = to_ratio(
+                1 - special_offer.fraction_of_price,
+            )
+
+            discounted_column = self._get_column(
+                special_offer.discounted_product,
+            )
+            price_pence = special_offer.discounted_product.price_pence
+
+            if isinstance(special_offer, FractionOfPricePerQuantity):
+                trigger_quota = special_offer.trigger_product_quantity
+                discounted_quota = special_offer.discounted_product_quantity
+                bound = _get_bound(
+                    price_pence,
+                    numerator,
+                    denominator,
+                    discounted_quota,
+                )
+
+                if bound is None or abs(trigger_quota) > _INT64_MAX:
+                    self._python_positions.append(position)
+                    continue
+
+                per_quantity_rows.append((
+                    position,
+                    self._get_column(special_offer.trigger_product),
+                    trigger_quota,
+                    discounted_column,
+                    discounted_quota,
+                    price_pence,
+                    numerator,
+                    denominator,
+                    bound,
+                ))
+            else:
+                bound = _get_bound(price_pence, numerator, denominator)
+
+                if bound is None:
+                    self._python_positions.append(position)
+                    continue
+
+                fraction_of_price_rows.append((
+                    position,
+                    discounted_column,
+                    price_pence,
+                    numerator,
+                    denominator,
+                    bound,
+                ))
+
+        if numpy is not None:
+            self._fraction_of_price_arrays = self._to_arrays(
+                fraction_of_price_rows,
+                6,
+            )
+            self._per_quantity_arrays = self._to_arrays(
+                per_quantity_rows,
+                9,
+            )
+
+    def __repr__(self):
+        return (
+            f"VectorizedSpecialOffers("
+            f"len={len(self._special_offers)!r}, "
+            f"numpy={numpy is not None!r})")
+
+    def __len__(self):
+        return len(self._special_offers)
+
+    def _get_column(self, product):
+        return self._column_by_product.setdefault(
+            product,
+            len(self._column_by_product),
+        )
+
+    @staticmethod
+    def _to_arrays(rows, num_cols):
+        """
+        Transpose rows of parameters into one int64 array per parameter
+        """
+        if not rows:
+            return tuple(
+                numpy.empty(0, dtype=numpy.int64)
+                for _ in range(num_cols))
+
+        return tuple(numpy.array(rows, dtype=numpy.int64).T)
+
+    def get_quantity_matrix(self, baskets):
+        """
+        Get a matrix of quantities, with one row per basket and one
+        column per product referenced by a special offer (other products
+        are left out, as they don't affect the discounts)
+        """
+        column_by_product = self._column_by_product
+
+        matrix = numpy.zeros(
+            (len(baskets), len(column_by_product)),
+            dtype=numpy.int64,
+        )
+
+        for row, quantity_by_product in enumerate(baskets):
+            for product, quantity in quantity_by_product.items():
+                column = column_by_product.get(product)
+
+                if column is not None:
+                    matrix[row, column] = quantity
+
+        return matrix
+
+    def _get_discount_values_numpy(self, quantity_matrix):
+        values = numpy.zeros(
+            (len(quantity_matrix), len(self._special_offers)),
+            dtype=numpy.int64,
+        )
+
+        (positions,
+         discounted_columns,
+         price_pence,
+         numerators,
+         denominators,
+         _) = self._fraction_of_price_arrays
+
+        values[:, positions] = _multiply_pence(
+            quantity_matrix[:, discounted_columns] * price_pence,
+            numerators,
+            denominators,
+        )
+
+        (positions,
+         trigger_columns,
+         trigger_quotas,
+         discounted_columns,
+         discounted_quotas,
+         price_pence,
+         numerators,
+         denominators,
+         _) = self._per_quantity_arrays
+
+        trigger_quantities = quantity_matrix[:, trigger_columns]
+        is_quota_positive = trigger_quotas > 0
+
+        # A quota that is not positive is bad data, and never applies (as
+        # in offer_rule.compile_rule)
+        max_num_discountable = numpy.where(
+            (trigger_quantities > 0) & is_quota_positive,
+            (
+                (trigger_quantities //
+                 numpy.where(is_quota_positive, trigger_quotas, 1)) *
+                discounted_quotas),
+            0,
+        )
+        num_discountable = numpy.minimum(
+            max_num_discountable,
+            quantity_matrix[:, discounted_columns],
+        )
+
+        values[:, positions] = _multiply_pence(
+            num_discountable * price_pence,
+            numerators,
+            denominators,
+        )
+
+        return values
+
+    def _get_python_positions(self, quantity_matrix):
+        """
+        Get the positions of the special offers whose discounts could
+        overflow int64 for the quantities in quantity_matrix
+        """
+        max_quantity = int(numpy.abs(quantity_matrix).max(initial=0))
+        max_bound = _INT64_MAX // max(max_quantity, 1)
+
+        positions = list(self._python_positions)
+
+        for arrays in (
+                self._fraction_of_price_arrays,
+                self._per_quantity_arrays,
+        ):
+            bounds = arrays[-1]
+            positions.extend(arrays[0][bounds > max_bound].tolist())
+
+        return positions
+
+    def get_discount_values(self, baskets):
+        """
+        Get the value (in pence) of every special offer's discount for
+        each basket, as a matrix with one row per basket and one column
+        per special offer (in their original order)
+
+        Special offers whose discounts could overflow int64 (e.g. a
+        fraction of price with many decimal places, or a large price and
+        quantity) are evaluated in Python instead. If a discount doesn't
+        fit in int64, the matrix has dtype object.
+
+        Without NumPy, a list of lists is returned instead.
+        """
+        if numpy is None:
+            return [
+                [
+                    special_offer.get_discount_pence(basket).value
+                    for special_offer in self._special_offers]
+                for basket in baskets]
+
+        quantity_matrix = self.get_quantity_matrix(baskets)
+        values = self._get_discount_values_numpy(quantity_matrix)
+
+        # Replace the values that could have overflowed with those of the
+        # reference implementation
+        for position in self._get_python_positions(quantity_matrix):
+            special_offer = self._special_offers[position]
+            column = [
+                special_offer.get_discount_pence(basket).value
+                for basket in baskets]
+
+            if values.dtype != object and any(
+                    abs(value) > _INT64_MAX for value in column):
+                values = values.astype(object)
+
+            values[:, position] = column
+
+        return values
+
+    def _get_hit_positions(self, baskets):
+        """
+        Yield (basket, values, positions) for each basket, where
+        positions are those of the special offers with a positive
+        discount
+        """
+        if numpy is None:
+            for basket, values in zip(
+                baskets,
+                self.get_discount_values(baskets),
+            ):
+                yield basket, values, [
+                    position
+                    for position, value in enumerate(values)
+                    if value > 0]
+
+            return
+
+        # Limit the size of the values matrix
+        chunk_size = max(
+            1,
+            self._MAX_MATRIX_SIZE // max(1, len(self._special_offers)),
+        )
+
+        for start in range(0, len(baskets), chunk_size):
+            chunk = baskets[start:start + chunk_size]
+            values_matrix = self.get_discount_values(chunk)
+
+            for basket, values in zip(chunk, values_matrix):
+                yield basket, values, numpy.flatnonzero(values > 0)
+
+    def price_baskets(self, baskets):
+        """
+        The same as price_basket.price_baskets with in_pence=True: a list
+        of (original_total, discounts) pairs, in basket order
+        """
+        special_offers = self._special_offers
+        results = []
+
+        for basket, values, positions in self._get_hit_positions(
+            list(baskets),
+        ):
+            original_total = sum(
+                quantity * product.price_pence
+                for product, quantity in basket.items())
+
+            discounts = tuple(
+                Discount._make((
+                    int(values[position]),
+                    None,
+                    special_offers[position],
+                    format_pence_gbp,
+                ))
+                for position in positions)
+
+            results.append((original_total, discounts))
+
+        return results